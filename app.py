@@ -5,7 +5,6 @@ Sistema de processamento em lote de Notas Fiscais de Serviço Eletrônica
 através da API oficial do Gov.br.
 """
 import streamlit as st
-import asyncio
 from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Any
@@ -19,6 +18,7 @@ from src.api.nfse_service import get_nfse_service
 from src.database.repository import NFSeRepository, LogRepository
 from src.models.schemas import ProcessingResult
 from src.utils.logger import app_logger
+from src.utils.runtime import run_sync
 from src.utils.certificate import get_certificate_manager
 
 
@@ -155,7 +155,7 @@ def render_home():
     repo = NFSeRepository()
     
     try:
-        stats = asyncio.run(repo.get_estatisticas(dias=30))
+        stats = run_sync(repo.get_estatisticas(dias=30))
         
         with col1:
             st.metric("Total de Emissões (30d)", stats['total_emissoes'])
@@ -180,7 +180,7 @@ def render_home():
     
     with st.spinner("Verificando disponibilidade da API..."):
         service = get_nfse_service()
-        api_available = asyncio.run(service.consultar_status_api())
+        api_available = run_sync(service.consultar_status_api())
         
         if api_available:
             st.success("✅ API Nacional NFS-e está **ONLINE** e disponível")
@@ -346,7 +346,7 @@ def process_batch(records: List[Dict], config: Dict, filename: str):
     
     # Cria log
     log_repo = LogRepository()
-    batch_id = asyncio.run(log_repo.create_log(len(records), filename, st.session_state.username))
+    batch_id = run_sync(log_repo.create_log(len(records), filename, st.session_state.username))
     
     # Barra de progresso
     progress_bar = st.progress(0)
@@ -362,7 +362,7 @@ def process_batch(records: List[Dict], config: Dict, filename: str):
     service = get_nfse_service()
     
     with st.spinner("Emitindo NFS-e..."):
-        results = asyncio.run(
+        results = run_sync(
             service.emitir_nfse_lote(
                 records,
                 config,
@@ -372,12 +372,12 @@ def process_batch(records: List[Dict], config: Dict, filename: str):
     
     # Salva resultados
     nfse_repo = NFSeRepository()
-    asyncio.run(nfse_repo.save_batch_results(results, st.session_state.username))
+    run_sync(nfse_repo.save_batch_results(results, st.session_state.username))
     
     # Atualiza log
     sucessos = sum(1 for r in results if r.status == 'sucesso')
     erros = len(results) - sucessos
-    asyncio.run(log_repo.update_log(batch_id, sucessos, erros))
+    run_sync(log_repo.update_log(batch_id, sucessos, erros))
     
     # Exibe resultados
     st.markdown("### ✅ Processamento Concluído")
@@ -489,7 +489,7 @@ def main():
     
     # Inicializa banco de dados (primeira vez)
     try:
-        asyncio.run(init_database())
+        run_sync(init_database())
     except Exception as e:
         app_logger.warning(f"Aviso ao inicializar BD: {e}")
     
@@ -3,17 +3,16 @@ Dashboard Streamlit APRIMORADO para Emissão de NFS-e Nacional.
 Agora com funcionalidade de download de XML e PDF!
 """
 import streamlit as st
-import asyncio
 from pathlib import Path
 from datetime import datetime
 import pytz
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import sys
 import os
 import base64
 from io import BytesIO
 import json
-import zipfile
+import time
 
 # Adiciona diretório raiz ao path
 sys.path.insert(0, str(Path(__file__).parent))
@@ -24,10 +23,16 @@ from config.database import init_database
 from src.auth.authentication import auth_manager
 from src.pdf.extractor import pdf_extractor
 from src.api.nfse_service import get_nfse_service
-from src.database.repository import NFSeRepository, LogRepository
+from src.api.job_worker import get_emission_worker, montar_payload
+from src.database.repository import NFSeRepository, LogRepository, JobRepository
 from src.models.schemas import ProcessingResult, PrestadorServico, TomadorServico, Servico
 from src.utils.logger import app_logger
+from src.utils.runtime import run_sync
 from src.utils.certificate import get_certificate_manager
+from src.storage.export import exportar_zip
+from src.storage.competencias import get_exportador_competencias
+from src.storage.journal import get_nfse_journal
+from src.database.write_behind import get_gravador_nfse, sincronizar_diario
 
 # Import das funções de emissão completa
 from emitir_nfse_completo import emitir_nfse_com_pdf
@@ -48,10 +53,10 @@ st.set_page_config(
 # Diretório de dados persistentes (Railway ou local) - para arquivos PDF/XML
 DATA_DIR = Path(os.getenv('RAILWAY_VOLUME_MOUNT_PATH', './data'))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
-PERSISTENCE_FILE = DATA_DIR / "nfse_emitidas.json"  # Backup local
 
 # Instância do repositório
 nfse_repository = NFSeRepository()
+job_repository = JobRepository()
 
 # Verificar se o método delete_all_nfse existe
 if hasattr(nfse_repository, 'delete_all_nfse'):
@@ -70,7 +75,7 @@ async def delete_all_nfse_direct() -> int:
     Função standalone que não depende do cache do repositório.
     """
     from sqlalchemy import select, func, delete
-    from src.database.models import NFSeEmissao
+    from src.database.models import NFSeEmissao, NFSeResumoDiario
     from config.database import get_db_session
     
     try:
@@ -86,6 +91,7 @@ async def delete_all_nfse_direct() -> int:
                 # Remove todos os registros
                 stmt_delete = delete(NFSeEmissao)
                 await session.execute(stmt_delete)
+                await session.execute(delete(NFSeResumoDiario))
                 
                 app_logger.info(f"✅ Banco de dados limpo: {total} NFS-e removidas")
                 return total
@@ -102,30 +108,42 @@ def ensure_db_initialized():
     global _db_initialized
     if not _db_initialized:
         try:
-            asyncio.run(init_database())
+            run_sync(init_database())
             app_logger.info("Banco de dados PostgreSQL inicializado")
             _db_initialized = True
         except Exception as e:
             app_logger.warning(f"Aviso na inicialização do banco: {e}")
             _db_initialized = True  # Marcar como tentado para não repetir
 
-def save_emitted_nfse():
-    """Salva as NFS-e emitidas no PostgreSQL."""
+def _ao_gravar_nfse(notas: List[Dict[str, Any]]):
+    """Após cada grupo gravado no banco: atualiza os ZIPs mensais."""
+    if settings.EXPORT_COMPETENCIAS_ENABLED:
+        get_exportador_competencias().notificar()
+
+
+def save_emitted_nfse(novas: List[Dict[str, Any]], gravar_no_banco: bool = True):
+    """
+    Persiste notas recém-emitidas.
+    
+    Acrescenta as notas ao diário local (custo constante por nota) e as
+    agenda para gravação em grupo no PostgreSQL (write-behind).
+    
+    Args:
+        novas: Notas no formato da sessão
+        gravar_no_banco: False para notas que já estão no banco (ex.: lote
+            emitido pelo worker, que grava cada nota ao concluir o job)
+    """
     try:
-        # Salvar backup em JSON local também
-        PERSISTENCE_FILE.parent.mkdir(parents=True, exist_ok=True)
-        with open(PERSISTENCE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(st.session_state.emitted_nfse, f, ensure_ascii=False, indent=2, default=str)
-        
-        # Garantir que o banco está inicializado antes de salvar
-        ensure_db_initialized()
+        get_nfse_journal().append(novas)
         
-        # Salvar no PostgreSQL (última nota adicionada)
-        if st.session_state.emitted_nfse:
-            last_nfse = st.session_state.emitted_nfse[-1]
-            asyncio.run(nfse_repository.save_nfse(last_nfse))
+        if gravar_no_banco:
+            # Garantir que o banco está inicializado antes de salvar
+            ensure_db_initialized()
+            get_gravador_nfse(_ao_gravar_nfse).enfileirar(novas)
+        else:
+            _ao_gravar_nfse(novas)
         
-        app_logger.info(f"Notas salvas: {len(st.session_state.emitted_nfse)} registros")
+        app_logger.info(f"Notas salvas: {len(novas)} nova(s), {len(st.session_state.emitted_nfse)} na sessão")
     except Exception as e:
         app_logger.error(f"Erro ao salvar notas: {e}")
 
@@ -133,31 +151,27 @@ def load_emitted_nfse():
     """Carrega as NFS-e emitidas do PostgreSQL."""
     try:
         # Tentar carregar do PostgreSQL primeiro
-        nfse_list = asyncio.run(nfse_repository.get_all_nfse())
+        nfse_list = run_sync(nfse_repository.get_all_nfse())
         if nfse_list:
             app_logger.info(f"Notas carregadas do PostgreSQL: {len(nfse_list)} registros")
             return nfse_list
         
-        # Fallback para arquivo JSON local
-        if PERSISTENCE_FILE.exists():
-            with open(PERSISTENCE_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                app_logger.info(f"Notas carregadas do JSON: {len(data)} registros")
-                return data
+        # Fallback para o diário local
+        data = get_nfse_journal().ler()
+        if data:
+            app_logger.info(f"Notas carregadas do diário local: {len(data)} registros")
+            return data
     except Exception as e:
         app_logger.error(f"Erro ao carregar notas: {e}")
     
     return []
 
 def sync_json_to_db():
-    """Sincroniza notas do JSON local para o PostgreSQL."""
+    """Envia ao PostgreSQL as notas do diário local ainda não sincronizadas."""
     try:
-        if PERSISTENCE_FILE.exists():
-            with open(PERSISTENCE_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if data:
-                    asyncio.run(nfse_repository.save_batch_nfse(data))
-                    app_logger.info(f"Sincronizado {len(data)} notas do JSON para PostgreSQL")
+        enviadas = run_sync(sincronizar_diario(get_nfse_journal(), nfse_repository))
+        if enviadas:
+            app_logger.info(f"Sincronizado {enviadas} notas do diário local para PostgreSQL")
     except Exception as e:
         app_logger.error(f"Erro ao sincronizar notas: {e}")
 
@@ -269,11 +283,19 @@ def render_overview():
     # Métricas
     col1, col2, col3, col4 = st.columns(4)
     
+    # Totais do resumo diário no banco (não percorre as notas)
+    try:
+        stats = run_sync(nfse_repository.get_estatisticas(dias=None))
+        total_emitidas, total_valor = stats['sucessos'], stats['valor_total']
+    except Exception as e:
+        app_logger.warning(f"Erro ao buscar estatísticas: {e}")
+        total_emitidas = len(st.session_state.emitted_nfse)
+        total_valor = sum(nfse.get('valor', 0) for nfse in st.session_state.emitted_nfse)
+    
     with col1:
-        st.metric("NFS-e Emitidas", len(st.session_state.emitted_nfse))
+        st.metric("NFS-e Emitidas", total_emitidas)
     
     with col2:
-        total_valor = sum([nfse.get('valor', 0) for nfse in st.session_state.emitted_nfse])
         st.metric("Valor Total", f"R$ {total_valor:,.2f}")
     
     with col3:
@@ -494,16 +516,21 @@ def render_single_emission():
             # Emitir NFS-e
             with st.spinner("⏳ Emitindo NFS-e... Por favor aguarde..."):
                 try:
-                    resultado = asyncio.run(emitir_nfse_com_pdf(prestador, tomador, servico))
+                    # Com o hash do paciente, reenviar o formulário não emite a nota de novo
+                    hash_transacao = (hash_paciente or '').strip() or None
+                    resultado = run_sync(emitir_nfse_com_pdf(prestador, tomador, servico, hash_transacao=hash_transacao))
                     
                     if resultado['sucesso']:
                         st.success("✅ NFS-e emitida com sucesso!")
+                        if resultado.get('reconciliado'):
+                            st.info("ℹ️ Este hash já tinha NFS-e emitida: exibindo a nota existente")
                         
                         # Salvar na sessão
                         tz_br = pytz.timezone('America/Sao_Paulo')
                         data_emissao = datetime.now(tz_br).strftime("%d/%m/%Y %H:%M:%S")
                         
                         nfse_data = {
+                            'hash_transacao': hash_transacao,
                             'chave_acesso': resultado['chave_acesso'],
                             'numero': resultado.get('numero', 'N/A'),
                             'data_emissao': data_emissao,
@@ -520,7 +547,7 @@ def render_single_emission():
                         st.session_state.last_emission = nfse_data
                         
                         # Salvar persistência
-                        save_emitted_nfse()
+                        save_emitted_nfse([nfse_data])
                         
                         # Exibir resultado
                         st.markdown("---")
@@ -584,6 +611,34 @@ def render_batch_emission():
     st.markdown("Processe múltiplas NFS-e a partir de um arquivo PDF")
     st.markdown("---")
     
+    # Lotes da fila persistente ainda em aberto (ex.: página recarregada ou container reiniciado)
+    try:
+        lotes_abertos = run_sync(job_repository.get_open_batches())
+    except Exception as e:
+        app_logger.warning(f"Não foi possível consultar lotes em andamento: {e}")
+        lotes_abertos = []
+    
+    if lotes_abertos:
+        st.markdown("### ⏳ Lotes em Andamento")
+        if settings.JOB_WORKER_ENABLED:
+            get_emission_worker(emitir_nfse_com_pdf)  # Garante que a fila está sendo consumida
+        
+        for lote in lotes_abertos:
+            contagem = run_sync(job_repository.count_by_status(lote['batch_id']))
+            concluidos = contagem.get('sucesso', 0) + contagem.get('erro', 0)
+            
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                st.info(
+                    f"📄 {lote['nome_arquivo'] or 'Lote'} — {concluidos}/{lote['total_registros']} processadas "
+                    f"(✅ {contagem.get('sucesso', 0)} | ❌ {contagem.get('erro', 0)})"
+                )
+            with col2:
+                if st.button("👁️ Acompanhar", key=f"acompanhar_{lote['batch_id']}", use_container_width=True):
+                    acompanhar_lote(lote['batch_id'])
+        
+        st.markdown("---")
+    
     # Upload do PDF
     st.markdown("### 1️⃣ Upload do Arquivo PDF")
     
@@ -594,12 +649,6 @@ def render_batch_emission():
     )
     
     if uploaded_file is not None:
-        # Salvar arquivo temporariamente
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(uploaded_file.read())
-            pdf_path = tmp_file.name
-        
         st.success(f"✅ Arquivo carregado: {uploaded_file.name}")
         
         # Extrair dados do PDF
@@ -607,11 +656,27 @@ def render_batch_emission():
         
         with st.spinner("⏳ Extraindo dados do PDF..."):
             try:
-                records = pdf_extractor.extract_from_file(Path(pdf_path))
+                # Extração página a página direto dos bytes do upload, com progresso
+                records = []
+                progresso = st.progress(0.0, text="⏳ Extraindo dados do PDF...")
+                for pagina in pdf_extractor.iter_records(uploaded_file.getvalue()):
+                    records.extend(pagina['records'])
+                    progresso.progress(
+                        pagina['page'] / pagina['total_pages'],
+                        text=f"⏳ Página {pagina['page']}/{pagina['total_pages']} - {len(records)} registros"
+                    )
+                progresso.empty()
                 
                 if records:
                     st.success(f"✅ {len(records)} registros encontrados!")
                     
+                    metricas = pdf_extractor.ultimas_metricas
+                    if metricas.get('paginas'):
+                        st.caption(
+                            f"⏱️ {len(metricas['paginas'])} páginas em {metricas['total_segundos']:.1f}s "
+                            f"({metricas['backend']}, {metricas['modo']}, {metricas['processos']} processo(s))"
+                        )
+                    
                     # Estatísticas
                     col1, col2, col3 = st.columns(3)
                     
@@ -702,7 +767,9 @@ def render_batch_emission():
                             )
                         
                         with col2:
-                            tempo_estimado = limite_lote * 2  # ~2 segundos por nota
+                            # ~2 segundos por nota, com até CONCURRENT_REQUESTS emissões simultâneas
+                            concorrencia = max(1, settings.CONCURRENT_REQUESTS)
+                            tempo_estimado = ((limite_lote + concorrencia - 1) // concorrencia) * 2
                             st.info(f"⏱️ Tempo estimado: ~{tempo_estimado//60} min {tempo_estimado%60} seg")
                         
                         st.markdown("---")
@@ -758,44 +825,12 @@ def render_batch_emission():
                                     'cnpj': '58645846000169',
                                 }
                                 
-                                # Barra de progresso
-                                progress_bar = st.progress(0)
-                                status_text = st.empty()
-                                
-                                # Painel de logs em tempo real
-                                log_expander = st.expander("📋 Ver Logs Detalhados", expanded=False)
-                                log_text = log_expander.empty()
-                                logs = []
-                                
-                                resultados = []
-                                sucessos = 0
-                                falhas = 0
-                                
-                                import time
-                                
-                                # Função auxiliar para retry
-                                def emitir_com_retry(prestador_obj, tomador_obj, servico_obj, max_tentativas=3):
-                                    """Tenta emitir NFS-e com retry automático."""
-                                    for tentativa in range(max_tentativas):
-                                        try:
-                                            return asyncio.run(emitir_nfse_com_pdf(prestador_obj, tomador_obj, servico_obj))
-                                        except Exception as e:
-                                            if tentativa < max_tentativas - 1:
-                                                time.sleep(1)  # Aguarda 1 segundo antes de tentar novamente
-                                                continue
-                                            else:
-                                                raise e
+                                # Monta prestador/tomador/serviço de cada registro e enfileira como job
+                                payloads = []
+                                falhas_montagem = []
                                 
                                 for idx, record in enumerate(records_to_process):
-                                    status_text.text(f"⏳ Processando {idx+1}/{len(records_to_process)}: {record.get('nome', 'N/A')}...")
-                                    
                                     try:
-                                        # LOG 1: Dados do registro
-                                        log_msg = f"[{idx+1}/{len(records_to_process)}] Processando: {record.get('nome', 'N/A')}"
-                                        logs.append(log_msg)
-                                        log_text.code("\n".join(logs[-20:]))  # Mostrar últimas 20 linhas
-                                        app_logger.info(log_msg)
-                                        
                                         # Preparar tomador
                                         cpf_cnpj = record.get('cpf', '').replace('.', '').replace('-', '').replace('/', '')
                                         hash_paciente = record.get('hash', '')
@@ -803,7 +838,6 @@ def render_batch_emission():
                                         app_logger.info(f"[{idx+1}] CPF limpo: {cpf_cnpj}, Hash: {hash_paciente}")
                                         
                                         # Prestador
-                                        app_logger.info(f"[{idx+1}] Criando objeto Prestador...")
                                         prestador_obj = PrestadorServico(
                                             cnpj='58645846000169',
                                             inscricao_municipal='93442',  # IM obrigatória para Tubarão/SC
@@ -815,10 +849,8 @@ def render_batch_emission():
                                             uf='SC',
                                             cep='88704000'
                                         )
-                                        app_logger.info(f"[{idx+1}] Prestador criado com sucesso")
                                         
                                         # Tomador
-                                        app_logger.info(f"[{idx+1}] Criando objeto Tomador...")
                                         tomador_obj = TomadorServico(
                                             cpf=cpf_cnpj if len(cpf_cnpj) == 11 else None,
                                             cnpj=cpf_cnpj if len(cpf_cnpj) == 14 else None,
@@ -826,10 +858,6 @@ def render_batch_emission():
                                             email=record.get('email'),
                                             telefone=record.get('telefone')
                                         )
-                                        app_logger.info(f"[{idx+1}] Tomador criado com sucesso")
-                                        
-                                        # Criar descrição personalizada com o hash do paciente
-                                        app_logger.info(f"[{idx+1}] Preparando descrição com hash...")
                                         
                                         # Adicionar hash na DESCRIÇÃO (aparece na DANFSE)
                                         descricao_com_hash = hash_paciente if hash_paciente else descricao_servico
@@ -843,7 +871,6 @@ def render_batch_emission():
                                                 discriminacao_com_hash = f"Hash do Paciente: {hash_paciente}"
                                         
                                         # Serviço
-                                        app_logger.info(f"[{idx+1}] Criando objeto Servico...")
                                         servico_obj = Servico(
                                             valor_servico=valor_servico,
                                             aliquota_iss=aliquota_iss,
@@ -851,166 +878,46 @@ def render_batch_emission():
                                             descricao=descricao_com_hash,
                                             discriminacao=discriminacao_com_hash
                                         )
-                                        app_logger.info(f"[{idx+1}] Servico criado com sucesso")
-                                        
-                                        # Emitir NFS-e com retry automático
-                                        app_logger.info(f"[{idx+1}] Chamando emitir_com_retry...")
-                                        resultado = emitir_com_retry(prestador_obj, tomador_obj, servico_obj)
-                                        app_logger.info(f"[{idx+1}] Emissão concluída: {resultado.get('sucesso', False)}")
                                         
-                                        # Pequeno delay entre emissões (reduzido para acelerar)
-                                        time.sleep(0.2)
-                                        
-                                        if resultado['sucesso']:
-                                            sucessos += 1
-                                            
-                                            logs.append(f"  ✅ Sucesso! Chave: {resultado['chave_acesso'][:20]}...")
-                                            log_text.code("\n".join(logs[-20:]))
-                                            
-                                            # Salvar na sessão
-                                            tz_br = pytz.timezone('America/Sao_Paulo')
-                                            data_emissao = datetime.now(tz_br).strftime("%d/%m/%Y %H:%M:%S")
-                                            
-                                            nfse_data = {
-                                                'chave_acesso': resultado['chave_acesso'],
-                                                'numero': resultado.get('numero', 'N/A'),
-                                                'data_emissao': data_emissao,
-                                                'tomador_nome': record.get('nome', 'N/A'),
-                                                'tomador_cpf': record.get('cpf', 'N/A'),
-                                                'valor': valor_servico,
-                                                'iss': valor_servico * (aliquota_iss / 100),
-                                                'xml_path': resultado.get('xml_path'),
-                                                'pdf_path': resultado.get('pdf_path'),
-                                                'resultado_completo': resultado
-                                            }
-                                            
-                                            st.session_state.emitted_nfse.append(nfse_data)
-                                            
-                                            # Salvar persistência após cada nota
-                                            save_emitted_nfse()
-                                            
-                                            resultados.append({
-                                                'nome': record.get('nome'),
-                                                'cpf': record.get('cpf'),
-                                                'status': '✅ Sucesso',
-                                                'chave': resultado['chave_acesso']
-                                            })
-                                        else:
-                                            falhas += 1
-                                            logs.append(f"  ❌ Falha: {resultado.get('mensagem', 'Erro desconhecido')[:50]}")
-                                            log_text.code("\n".join(logs[-20:]))
-                                            resultados.append({
-                                                'nome': record.get('nome'),
-                                                'cpf': record.get('cpf'),
-                                                'status': '❌ Falha',
-                                                'erro': resultado.get('mensagem', 'Erro desconhecido')
-                                            })
+                                        payloads.append(montar_payload(prestador_obj, tomador_obj, servico_obj, record))
                                     
                                     except Exception as e:
-                                        falhas += 1
                                         erro_msg = str(e)
                                         
-                                        # LOG de erro detalhado
-                                        app_logger.error(f"[{idx+1}] ERRO COMPLETO: {erro_msg}")
-                                        app_logger.error(f"[{idx+1}] Tipo do erro: {type(e).__name__}")
+                                        app_logger.error(f"[{idx+1}] ERRO ao montar dados: {erro_msg}")
                                         app_logger.error(f"[{idx+1}] Registro: {record}")
                                         
                                         # Capturar detalhes do erro
                                         if "'cnpj'" in erro_msg or "cnpj" in erro_msg.lower():
                                             erro_msg = f"Erro ao criar objeto Prestador/Tomador: {erro_msg}"
-                                            app_logger.error(f"[{idx+1}] Erro relacionado a CNPJ detectado")
-                                        
-                                        # Tentar mostrar stack trace
-                                        import traceback
-                                        stack_trace = traceback.format_exc()
-                                        app_logger.error(f"[{idx+1}] Stack trace:\n{stack_trace}")
-                                        
-                                        # Adicionar ao log visual
-                                        logs.append(f"  ❌ ERRO: {erro_msg[:80]}")
-                                        log_text.code("\n".join(logs[-20:]))
                                         
-                                        resultados.append({
+                                        falhas_montagem.append({
                                             'nome': record.get('nome', 'N/A'),
                                             'cpf': record.get('cpf', 'N/A'),
                                             'status': '❌ Erro',
                                             'erro': erro_msg[:100]  # Limitar tamanho
                                         })
-                                        
-                                        # Adicionar detalhes do erro ao status
-                                        status_text.text(f"❌ Erro no registro {idx+1}: {erro_msg[:50]}...")
-                                    
-                                    # Atualizar progresso
-                                    progress = (idx + 1) / len(records_to_process)
-                                    progress_bar.progress(progress)
-                                
-                                # Finalizar
-                                status_text.text("✅ Processamento concluído!")
-                                
-                                st.markdown("### 5️⃣ Resultado do Processamento")
-                                
-                                col1, col2, col3 = st.columns(3)
                                 
-                                with col1:
-                                    st.metric("Total Processado", len(records_to_process))
+                                if falhas_montagem:
+                                    import pandas as pd
+                                    st.warning(f"⚠️ {len(falhas_montagem)} registro(s) não puderam ser preparados")
+                                    st.dataframe(pd.DataFrame(falhas_montagem), use_container_width=True)
                                 
-                                with col2:
-                                    st.metric("✅ Sucessos", sucessos)
-                                
-                                with col3:
-                                    st.metric("❌ Falhas", falhas)
-                                
-                                # Tabela de resultados
-                                st.markdown("### 📊 Detalhamento")
-                                
-                                import pandas as pd
-                                df_result = pd.DataFrame(resultados)
-                                st.dataframe(df_result, use_container_width=True)
-                                
-                                # Gerar ZIP com os PDFs automaticamente
-                                if sucessos > 0:
-                                    st.success(f"🎉 {sucessos} NFS-e emitidas com sucesso!")
+                                if payloads:
+                                    # Fila persistente: o lote sobrevive a recarregamentos e reinícios
+                                    batch_id = run_sync(job_repository.enqueue_batch(
+                                        payloads,
+                                        nome_arquivo=uploaded_file.name,
+                                        usuario=st.session_state.get('username') or 'admin',
+                                        max_tentativas=settings.JOB_MAX_TENTATIVAS
+                                    ))
+                                    if settings.JOB_WORKER_ENABLED:
+                                        get_emission_worker(emitir_nfse_com_pdf)
                                     
-                                    # Preparar ZIP com todos os PDFs do lote
-                                    try:
-                                        with st.spinner("📦 Preparando download automático dos PDFs..."):
-                                            # Coletar PDFs das notas emitidas no lote
-                                            pdf_files = []
-                                            for nfse in st.session_state.emitted_nfse[-sucessos:]:  # Pegar apenas as últimas emitidas
-                                                pdf_path = nfse.get('pdf_path')
-                                                if pdf_path and Path(pdf_path).exists():
-                                                    pdf_files.append(Path(pdf_path))
-                                            
-                                            if pdf_files:
-                                                # Criar ZIP em memória
-                                                import io
-                                                zip_buffer = io.BytesIO()
-                                                
-                                                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                                                    for pdf_path in pdf_files:
-                                                        zip_file.write(pdf_path, pdf_path.name)
-                                                
-                                                zip_buffer.seek(0)
-                                                
-                                                # Criar nome do arquivo com timestamp
-                                                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                                                zip_filename = f"nfse_lote_pdfs_{timestamp}.zip"
-                                                
-                                                # Salvar no session_state para download fora do form
-                                                st.session_state['batch_zip_data'] = zip_buffer.getvalue()
-                                                st.session_state['batch_zip_filename'] = zip_filename
-                                                st.session_state['batch_zip_count'] = len(pdf_files)
-                                                
-                                                st.success(f"✅ {len(pdf_files)} PDFs prontos para download!")
-                                                st.info("💡 **Dica:** Clique no botão de download abaixo do formulário para salvar os PDFs!")
-                                            else:
-                                                st.warning("⚠️ Nenhum arquivo PDF disponível para download")
-                                                st.info("💡 Acesse o menu 'NFS-e Emitidas' para visualizar todas as notas")
+                                    st.info(f"📥 {len(payloads)} NFS-e enfileiradas (lote {batch_id[:8]}). "
+                                            f"Você pode fechar a página: o processamento continua no servidor.")
                                     
-                                    except Exception as e:
-                                        st.error(f"❌ Erro ao preparar download: {e}")
-                                        app_logger.error(f"Erro ao preparar ZIP de PDFs: {e}", exc_info=True)
-                                        st.info("💡 Acesse o menu 'NFS-e Emitidas' para baixar os arquivos individualmente")
-                
+                                    acompanhar_lote(batch_id)
                 else:
                     st.error("❌ Não foi possível extrair dados do PDF!")
             
@@ -1036,10 +943,263 @@ def render_batch_emission():
             st.rerun()
 
 
+def acompanhar_lote(batch_id: str):
+    """
+    Acompanha um lote da fila persistente até o fim e mostra o resultado.
+    
+    O processamento em si roda no worker de emissão; aqui apenas consultamos
+    o banco periodicamente. Ao concluir, as notas emitidas entram na sessão e
+    os PDFs do lote ficam disponíveis para download em ZIP.
+    
+    Se o lote passa JOB_ACOMPANHAMENTO_TIMEOUT segundos sem progresso (ex.:
+    nenhum worker consumindo a fila), o acompanhamento é encerrado; o lote
+    continua na fila e pode ser retomado em "Lotes em Andamento".
+    """
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    
+    contagem_anterior = None
+    ultimo_progresso = time.monotonic()
+    
+    while True:
+        contagem = run_sync(job_repository.count_by_status(batch_id))
+        total = sum(contagem.values())
+        concluidos = contagem.get('sucesso', 0) + contagem.get('erro', 0)
+        
+        # Qualquer mudança de status (inclusive pendente -> processando) conta como progresso
+        if contagem != contagem_anterior:
+            contagem_anterior = contagem
+            ultimo_progresso = time.monotonic()
+        elif time.monotonic() - ultimo_progresso > settings.JOB_ACOMPANHAMENTO_TIMEOUT:
+            status_text.text(f"⏸️ Processadas {concluidos}/{total}")
+            st.warning(
+                f"⏸️ Sem progresso há {settings.JOB_ACOMPANHAMENTO_TIMEOUT:.0f}s: o acompanhamento foi "
+                f"interrompido, mas o lote continua na fila. Verifique se o worker de emissão está "
+                f"ativo e retome em **⏳ Lotes em Andamento** nesta página."
+            )
+            return
+        
+        progress_bar.progress(concluidos / total if total else 1.0)
+        status_text.text(
+            f"⏳ Processadas {concluidos}/{total} "
+            f"(até {settings.CONCURRENT_REQUESTS} simultâneas)..."
+        )
+        
+        if concluidos >= total:
+            break
+        
+        time.sleep(settings.JOB_WORKER_POLL_INTERVAL)
+    
+    # Finalizar
+    status_text.text("✅ Processamento concluído!")
+    
+    jobs = run_sync(job_repository.get_batch_jobs(batch_id))
+    emitidas = [job['resultado'] for job in jobs if job['status'] == 'sucesso' and job['resultado']]
+    falhas = [job for job in jobs if job['status'] == 'erro']
+    
+    # Incluir na sessão as notas emitidas pelo worker (sem duplicar)
+    chaves_sessao = {nfse.get('chave_acesso') for nfse in st.session_state.emitted_nfse}
+    novas = [nfse for nfse in emitidas if nfse.get('chave_acesso') not in chaves_sessao]
+    if novas:
+        st.session_state.emitted_nfse.extend(novas)
+        # O worker já gravou as notas no banco: só o diário local
+        save_emitted_nfse(novas, gravar_no_banco=False)
+    
+    st.markdown("### 5️⃣ Resultado do Processamento")
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        st.metric("Total Processado", len(jobs))
+    
+    with col2:
+        st.metric("✅ Sucessos", len(emitidas))
+    
+    with col3:
+        st.metric("❌ Falhas", len(falhas))
+    
+    # Tabela de resultados
+    st.markdown("### 📊 Detalhamento")
+    
+    import pandas as pd
+    df_result = pd.DataFrame([
+        {
+            'nome': job['nome_tomador'],
+            'cpf': job['cpf_tomador'],
+            'status': '✅ Sucesso' if job['status'] == 'sucesso' else '❌ Erro',
+            'tentativas': job['tentativas'],
+            'chave': (job['resultado'] or {}).get('chave_acesso'),
+            'erro': (job['erro'] or '')[:100] if job['status'] == 'erro' else None
+        }
+        for job in jobs
+    ])
+    st.dataframe(df_result, use_container_width=True)
+    
+    # Gerar ZIP com os PDFs automaticamente
+    if emitidas:
+        st.success(f"🎉 {len(emitidas)} NFS-e emitidas com sucesso!")
+        
+        # Preparar ZIP com todos os PDFs do lote
+        try:
+            with st.spinner("📦 Preparando download automático dos PDFs..."):
+                zip_lote = gerar_zip_nfse(emitidas, 'pdf')
+                
+                if zip_lote['quantidade']:
+                    # Criar nome do arquivo com timestamp
+                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                    zip_filename = f"nfse_lote_pdfs_{timestamp}.zip"
+                    
+                    # Salvar no session_state para download fora do form
+                    st.session_state['batch_zip_data'] = zip_lote['dados']
+                    st.session_state['batch_zip_filename'] = zip_filename
+                    st.session_state['batch_zip_count'] = zip_lote['quantidade']
+                    
+                    st.success(f"✅ {zip_lote['quantidade']} PDFs prontos para download!")
+                    st.info("💡 **Dica:** Clique no botão de download abaixo do formulário para salvar os PDFs!")
+                else:
+                    st.warning("⚠️ Nenhum arquivo PDF disponível para download")
+                    st.info("💡 Acesse o menu 'NFS-e Emitidas' para visualizar todas as notas")
+        
+        except Exception as e:
+            st.error(f"❌ Erro ao preparar download: {e}")
+            app_logger.error(f"Erro ao preparar ZIP de PDFs: {e}", exc_info=True)
+            st.info("💡 Acesse o menu 'NFS-e Emitidas' para baixar os arquivos individualmente")
+
+
 # ============================================================================
 # LISTAGEM DE NFS-e EMITIDAS
 # ============================================================================
 
+# Rótulo do filtro de ordenação -> ordem de NFSeRepository.search
+ORDENACOES_LISTAGEM = {
+    "Mais Recentes": 'recentes',
+    "Mais Antigas": 'antigas',
+    "Maior Valor": 'maior_valor',
+    "Menor Valor": 'menor_valor',
+}
+
+NFSE_LISTAGEM_PAGE_SIZE = 50
+
+
+def _data_emissao_sessao(nota: Dict[str, Any]):
+    """Converte 'DD/MM/AAAA HH:MM:SS' da sessão em datetime (None se inválida)."""
+    try:
+        return datetime.strptime(nota.get('data_emissao') or '', "%d/%m/%Y %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def _periodos_sessao() -> List[str]:
+    """Meses/anos das notas da sessão (fallback sem banco)."""
+    datas = {d.replace(day=1, hour=0, minute=0, second=0) for d in map(_data_emissao_sessao, st.session_state.emitted_nfse) if d}
+    return [d.strftime('%m/%Y') for d in sorted(datas, reverse=True)]
+
+
+def _buscar_nfse_sessao(filtros: Dict[str, Any], pagina: int = 0, page_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Equivalente de NFSeRepository.search sobre st.session_state.emitted_nfse.
+    
+    Usado apenas quando o banco está indisponível; pagina por deslocamento.
+    """
+    notas = []
+    for nota in st.session_state.emitted_nfse:
+        data = _data_emissao_sessao(nota)
+        if filtros['nome'] and filtros['nome'].lower() not in (nota.get('tomador_nome') or '').lower():
+            continue
+        if filtros['cpf'] and filtros['cpf'] not in (nota.get('tomador_cpf') or ''):
+            continue
+        if filtros['mes'] and (not data or data.month != filtros['mes']):
+            continue
+        if filtros['periodo'] and (not data or data.strftime('%m/%Y') != filtros['periodo']):
+            continue
+        notas.append(nota)
+    
+    ordem = filtros['ordem']
+    if ordem == 'recentes':
+        notas.reverse()
+    elif ordem in ('maior_valor', 'menor_valor'):
+        notas.sort(key=lambda n: n.get('valor', 0), reverse=ordem == 'maior_valor')
+    
+    inicio = pagina * page_size if page_size else 0
+    fim = inicio + page_size if page_size else None
+    
+    return {
+        'itens': notas[inicio:fim],
+        'total': len(notas),
+        'valor_total': sum(n.get('valor', 0) for n in notas),
+        'iss_total': sum(n.get('iss', 0) for n in notas),
+        'proxima_pagina': 'sessao' if fim and fim < len(notas) else None
+    }
+
+
+def gerar_zip_nfse(notas: List[Dict[str, Any]], tipo: str) -> Dict[str, Any]:
+    """
+    Gera o ZIP com o PDF ou XML das notas (src.storage.export).
+    
+    O ZIP é montado em arquivo temporário; os bytes são lidos uma única vez
+    aqui porque st.download_button exige bytes.
+    
+    Returns:
+        {'dados': bytes do ZIP, 'quantidade': arquivos incluídos}
+    """
+    resultado = run_sync(exportar_zip(notas, tipo, nfse_repository))
+    with resultado['arquivo'] as arquivo:
+        dados = arquivo.read() if resultado['quantidade'] else b''
+    return {'dados': dados, 'quantidade': resultado['quantidade']}
+
+
+def render_arquivos_competencia(periodo_filtro: Optional[str] = None):
+    """
+    Download dos ZIPs mensais já prontos (src.storage.competencias).
+    
+    Os arquivos são mantidos em background; aqui apenas lemos o ZIP do mês
+    escolhido, sem consultar o banco.
+    """
+    st.markdown("### 🗂️ Arquivos por Competência")
+    
+    try:
+        exportador = get_exportador_competencias()
+        disponiveis = exportador.competencias_disponiveis()
+    except Exception as e:
+        app_logger.warning(f"Exportador de competências indisponível: {e}")
+        st.caption("Arquivos mensais indisponíveis no momento.")
+        return
+    
+    if not disponiveis:
+        st.caption("⏳ Os arquivos mensais estão sendo preparados...")
+        return
+    
+    opcoes = ["Selecione..."] + disponiveis
+    competencia = st.selectbox(
+        "📅 Competência",
+        opcoes,
+        index=opcoes.index(periodo_filtro) if periodo_filtro in disponiveis else 0,
+        key="competencia_zip",
+        help="ZIPs gerados automaticamente a cada nova emissão"
+    )
+    if competencia == "Selecione...":
+        return
+    
+    col1, col2 = st.columns(2)
+    for coluna, tipo in ((col1, 'pdf'), (col2, 'xml')):
+        with coluna:
+            arquivo = exportador.obter(competencia, tipo)
+            if arquivo is None:
+                st.caption(f"⏳ ZIP de {tipo.upper()}s de {competencia} em preparação...")
+                continue
+            
+            st.download_button(
+                label=f"📥 {tipo.upper()}s de {competencia} ({arquivo['quantidade']})",
+                data=arquivo['caminho'].read_bytes(),
+                file_name=arquivo['caminho'].name,
+                mime="application/zip",
+                use_container_width=True,
+                key=f"download_competencia_{tipo}"
+            )
+            st.caption(f"Gerado em {arquivo['gerado_em']} · SHA-256 {arquivo['sha256'][:16]}…")
+    
+    st.markdown("---")
+
 def render_emitted_nfse_list():
     """Renderiza lista de NFS-e emitidas."""
     st.title("📜 NFS-e Emitidas")
@@ -1084,23 +1244,13 @@ def render_emitted_nfse_list():
         )
     
     with col4:
-        # Extrair períodos disponíveis das notas (mês/ano)
-        periodos_disponiveis = set()
-        for nota in st.session_state.emitted_nfse:
-            try:
-                data_str = nota.get('data_emissao', '')
-                if data_str:
-                    # Formato: DD/MM/YYYY HH:MM:SS
-                    partes = data_str.split()
-                    if partes:
-                        data_parte = partes[0]
-                        mes_ano = '/'.join(data_parte.split('/')[-2:])
-                        periodos_disponiveis.add(mes_ano)
-            except:
-                pass
+        # Períodos disponíveis (mês/ano) calculados no banco
+        try:
+            periodos_ordenados = run_sync(nfse_repository.get_periodos())
+        except Exception as e:
+            app_logger.warning(f"Erro ao consultar períodos: {e}")
+            periodos_ordenados = _periodos_sessao()
         
-        from datetime import datetime as dt
-        periodos_ordenados = sorted(list(periodos_disponiveis), key=lambda x: dt.strptime(x, '%m/%Y'), reverse=True)
         filtro_periodo = st.selectbox(
             "📅 Filtrar por Período",
             ["Todos"] + periodos_ordenados,
@@ -1108,147 +1258,95 @@ def render_emitted_nfse_list():
         )
     
     with col5:
-        ordem = st.selectbox("📊 Ordenar por", ["Mais Recentes", "Mais Antigas", "Maior Valor", "Menor Valor"])
+        ordem = st.selectbox("📊 Ordenar por", list(ORDENACOES_LISTAGEM.keys()))
     
     st.markdown("---")
     
-    # Filtrar e ordenar
-    nfse_list = st.session_state.emitted_nfse.copy()
+    filtros = {
+        'nome': filtro_nome or None,
+        'cpf': filtro_cpf or None,
+        'mes': int(filtro_mes) if filtro_mes != "Todos" else None,
+        'periodo': filtro_periodo if filtro_periodo != "Todos" else None,
+        'ordem': ORDENACOES_LISTAGEM[ordem],
+    }
+    filtros_ativos = any(valor for chave, valor in filtros.items() if chave != 'ordem')
     
-    if filtro_nome:
-        nfse_list = [n for n in nfse_list if filtro_nome.lower() in n.get('tomador_nome', '').lower()]
+    # Paginação por keyset: pilha com o token de cada página visitada
+    assinatura_filtros = json.dumps(filtros, sort_keys=True)
+    if st.session_state.get('nfse_lista_filtros') != assinatura_filtros:
+        st.session_state.nfse_lista_filtros = assinatura_filtros
+        st.session_state.nfse_lista_paginas = [None]
     
-    if filtro_cpf:
-        nfse_list = [n for n in nfse_list if filtro_cpf in n.get('tomador_cpf', '')]
+    paginas = st.session_state.nfse_lista_paginas
     
-    # Filtrar por mês (independente do ano)
-    if filtro_mes != "Todos":
-        nfse_filtradas = []
-        for n in nfse_list:
-            try:
-                data_str = n.get('data_emissao', '')
-                if data_str:
-                    partes = data_str.split()
-                    if partes:
-                        data_parte = partes[0]
-                        mes = data_parte.split('/')[1]  # Extrai o mês (MM)
-                        if mes == filtro_mes:
-                            nfse_filtradas.append(n)
-            except:
-                pass
-        nfse_list = nfse_filtradas
-    
-    # Filtrar por período (mês/ano específico)
-    if filtro_periodo != "Todos":
-        nfse_filtradas = []
-        for n in nfse_list:
-            try:
-                data_str = n.get('data_emissao', '')
-                if data_str:
-                    partes = data_str.split()
-                    if partes:
-                        data_parte = partes[0]
-                        mes_ano = '/'.join(data_parte.split('/')[-2:])
-                        if mes_ano == filtro_periodo:
-                            nfse_filtradas.append(n)
-            except:
-                pass
-        nfse_list = nfse_filtradas
-    
-    if ordem == "Mais Recentes":
-        nfse_list = list(reversed(nfse_list))
-    elif ordem == "Maior Valor":
-        nfse_list = sorted(nfse_list, key=lambda x: x.get('valor', 0), reverse=True)
-    elif ordem == "Menor Valor":
-        nfse_list = sorted(nfse_list, key=lambda x: x.get('valor', 0))
+    try:
+        resultado = run_sync(nfse_repository.search(
+            **filtros, page=paginas[-1], page_size=NFSE_LISTAGEM_PAGE_SIZE
+        ))
+    except Exception as e:
+        app_logger.warning(f"Busca no banco indisponível, usando notas da sessão: {e}")
+        resultado = _buscar_nfse_sessao(filtros, pagina=len(paginas) - 1, page_size=NFSE_LISTAGEM_PAGE_SIZE)
+    
+    nfse_list = resultado['itens']
+    
+    def buscar_todas_filtradas() -> List[Dict[str, Any]]:
+        """Todas as notas do filtro atual (ações em lote), sem XML/PDF."""
+        try:
+            return run_sync(nfse_repository.search(**filtros, page_size=None))['itens']
+        except Exception as e:
+            app_logger.warning(f"Busca no banco indisponível, usando notas da sessão: {e}")
+            return _buscar_nfse_sessao(filtros)['itens']
     
     # Exibir métricas
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("Total de NFS-e", len(nfse_list))
+        st.metric("Total de NFS-e", resultado['total'])
     
     with col2:
-        total_valor = sum([n.get('valor', 0) for n in nfse_list])
-        st.metric("Valor Total", f"R$ {total_valor:,.2f}")
+        st.metric("Valor Total", f"R$ {resultado['valor_total']:,.2f}")
     
     with col3:
-        total_iss = sum([n.get('iss', 0) for n in nfse_list])
-        st.metric("Total ISS", f"R$ {total_iss:,.2f}")
+        st.metric("Total ISS", f"R$ {resultado['iss_total']:,.2f}")
     
     st.markdown("---")
     
+    if settings.EXPORT_COMPETENCIAS_ENABLED:
+        render_arquivos_competencia(filtros['periodo'])
+    
     # Botões de ação em lote
     st.markdown("### 📦 Ações em Lote")
     
-    # Mostrar quantas notas estão sendo exibidas vs total
-    if len(nfse_list) < len(st.session_state.emitted_nfse):
-        st.info(f"📊 Exibindo {len(nfse_list)} de {len(st.session_state.emitted_nfse)} notas (filtradas)")
+    # Mostrar quantas notas estão no filtro atual
+    if filtros_ativos:
+        st.info(f"📊 {resultado['total']} nota(s) no filtro atual")
     
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        label_pdf = f"📥 Baixar PDFs ({len(nfse_list)})" if len(nfse_list) < len(st.session_state.emitted_nfse) else "📥 Baixar Todos os PDFs"
+        label_pdf = f"📥 Baixar PDFs ({resultado['total']})" if filtros_ativos else "📥 Baixar Todos os PDFs"
         if st.button(label_pdf, type="primary", use_container_width=True, key="bulk_pdf"):
-            if not nfse_list:
+            notas_lote = buscar_todas_filtradas()
+            if not notas_lote:
                 st.warning("⚠️ Nenhuma nota no filtro atual")
             else:
                 with st.spinner("📦 Gerando arquivo ZIP com os PDFs..."):
                     try:
-                        import zipfile
-                        from io import BytesIO
-                        from datetime import datetime
-                        
-                        # Criar arquivo ZIP em memória
-                        zip_buffer = BytesIO()
-                        
-                        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                            pdfs_encontrados = 0
-                            
-                            for nota in nfse_list:
-                                pdf_content = None
-                                nome_arquivo = f"nfse_{nota.get('numero', 'N_A')}.pdf"
-                                
-                                # Tentar arquivo local primeiro
-                                pdf_path = nota.get('pdf_path')
-                                if pdf_path and Path(pdf_path).exists():
-                                    pdf_content = Path(pdf_path).read_bytes()
-                                    nome_arquivo = Path(pdf_path).name
-                                # Senão, buscar do banco
-                                elif nota.get('pdf_content'):
-                                    pdf_content = nota.get('pdf_content')
-                                    if isinstance(pdf_content, str):
-                                        # Se vier como string base64
-                                        import base64
-                                        pdf_content = base64.b64decode(pdf_content)
-                                # Último recurso: buscar do banco por chave
-                                elif nota.get('chave_acesso'):
-                                    try:
-                                        pdf_bytes = asyncio.run(nfse_repository.get_nfse_pdf(nota['chave_acesso']))
-                                        if pdf_bytes:
-                                            pdf_content = pdf_bytes
-                                    except Exception as e:
-                                        app_logger.warning(f"Erro ao buscar PDF do banco: {e}")
-                                
-                                if pdf_content:
-                                    zip_file.writestr(nome_arquivo, pdf_content)
-                                    pdfs_encontrados += 1
+                        zip_pdfs = gerar_zip_nfse(notas_lote, 'pdf')
                         
-                        if pdfs_encontrados > 0:
-                            # Preparar download
-                            zip_buffer.seek(0)
+                        if zip_pdfs['quantidade'] > 0:
                             data_hora = datetime.now().strftime("%Y%m%d_%H%M%S")
                             
                             st.download_button(
-                                label=f"⬇️ Download ZIP ({pdfs_encontrados} PDFs)",
-                                data=zip_buffer.getvalue(),
+                                label=f"⬇️ Download ZIP ({zip_pdfs['quantidade']} PDFs)",
+                                data=zip_pdfs['dados'],
                                 file_name=f"nfse_pdfs_{data_hora}.zip",
                                 mime="application/zip",
                                 use_container_width=True,
                                 key="download_bulk_pdf"
                             )
                             
-                            st.success(f"✅ {pdfs_encontrados} PDF(s) prontos para download!")
+                            st.success(f"✅ {zip_pdfs['quantidade']} PDF(s) prontos para download!")
                         else:
                             st.warning("⚠️ Nenhum arquivo PDF encontrado no sistema")
                     
@@ -1256,63 +1354,29 @@ def render_emitted_nfse_list():
                         st.error(f"❌ Erro ao gerar ZIP: {e}")
     
     with col2:
-        label_xml = f"📄 Baixar XMLs ({len(nfse_list)})" if len(nfse_list) < len(st.session_state.emitted_nfse) else "📄 Baixar Todos os XMLs"
+        label_xml = f"📄 Baixar XMLs ({resultado['total']})" if filtros_ativos else "📄 Baixar Todos os XMLs"
         if st.button(label_xml, type="primary", use_container_width=True, key="bulk_xml"):
-            if not nfse_list:
+            notas_lote = buscar_todas_filtradas()
+            if not notas_lote:
                 st.warning("⚠️ Nenhuma nota no filtro atual")
             else:
                 with st.spinner("📦 Gerando arquivo ZIP com os XMLs..."):
                     try:
-                        import zipfile
-                        from io import BytesIO
-                        from datetime import datetime
-                        
-                        # Criar arquivo ZIP em memória
-                        zip_buffer = BytesIO()
+                        zip_xmls = gerar_zip_nfse(notas_lote, 'xml')
                         
-                        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                            xmls_encontrados = 0
-                            
-                            for nota in nfse_list:
-                                xml_content = None
-                                nome_arquivo = f"nfse_{nota.get('numero', 'N_A')}.xml"
-                                
-                                # Tentar arquivo local primeiro
-                                xml_path = nota.get('xml_path')
-                                if xml_path and Path(xml_path).exists():
-                                    xml_content = Path(xml_path).read_text(encoding='utf-8')
-                                    nome_arquivo = Path(xml_path).name
-                                # Senão, buscar do banco
-                                elif nota.get('xml_content'):
-                                    xml_content = nota.get('xml_content')
-                                # Último recurso: buscar do banco por chave
-                                elif nota.get('chave_acesso'):
-                                    try:
-                                        xml_text = asyncio.run(nfse_repository.get_nfse_xml(nota['chave_acesso']))
-                                        if xml_text:
-                                            xml_content = xml_text
-                                    except Exception as e:
-                                        app_logger.warning(f"Erro ao buscar XML do banco: {e}")
-                                
-                                if xml_content:
-                                    zip_file.writestr(nome_arquivo, xml_content.encode('utf-8'))
-                                    xmls_encontrados += 1
-                        
-                        if xmls_encontrados > 0:
-                            # Preparar download
-                            zip_buffer.seek(0)
+                        if zip_xmls['quantidade'] > 0:
                             data_hora = datetime.now().strftime("%Y%m%d_%H%M%S")
                             
                             st.download_button(
-                                label=f"⬇️ Download ZIP ({xmls_encontrados} XMLs)",
-                                data=zip_buffer.getvalue(),
+                                label=f"⬇️ Download ZIP ({zip_xmls['quantidade']} XMLs)",
+                                data=zip_xmls['dados'],
                                 file_name=f"nfse_xmls_{data_hora}.zip",
                                 mime="application/zip",
                                 use_container_width=True,
                                 key="download_bulk_xml"
                             )
                             
-                            st.success(f"✅ {xmls_encontrados} XML(s) prontos para download!")
+                            st.success(f"✅ {zip_xmls['quantidade']} XML(s) prontos para download!")
                         else:
                             st.warning("⚠️ Nenhum arquivo XML encontrado no sistema")
                     
@@ -1365,7 +1429,9 @@ def render_emitted_nfse_list():
                     try:
                         app_logger.info("Iniciando limpeza do banco de dados PostgreSQL (função direta)...")
                         ensure_db_initialized()
-                        db_removidos = asyncio.run(delete_all_nfse_direct())
+                        # Notas ainda na fila de gravação voltariam ao banco depois da limpeza
+                        get_gravador_nfse(_ao_gravar_nfse).aguardar(timeout=30)
+                        db_removidos = run_sync(delete_all_nfse_direct())
                         app_logger.info(f"✅ Banco de dados limpo com sucesso: {db_removidos} registros removidos")
                     except Exception as e:
                         erro_msg = f"Erro ao limpar banco de dados: {e}"
@@ -1378,20 +1444,18 @@ def render_emitted_nfse_list():
                     st.session_state.last_emission = None
                     st.session_state.confirmar_limpeza = False
                     
-                    # Salvar arquivo JSON vazio
+                    # Esvaziar o diário local
                     try:
-                        PERSISTENCE_FILE.parent.mkdir(parents=True, exist_ok=True)
-                        with open(PERSISTENCE_FILE, 'w', encoding='utf-8') as f:
-                            json.dump([], f, ensure_ascii=False, indent=2)
-                        app_logger.info("Arquivo de backup JSON limpo")
+                        get_nfse_journal().limpar()
+                        app_logger.info("Diário local de notas limpo")
                     except Exception as e:
-                        erro_msg = f"Erro ao limpar arquivo JSON: {e}"
+                        erro_msg = f"Erro ao limpar diário local: {e}"
                         app_logger.error(erro_msg)
                         erros.append(erro_msg)
                     
                     # Verificar se realmente limpou do banco
                     try:
-                        verificacao = asyncio.run(nfse_repository.get_all_nfse())
+                        verificacao = run_sync(nfse_repository.get_all_nfse())
                         if verificacao:
                             app_logger.warning(f"⚠️ ATENÇÃO: Ainda há {len(verificacao)} registros no banco após limpeza!")
                             erros.append(f"Banco ainda contém {len(verificacao)} registros após limpeza")
@@ -1414,6 +1478,26 @@ def render_emitted_nfse_list():
     
     st.markdown("---")
     
+    # Navegação entre páginas
+    if len(paginas) > 1 or resultado['proxima_pagina']:
+        col_ant, col_pag, col_prox = st.columns([1, 2, 1])
+        
+        with col_ant:
+            if len(paginas) > 1 and st.button("◀ Anterior", use_container_width=True, key="nfse_pagina_anterior"):
+                paginas.pop()
+                st.rerun()
+        
+        with col_pag:
+            st.caption(
+                f"Página {len(paginas)} — notas {(len(paginas) - 1) * NFSE_LISTAGEM_PAGE_SIZE + 1}"
+                f" a {(len(paginas) - 1) * NFSE_LISTAGEM_PAGE_SIZE + len(nfse_list)} de {resultado['total']}"
+            )
+        
+        with col_prox:
+            if resultado['proxima_pagina'] and st.button("Próxima ▶", use_container_width=True, key="nfse_pagina_proxima"):
+                paginas.append(resultado['proxima_pagina'])
+                st.rerun()
+    
     # Listar NFS-e
     for idx, nfse in enumerate(nfse_list):
         with st.expander(
@@ -1543,37 +1627,20 @@ def render_settings():
             else:
                 with st.spinner("📦 Gerando arquivo ZIP com todos os PDFs..."):
                     try:
-                        import zipfile
-                        from io import BytesIO
-                        from datetime import datetime
-                        
-                        # Criar arquivo ZIP em memória
-                        zip_buffer = BytesIO()
-                        
-                        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                            pdfs_encontrados = 0
-                            
-                            for nota in st.session_state.emitted_nfse:
-                                pdf_path = nota.get('pdf_path')
-                                if pdf_path and Path(pdf_path).exists():
-                                    # Adicionar PDF ao ZIP
-                                    zip_file.write(pdf_path, Path(pdf_path).name)
-                                    pdfs_encontrados += 1
+                        zip_pdfs = gerar_zip_nfse(st.session_state.emitted_nfse, 'pdf')
                         
-                        if pdfs_encontrados > 0:
-                            # Preparar download
-                            zip_buffer.seek(0)
+                        if zip_pdfs['quantidade'] > 0:
                             data_hora = datetime.now().strftime("%Y%m%d_%H%M%S")
                             
                             st.download_button(
-                                label=f"⬇️ Download ZIP ({pdfs_encontrados} PDFs)",
-                                data=zip_buffer.getvalue(),
+                                label=f"⬇️ Download ZIP ({zip_pdfs['quantidade']} PDFs)",
+                                data=zip_pdfs['dados'],
                                 file_name=f"nfse_pdfs_{data_hora}.zip",
                                 mime="application/zip",
                                 use_container_width=True
                             )
                             
-                            st.success(f"✅ {pdfs_encontrados} PDF(s) prontos para download!")
+                            st.success(f"✅ {zip_pdfs['quantidade']} PDF(s) prontos para download!")
                         else:
                             st.warning("⚠️ Nenhum arquivo PDF encontrado no sistema")
                     
@@ -1587,37 +1654,20 @@ def render_settings():
             else:
                 with st.spinner("📦 Gerando arquivo ZIP com todos os XMLs..."):
                     try:
-                        import zipfile
-                        from io import BytesIO
-                        from datetime import datetime
+                        zip_xmls = gerar_zip_nfse(st.session_state.emitted_nfse, 'xml')
                         
-                        # Criar arquivo ZIP em memória
-                        zip_buffer = BytesIO()
-                        
-                        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                            xmls_encontrados = 0
-                            
-                            for nota in st.session_state.emitted_nfse:
-                                xml_path = nota.get('xml_path')
-                                if xml_path and Path(xml_path).exists():
-                                    # Adicionar XML ao ZIP
-                                    zip_file.write(xml_path, Path(xml_path).name)
-                                    xmls_encontrados += 1
-                        
-                        if xmls_encontrados > 0:
-                            # Preparar download
-                            zip_buffer.seek(0)
+                        if zip_xmls['quantidade'] > 0:
                             data_hora = datetime.now().strftime("%Y%m%d_%H%M%S")
                             
                             st.download_button(
-                                label=f"⬇️ Download ZIP ({xmls_encontrados} XMLs)",
-                                data=zip_buffer.getvalue(),
+                                label=f"⬇️ Download ZIP ({zip_xmls['quantidade']} XMLs)",
+                                data=zip_xmls['dados'],
                                 file_name=f"nfse_xmls_{data_hora}.zip",
                                 mime="application/zip",
                                 use_container_width=True
                             )
                             
-                            st.success(f"✅ {xmls_encontrados} XML(s) prontos para download!")
+                            st.success(f"✅ {zip_xmls['quantidade']} XML(s) prontos para download!")
                         else:
                             st.warning("⚠️ Nenhum arquivo XML encontrado no sistema")
                     
@@ -1658,7 +1708,9 @@ def render_settings():
                     try:
                         app_logger.info("Iniciando limpeza do banco de dados PostgreSQL (função direta)...")
                         ensure_db_initialized()
-                        db_removidos = asyncio.run(delete_all_nfse_direct())
+                        # Notas ainda na fila de gravação voltariam ao banco depois da limpeza
+                        get_gravador_nfse(_ao_gravar_nfse).aguardar(timeout=30)
+                        db_removidos = run_sync(delete_all_nfse_direct())
                         app_logger.info(f"✅ Banco de dados limpo com sucesso: {db_removidos} registros removidos")
                     except Exception as e:
                         erro_msg = f"Erro ao limpar banco de dados: {e}"
@@ -1671,20 +1723,18 @@ def render_settings():
                     st.session_state.last_emission = None
                     st.session_state.confirmar_limpeza_settings = False
                     
-                    # Salvar arquivo JSON vazio
+                    # Esvaziar o diário local
                     try:
-                        PERSISTENCE_FILE.parent.mkdir(parents=True, exist_ok=True)
-                        with open(PERSISTENCE_FILE, 'w', encoding='utf-8') as f:
-                            json.dump([], f, ensure_ascii=False, indent=2)
-                        app_logger.info("Arquivo de backup JSON limpo")
+                        get_nfse_journal().limpar()
+                        app_logger.info("Diário local de notas limpo")
                     except Exception as e:
-                        erro_msg = f"Erro ao limpar arquivo JSON: {e}"
+                        erro_msg = f"Erro ao limpar diário local: {e}"
                         app_logger.error(erro_msg)
                         erros.append(erro_msg)
                     
                     # Verificar se realmente limpou do banco
                     try:
-                        verificacao = asyncio.run(nfse_repository.get_all_nfse())
+                        verificacao = run_sync(nfse_repository.get_all_nfse())
                         if verificacao:
                             app_logger.warning(f"⚠️ ATENÇÃO: Ainda há {len(verificacao)} registros no banco após limpeza!")
                             erros.append(f"Banco ainda contém {len(verificacao)} registros após limpeza")
@@ -1737,15 +1787,13 @@ def download_file_button(file_path: str, label: str, key: str, chave_acesso: str
                 file_data = f.read()
         # Se não existir localmente, tentar buscar do banco de dados
         elif chave_acesso and file_type:
-            nfse_repository = NFSeRepository(get_db_session())
-            
             if file_type == 'xml':
-                xml_content = asyncio.run(nfse_repository.get_nfse_xml(chave_acesso))
+                xml_content = run_sync(nfse_repository.get_nfse_xml(chave_acesso))
                 if xml_content:
                     file_data = xml_content.encode('utf-8')
                     file_name = f"nfse_{chave_acesso}.xml"
             elif file_type == 'pdf':
-                pdf_content = asyncio.run(nfse_repository.get_nfse_pdf(chave_acesso))
+                pdf_content = run_sync(nfse_repository.get_nfse_pdf(chave_acesso))
                 if pdf_content:
                     file_data = pdf_content
                     file_name = f"danfse_{chave_acesso}.pdf"
@@ -1799,6 +1847,20 @@ def main():
             app_logger.warning(f"Aviso na sincronização: {e}")
         st.session_state.db_synced = True
     
+    # Worker da fila de emissão: retoma lotes interrompidos por um reinício
+    if settings.JOB_WORKER_ENABLED:
+        try:
+            get_emission_worker(emitir_nfse_com_pdf)
+        except Exception as e:
+            app_logger.warning(f"Aviso ao iniciar worker de emissão: {e}")
+    
+    # ZIPs mensais prontos para download na listagem
+    if settings.EXPORT_COMPETENCIAS_ENABLED:
+        try:
+            get_exportador_competencias()
+        except Exception as e:
+            app_logger.warning(f"Aviso ao iniciar exportador de competências: {e}")
+    
     # Verifica autenticação
     if not st.session_state.authenticated:
         login_page()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark de compressão dos DPS: tempo de CPU x tamanho do payload por nível.
+
+Para cada nível 1-9 mede GZIP (formato enviado à Sefin) e zlib com o
+dicionário NFS-e (formato de armazenamento), sobre DPS assinados reais.
+
+Uso:
+    python benchmark_compression.py [quantidade] [arquivo.xml ...]
+
+Sem arquivos, gera DPS assinados com o template (certificado temporário se
+certificados/*.pem não existirem).
+"""
+import gzip
+import sys
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+from lxml import etree
+
+from benchmark_dps_pipeline import _certificado_temporario, _request
+from src.models.schemas import TipoAmbiente
+from src.utils.compression import DECLARACAO_BYTES, DICIONARIO_NFSE
+from src.utils.signing_material import get_signing_material
+from src.utils.xml_generator import NFSeXMLGenerator
+from src.utils.xml_signer import assinar_dps_element
+
+
+def _dps_assinados(quantidade: int) -> list[bytes]:
+    generator = NFSeXMLGenerator(ambiente=TipoAmbiente.HOMOLOGACAO)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_path, key_path = "certificados/cert.pem", "certificados/key.pem"
+        if not (Path(cert_path).exists() and Path(key_path).exists()):
+            cert_path, key_path = _certificado_temporario(Path(tmp))
+        material = get_signing_material(cert_path, key_path)
+        
+        return [
+            DECLARACAO_BYTES + etree.tostring(
+                assinar_dps_element(generator.gerar_dps_element(_request(i)), material),
+                encoding='UTF-8'
+            )
+            for i in range(quantidade)
+        ]
+
+
+def _zlib_dicionario(xml: bytes, nivel: int) -> bytes:
+    compressor = zlib.compressobj(level=nivel, zdict=DICIONARIO_NFSE)
+    return compressor.compress(xml) + compressor.flush()
+
+
+def medir(nome: str, funcao, xmls: list[bytes], nivel: int) -> None:
+    inicio = time.process_time()
+    tamanho = sum(len(funcao(xml, nivel)) for xml in xmls)
+    cpu = time.process_time() - inicio
+    
+    n = len(xmls)
+    original = sum(len(xml) for xml in xmls) / n
+    media = tamanho / n
+    base64_media = 4 * ((media + 2) // 3)
+    print(
+        f"{nome:<10} {nivel:>5}  {cpu / n * 1_000_000:9.1f} µs/nota  "
+        f"{media:8.0f} B  (b64 {base64_media:6.0f} B, {media / original:6.1%})"
+    )
+
+
+def main() -> None:
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    arquivos = sys.argv[2:]
+    
+    if arquivos:
+        xmls = [Path(arquivo).read_bytes() for arquivo in arquivos]
+    else:
+        xmls = _dps_assinados(quantidade)
+    
+    print(f"Compressão DPS - {len(xmls)} documento(s), média {sum(map(len, xmls)) / len(xmls):.0f} B\n")
+    print(f"{'formato':<10} {'nível':>5}  {'CPU':>15}  {'tamanho':>10}")
+    
+    for nivel in range(1, 10):
+        medir("gzip", lambda xml, n: gzip.compress(xml, compresslevel=n), xmls, nivel)
+    print()
+    for nivel in range(1, 10):
+        medir("zlib+dict", _zlib_dicionario, xmls, nivel)
+
+
+if __name__ == "__main__":
+    main()
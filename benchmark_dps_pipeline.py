@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark do pipeline DPS: geração → assinatura → GZIP → Base64.
+
+Compara, por nota, tempo e alocações (tracemalloc) entre:
+- antes: ElementTree → str → parse lxml → assina → str → encode → gzip → base64
+- depois: template lxml → assina a árvore → serializa uma vez direto no gzip
+
+Uso:
+    python benchmark_dps_pipeline.py [quantidade]
+
+Usa certificados/cert.pem e certificados/key.pem se existirem; caso contrário
+gera um certificado autoassinado temporário (apenas para medir).
+"""
+import base64
+import gzip
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+from xml.etree.ElementTree import tostring
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+from src.models.schemas import NFSeRequest, PrestadorServico, TomadorServico, Servico, TipoAmbiente
+from src.utils.signing_material import get_signing_material
+from src.utils.xml_generator import NFSeXMLGenerator
+from src.utils.xml_signer import XML_DECLARACAO, assinar_e_comprimir, assinar_xml_exclusive_c14n
+
+
+def _certificado_temporario(pasta: Path) -> tuple[str, str]:
+    """Gera par cert/key autoassinado para o benchmark."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nome = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Benchmark DPS")])
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(nome)
+        .issuer_name(nome)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.utcnow())
+        .not_valid_after(datetime.utcnow() + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = pasta / "cert.pem"
+    key_path = pasta / "key.pem"
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.TraditionalOpenSSL,
+        serialization.NoEncryption()
+    ))
+    return str(cert_path), str(key_path)
+
+
+def _request(i: int) -> NFSeRequest:
+    return NFSeRequest(
+        prestador=PrestadorServico(
+            cnpj="58645846000169",
+            inscricao_municipal="93442",
+            razao_social="VSB SERVICOS MEDICOS LTDA",
+            logradouro="Rua Felipe Schmidt",
+            numero="100",
+            bairro="Centro",
+            municipio="Tubarao",
+            uf="SC",
+            cep="88010000"
+        ),
+        tomador=TomadorServico(cpf="10463540948", nome=f"Paciente {i}"),
+        servico=Servico(
+            descricao=f"Consulta medica {i}",
+            item_lista_servico="04.01.01",
+            valor_servico=89.00 + i,
+            aliquota_iss=2.00,
+            valor_deducoes=0.00
+        ),
+        data_emissao=datetime.now(),
+        ambiente=TipoAmbiente.HOMOLOGACAO
+    )
+
+
+def pipeline_antes(generator: NFSeXMLGenerator, req: NFSeRequest, cert_path: str, key_path: str) -> str:
+    """Caminho antigo, com round trips de string."""
+    root = generator._build_dps_tree(req, generator._proximo_numero_dps(), generator._data_emissao())
+    xml = XML_DECLARACAO + tostring(root, encoding="unicode", method="xml")
+    xml_assinado = assinar_xml_exclusive_c14n(xml, cert_path, key_path)
+    return base64.b64encode(gzip.compress(xml_assinado.encode('utf-8'), compresslevel=9)).decode('utf-8')
+
+
+def pipeline_depois(generator: NFSeXMLGenerator, req: NFSeRequest, material) -> str:
+    """Pipeline novo: uma árvore, uma serialização."""
+    return assinar_e_comprimir(generator.gerar_dps_element(req), material)
+
+
+def medir(nome: str, funcao, requests: list) -> None:
+    funcao(requests[0])  # aquecimento (templates, cache de chave)
+    
+    # Tempo sem tracemalloc (que distorce a medição)
+    inicio = time.perf_counter()
+    for req in requests:
+        funcao(req)
+    duracao = time.perf_counter() - inicio
+    
+    # Memória: pico alocado durante cada nota, acima do que já estava em uso
+    tracemalloc.start()
+    total_pico = 0
+    for req in requests:
+        em_uso, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        funcao(req)
+        total_pico += tracemalloc.get_traced_memory()[1] - em_uso
+    tracemalloc.stop()
+    
+    n = len(requests)
+    print(f"{nome:<8} {duracao / n * 1000:8.3f} ms/nota  {total_pico / n / 1024:8.1f} KiB/nota (pico)")
+
+
+def main() -> None:
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    requests = [_request(i) for i in range(quantidade)]
+    generator = NFSeXMLGenerator(ambiente=TipoAmbiente.HOMOLOGACAO)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        cert_path, key_path = "certificados/cert.pem", "certificados/key.pem"
+        if not (Path(cert_path).exists() and Path(key_path).exists()):
+            cert_path, key_path = _certificado_temporario(Path(tmp))
+        material = get_signing_material(cert_path, key_path)
+        
+        print(f"Pipeline DPS - {quantidade} notas\n")
+        medir("antes", lambda req: pipeline_antes(generator, req, cert_path, key_path), requests)
+        medir("depois", lambda req: pipeline_depois(generator, req, material), requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Benchmark dos planos de consulta de nfse_emissoes.
+
+Executa EXPLAIN ANALYZE (PostgreSQL) ou EXPLAIN QUERY PLAN (SQLite) das
+consultas quentes da listagem/busca e mostra se o índice esperado foi usado.
+
+Uso:
+    python benchmark_query_plans.py [--seed N]
+
+Com --seed, insere N notas sintéticas antes de medir (tabelas pequenas levam
+o PostgreSQL a preferir seq scan). Tudo roda em uma transação desfeita ao
+final: o banco não é alterado.
+"""
+import argparse
+import asyncio
+import random
+import re
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from sqlalchemy import insert, select, text
+
+from config.database import engine, init_database
+from src.database.models import NFSeEmissao
+from src.database.repository import NFSeRepository
+
+NOMES = ["MARIA SILVA", "JOSE SANTOS", "ANA OLIVEIRA", "JOAO SOUZA", "PAULA LIMA", "CARLOS PEREIRA"]
+
+
+def _consultas():
+    """(nome, statement, índice esperado, apenas PostgreSQL)"""
+    colunas = NFSeRepository._COLUNAS_LISTAGEM
+    filtros = NFSeRepository._filtros_busca
+    
+    return [
+        (
+            "listagem recentes (get_all_nfse)",
+            select(*colunas).where(NFSeEmissao.status == 'sucesso')
+            .order_by(NFSeEmissao.created_at.desc()).limit(1000),
+            'ix_nfse_emissoes_status_created_at', False
+        ),
+        (
+            "por CPF (get_emissoes_by_cpf)",
+            select(*colunas).where(NFSeEmissao.cpf_tomador == '10463540948')
+            .order_by(NFSeEmissao.created_at.desc()).limit(100),
+            'ix_nfse_emissoes_cpf_created_at', False
+        ),
+        (
+            "search página 1",
+            select(*colunas).where(*filtros(None, None, None, None))
+            .order_by(NFSeEmissao.data_emissao.desc(), NFSeEmissao.id.desc()).limit(51),
+            'ix_nfse_emissoes_status_data_emissao', False
+        ),
+        (
+            "search período 03/2025",
+            select(*colunas).where(*filtros(None, None, None, '03/2025'))
+            .order_by(NFSeEmissao.data_emissao.desc(), NFSeEmissao.id.desc()).limit(51),
+            'ix_nfse_emissoes_status_data_emissao', False
+        ),
+        (
+            "search mês 03 (todos os anos)",
+            select(*colunas).where(*filtros(None, None, 3, None)),
+            'ix_nfse_emissoes_mes_emissao', True
+        ),
+        (
+            "search nome '%silva%'",
+            select(*colunas).where(*filtros('silva', None, None, None)),
+            'ix_nfse_emissoes_nome_trgm', True
+        ),
+    ]
+
+
+async def _semear(conn, quantidade: int) -> None:
+    agora = datetime.now()
+    linhas = []
+    for i in range(quantidade):
+        data = agora - timedelta(minutes=random.randint(0, 3 * 365 * 24 * 60))
+        linhas.append({
+            'chave_acesso': f"BENCH{i:020d}",
+            'numero_nfse': str(i),
+            'cpf_tomador': f"{random.randint(0, 10**11 - 1):011d}",
+            'nome_tomador': f"{random.choice(NOMES)} {i}",
+            'status': 'sucesso' if random.random() < 0.95 else 'erro',
+            'valor_servico': round(random.uniform(50, 500), 2),
+            'valor_iss': 2.0,
+            'data_emissao': data,
+            'created_at': data,
+            'updated_at': data,
+        })
+    
+    for inicio in range(0, len(linhas), 5000):
+        await conn.execute(insert(NFSeEmissao), linhas[inicio:inicio + 5000])
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seed', type=int, default=0, help="Notas sintéticas inseridas antes de medir")
+    args = parser.parse_args()
+    
+    await init_database()
+    postgres = engine.dialect.name == 'postgresql'
+    
+    async with engine.connect() as conn:
+        transacao = await conn.begin()
+        try:
+            if args.seed:
+                print(f"Inserindo {args.seed} notas sintéticas...")
+                await _semear(conn, args.seed)
+            if postgres:
+                await conn.execute(text("ANALYZE nfse_emissoes"))
+            
+            total = (await conn.execute(text("SELECT COUNT(*) FROM nfse_emissoes"))).scalar()
+            print(f"Planos de consulta - {engine.dialect.name}, {total} linhas\n")
+            
+            for nome, stmt, esperado, apenas_postgres in _consultas():
+                if apenas_postgres and not postgres:
+                    print(f"–  {nome}: índice {esperado} existe apenas no PostgreSQL\n")
+                    continue
+                
+                sql = str(stmt.compile(engine.sync_engine, compile_kwargs={'literal_binds': True}))
+                explain = "EXPLAIN (ANALYZE, BUFFERS) " if postgres else "EXPLAIN QUERY PLAN "
+                plano = [
+                    " ".join(str(coluna) for coluna in linha)
+                    for linha in (await conn.exec_driver_sql(explain + sql)).all()
+                ]
+                
+                usados = sorted(set(re.findall(r'ix_nfse_emissoes_\w+', "\n".join(plano))))
+                tempo = re.search(r'Execution Time: ([\d.]+) ms', "\n".join(plano))
+                marca = "✅" if esperado in usados else "❌"
+                
+                print(f"{marca} {nome}: {', '.join(usados) or 'nenhum índice'}"
+                      + (f" ({tempo.group(1)} ms)" if tempo else ""))
+                for linha in plano:
+                    print(f"     {linha}")
+                print()
+        finally:
+            await transacao.rollback()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
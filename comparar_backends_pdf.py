@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Compara os backends de texto do PDFDataExtractor (pdfplumber x PyMuPDF).
+
+Extrai os registros de cada relatório com os dois backends, mostra o tempo
+de cada um e as diferenças registro a registro. Sai com código 1 se algum
+relatório divergir, para uso antes de trocar PDF_TEXT_BACKEND.
+
+Sem arquivos, gera com reportlab um relatório de exemplo no layout do
+relatório de consultas (tabela Hash | Nome do Paciente | CPF | ...) e
+compara os backends nele.
+
+Uso:
+    python comparar_backends_pdf.py [relatorio1.pdf ...] [--paginas N]
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from src.pdf.backends import BACKENDS, PYMUPDF_DISPONIVEL
+from src.pdf.extractor import PDFDataExtractor
+
+
+NOMES = (
+    "Ana", "Bruno", "Carla", "Débora", "Eduardo", "Fábio", "Giovana", "Heitor",
+    "Iara", "João", "Lúcia", "Márcio", "Natália", "Otávio", "Patrícia", "Ruan",
+)
+SOBRENOMES = (
+    "Silva", "Souza", "Oliveira", "Conceição", "Pereira", "Gonçalves", "Araújo",
+    "Magalhães", "Assunção", "Brandão", "Nóbrega", "Vieira", "de Almeida",
+)
+RUAS = ("Rua das Flores", "Av. Brasil", "Rua São João", "Travessa Ipê", "Rua XV de Novembro")
+
+
+def gerar_relatorio_exemplo(caminho: Path, paginas: int = 5, semente: int = 42) -> int:
+    """
+    Gera um relatório de consultas sintético com reportlab.
+    
+    Args:
+        caminho: PDF a gravar
+        paginas: Páginas aproximadas do relatório
+        semente: Semente dos dados aleatórios (relatório reproduzível)
+    
+    Returns:
+        Quantidade de linhas de pacientes no relatório
+    """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.units import cm
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+    from validate_docbr import CPF
+    
+    aleatorio = random.Random(semente)
+    random.seed(semente)  # CPF().generate() usa o random global
+    gerador_cpf = CPF()
+    
+    linhas = [["Hash", "Nome do Paciente", "CPF", "Telefone", "Email", "Endereço", "Data Consulta", "Valor", "Criação"]]
+    quantidade = paginas * 28
+    for indice in range(quantidade):
+        nome = f"{aleatorio.choice(NOMES)} {aleatorio.choice(SOBRENOMES)} {aleatorio.choice(SOBRENOMES)}"
+        usuario = nome.split()[0].lower().encode('ascii', 'ignore').decode() or 'paciente'
+        linhas.append([
+            f"PACIENTEBLIS{aleatorio.getrandbits(40):010X}",
+            nome,
+            gerador_cpf.generate(),
+            f"{aleatorio.randint(11, 99)}9{aleatorio.randint(10000000, 99999999)}" if indice % 7 else "",
+            f"{usuario}{indice}@exemplo.com.br" if indice % 5 else "",
+            f"{aleatorio.choice(RUAS)}, {aleatorio.randint(1, 2000)}",
+            f"{aleatorio.randint(1, 28):02d}/{aleatorio.randint(1, 12):02d}/2025",
+            "R$ 89,00",
+            f"{aleatorio.randint(1, 28):02d}/{aleatorio.randint(1, 12):02d}/2025",
+        ])
+    
+    tabela = Table(linhas, repeatRows=1)
+    tabela.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 7),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]))
+    documento = SimpleDocTemplate(
+        str(caminho), pagesize=landscape(A4),
+        leftMargin=1 * cm, rightMargin=1 * cm, topMargin=1 * cm, bottomMargin=1 * cm
+    )
+    documento.build([tabela])
+    return quantidade
+
+
+def _extrair(caminho: Path, backend: str):
+    extrator = PDFDataExtractor()
+    inicio = time.perf_counter()
+    registros = extrator.extract_from_file(caminho, paralelo=False, backend=backend)
+    return registros, time.perf_counter() - inicio, extrator.errors
+
+
+def _comparar(caminho: Path) -> bool:
+    resultados = {backend: _extrair(caminho, backend) for backend in BACKENDS}
+    (ref_registros, ref_tempo, ref_erros), (alt_registros, alt_tempo, alt_erros) = resultados.values()
+    ref_nome, alt_nome = resultados
+    
+    print(f"{caminho.name}:")
+    for nome, (registros, tempo, erros) in resultados.items():
+        print(f"   {nome:<11} {len(registros):>5} registros em {tempo:.2f}s" + (f" - erros: {erros}" if erros else ""))
+    if alt_tempo:
+        print(f"   {alt_nome} {ref_tempo / alt_tempo:.1f}x mais rápido")
+    
+    diferencas = []
+    for indice in range(max(len(ref_registros), len(alt_registros))):
+        ref = ref_registros[indice] if indice < len(ref_registros) else None
+        alt = alt_registros[indice] if indice < len(alt_registros) else None
+        if ref != alt:
+            diferencas.append((indice, ref, alt))
+    
+    if not diferencas and not ref_erros and not alt_erros:
+        print("   ✅ registros idênticos\n")
+        return True
+    
+    print(f"   ❌ {len(diferencas)} registro(s) diferentes")
+    for indice, ref, alt in diferencas[:10]:
+        print(f"     #{indice}")
+        print(f"       {ref_nome}: {ref}")
+        print(f"       {alt_nome}: {alt}")
+    print()
+    return False
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('pdfs', nargs='*', type=Path, help="Relatórios a comparar (padrão: relatório de exemplo)")
+    parser.add_argument('--paginas', type=int, default=5, help="Páginas do relatório de exemplo")
+    args = parser.parse_args()
+    
+    if not PYMUPDF_DISPONIVEL:
+        print("PyMuPDF não instalado (pip install PyMuPDF)")
+        return 2
+    
+    with tempfile.TemporaryDirectory() as diretorio:
+        pdfs = args.pdfs
+        if not pdfs:
+            exemplo = Path(diretorio) / 'relatorio_exemplo.pdf'
+            linhas = gerar_relatorio_exemplo(exemplo, args.paginas)
+            print(f"Relatório de exemplo gerado: {linhas} pacientes\n")
+            pdfs = [exemplo]
+        
+        iguais = [_comparar(caminho) for caminho in pdfs]
+    
+    print(f"{sum(iguais)}/{len(iguais)} relatório(s) com registros idênticos")
+    return 0 if all(iguais) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,45 @@
 """
 Configuração e gerenciamento de conexões com PostgreSQL.
+
+A engine usa um pool de conexões (AsyncAdaptedQueuePool). Conexões asyncpg
+ficam presas ao event loop em que foram abertas, por isso todo acesso ao
+banco a partir de código síncrono (Streamlit, threads) passa por
+src.utils.runtime.run_sync(), que usa um único event loop por processo.
 """
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, Dict
 
 from .settings import settings
 
 # Base para modelos SQLAlchemy
 Base = declarative_base()
 
+
+def _pool_kwargs(url: str) -> Dict[str, Any]:
+    """Parâmetros do pool conforme o banco configurado."""
+    if url.startswith('sqlite') and ':memory:' in url:
+        # Banco em memória existe apenas dentro de uma única conexão
+        return {'poolclass': StaticPool}
+    
+    return {
+        'poolclass': AsyncAdaptedQueuePool,
+        'pool_size': settings.DB_POOL_SIZE,
+        'max_overflow': settings.DB_MAX_OVERFLOW,
+        'pool_timeout': settings.DB_POOL_TIMEOUT,
+        'pool_recycle': settings.DB_POOL_RECYCLE,
+        'pool_pre_ping': settings.DB_POOL_PRE_PING,
+    }
+
+
 # Engine assíncrona
 engine = create_async_engine(
     settings.DATABASE_URL,
     echo=settings.DB_ECHO,
-    poolclass=NullPool,  # Para Streamlit, evita problemas com pool
-    future=True
+    future=True,
+    **_pool_kwargs(settings.DATABASE_URL)
 )
 
 # Session factory
@@ -59,3 +81,4 @@ async def init_database():
 async def close_database():
     """Fecha todas as conexões do banco de dados."""
     await engine.dispose()
+
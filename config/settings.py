@@ -19,6 +19,12 @@ class Settings(BaseSettings):
     # Banco de Dados
     DATABASE_URL: str = "sqlite+aiosqlite:///./nfse.db"
     DB_ECHO: bool = False
+    DB_POOL_SIZE: int = 5  # Conexões mantidas abertas no pool
+    DB_MAX_OVERFLOW: int = 10  # Conexões extras sob pico (fechadas ao devolver)
+    DB_POOL_TIMEOUT: float = 30.0  # Espera máxima por uma conexão livre
+    DB_POOL_RECYCLE: int = 1800  # Recicla conexões mais velhas que isso (segundos)
+    DB_POOL_PRE_PING: bool = True  # Testa a conexão antes de usar (Railway derruba ociosas)
+    DB_BULK_CHUNK_SIZE: int = 500  # Linhas por INSERT multi-linha em gravações em lote
     
     # API Nacional NFS-e (Sefin Nacional - Sistema Nacional NFS-e)
     # Ambiente de PRODUÇÃO
@@ -29,6 +35,23 @@ class Settings(BaseSettings):
     NFSE_API_TIMEOUT: int = 30
     NFSE_API_MAX_RETRIES: int = 3
     
+    # Pool de conexões HTTP (keep-alive / mTLS reutilizado entre emissões)
+    HTTP_POOL_MAX_CONNECTIONS: int = 20
+    HTTP_POOL_MAX_KEEPALIVE: int = 10
+    HTTP_POOL_KEEPALIVE_EXPIRY: float = 60.0
+    HTTP2_ENABLED: bool = False  # Requer pacote 'h2' (httpx[http2])
+    
+    # Controle de tráfego Sefin (compartilhado por todos os clientes do processo)
+    SEFIN_RATE_LIMIT_PER_SEC: float = 10.0  # Token bucket: requisições/segundo
+    SEFIN_RATE_LIMIT_BURST: int = 10
+    SEFIN_CONCURRENCY_INICIAL: int = 5  # AIMD: cresce com sucesso, cai com 429/503/timeout
+    SEFIN_CONCURRENCY_MIN: int = 1
+    SEFIN_CONCURRENCY_MAX: int = 20
+    SEFIN_AIMD_FATOR_REDUCAO: float = 0.5
+    SEFIN_RETRY_AFTER_MAX: float = 120.0  # Teto para esperas via Retry-After
+    SEFIN_CIRCUIT_LIMITE_FALHAS: int = 5  # Falhas consecutivas para abrir o circuito
+    SEFIN_CIRCUIT_TEMPO_RESET: float = 30.0  # Segundos até a requisição de teste
+    
     # API ADN - Endpoint de recepção de lote (POST /adn/DFe)
     ADN_RECEPCAO_LOTE_ENDPOINT: str = "/adn/DFe"  # POST - Envio lote DPS/NFS-e comprimido
     ADN_DISTRIBUICAO_ENDPOINT: str = "/DFe"  # GET - Consulta por NSU
@@ -52,6 +75,60 @@ class Settings(BaseSettings):
     MIN_BATCH_SIZE: int = 1
     CONCURRENT_REQUESTS: int = 10
     
+    # Fila persistente de emissão em lote (tabela emissao_jobs)
+    JOB_WORKER_ENABLED: bool = True  # Worker em background no processo do Streamlit
+    JOB_WORKER_POLL_INTERVAL: float = 2.0  # Segundos entre consultas com fila vazia
+    JOB_MAX_TENTATIVAS: int = 3  # Tentativas por registro antes de marcar erro
+    JOB_STALE_TIMEOUT: float = 300.0  # Jobs 'processando' há mais que isso voltam para a fila
+    JOB_ACOMPANHAMENTO_TIMEOUT: float = 180.0  # Segundos sem progresso até a tela parar de acompanhar o lote
+    
+    # Numeração durável de DPS (tabela dps_sequencia). Na criação da sequência
+    # vale o maior entre este valor e o último DPS do registro de idempotência;
+    # 0 = não configurado (obrigatório se já houver notas da numeração antiga)
+    DPS_NUMERO_INICIAL: int = 0
+    
+    # Pool de processos para assinatura XMLDSig
+    SIGNING_POOL_WORKERS: int = 0  # 0 = número de CPUs
+    SIGNING_POOL_CHUNK_SIZE: int = 25  # XMLs por bloco enviado a cada worker
+    SIGNING_POOL_MIN_BATCH: int = 20  # Abaixo disso, sign_many/sign_encode_many assinam no próprio processo
+    SIGNING_POOL_JANELA_MS: float = 10.0  # Janela para agrupar DPS de emissões simultâneas (sign_encode_async)
+    
+    # Compressão dos payloads DPS (GZIP + Base64)
+    GZIP_COMPRESS_LEVEL: int = 6  # 1-9; em DPS de ~3 KB o nível 9 quase não reduz o tamanho
+    COMPRESSION_THREADS: int = 4  # Threads para comprimir lotes (zlib libera o GIL)
+    COMPRESSION_MIN_BATCH: int = 20  # Abaixo disso, comprime na thread atual
+    COMPRESSION_DICT_ENABLED: bool = True  # Dicionário zlib para XML armazenado (não usado no envio)
+    
+    # Armazenamento de XML/PDF endereçado por SHA-256 (fora de nfse_emissoes)
+    BLOB_STORE_BACKEND: str = "local"  # local ou s3
+    BLOB_STORE_DIR: str = ""  # Vazio = <RAILWAY_VOLUME_MOUNT_PATH ou ./data>/blobs
+    BLOB_STORE_S3_BUCKET: str = ""
+    BLOB_STORE_S3_ENDPOINT_URL: str = ""  # Ex.: http://localhost:9000 (MinIO)
+    BLOB_STORE_S3_REGION: str = ""
+    BLOB_STORE_S3_ACCESS_KEY_ID: str = ""
+    BLOB_STORE_S3_SECRET_ACCESS_KEY: str = ""
+    BLOB_MIGRAR_INLINE: bool = False  # migrate_database.py move xml_content/pdf_content para o blob store
+    
+    # Exportação ZIP de XML/PDF
+    EXPORT_SPOOL_MAX_BYTES: int = 16 * 1024 * 1024  # Acima disso o ZIP vai para arquivo temporário em disco
+    EXPORT_LOTE_LEGADO: int = 50  # Notas com conteúdo inline (pré blob store) lidas por consulta
+    EXPORT_COMPETENCIAS_ENABLED: bool = True  # ZIPs mensais mantidos em background
+    EXPORT_COMPETENCIAS_DIR: str = ""  # Vazio = <volume>/exportacoes
+    EXPORT_COMPETENCIAS_INTERVALO: float = 60.0  # Segundos entre verificações de meses alterados
+    
+    # Diário local de notas emitidas (JSONL) e gravação em segundo plano no banco
+    JOURNAL_FSYNC_LOTE: int = 50  # fsync a cada N linhas...
+    JOURNAL_FSYNC_INTERVALO: float = 1.0  # ...ou após N segundos desde o último
+    JOURNAL_COMPACTAR_MIN_LINHAS: int = 1000  # Compacta acima disso se metade das linhas forem repetidas
+    WRITE_BEHIND_LOTE: int = 100  # Notas por gravação no banco
+    WRITE_BEHIND_INTERVALO: float = 1.0  # Espera máxima antes de gravar um grupo incompleto
+    WRITE_BEHIND_MAX_TENTATIVAS: int = 5  # Depois disso o grupo fica só no diário até a próxima sincronização
+    
+    # Extração de PDF
+    PDF_TEXT_BACKEND: str = "pdfplumber"  # pdfplumber, pymupdf ou auto (PyMuPDF se instalado); confira com comparar_backends_pdf.py antes de trocar
+    PDF_EXTRACTION_PROCESSES: int = 0  # Processos da extração paralela (0 = núcleos disponíveis)
+    PDF_PARALLEL_MIN_PAGES: int = 40  # PDFs a partir deste número de páginas são extraídos em paralelo
+    
     # Logs
     LOG_LEVEL: str = "INFO"
     LOG_FILE: str = "logs/nfse_automation.log"
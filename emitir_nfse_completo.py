@@ -5,105 +5,32 @@ Script integrado: Emite NFS-e e gera automaticamente XML + PDF (DANFSE).
 import asyncio
 import base64
 import gzip
-import hashlib
-from lxml import etree
-from cryptography import x509
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.backends import default_backend
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
+
+import httpx
 
 from src.models.schemas import PrestadorServico, TomadorServico, Servico, NFSeRequest, TipoAmbiente
-from src.utils.xml_generator import NFSeXMLGenerator
-from src.api.client import NFSeAPIClient
+from src.utils.xml_generator import NFSeXMLGenerator, SERIE_DPS
+from src.api.client import get_nfse_api_client
+from src.database.repository import IdempotenciaRepository
+from config.database import init_database
+from src.utils.xml_signer import assinar_xml_exclusive_c14n, get_signing_pool  # noqa: F401 (reexport)
 from gerar_danfse_tubarao import gerar_danfse_tubarao
 from config.settings import settings
 
 
-def assinar_xml_exclusive_c14n(xml_string: str, cert_path: str, key_path: str) -> str:
-    """Assina XML com Exclusive C14N (método que funciona)."""
-    
-    root = etree.fromstring(xml_string.encode('utf-8'))
-    ns = {'nfse': 'http://www.sped.fazenda.gov.br/nfse'}
-    inf_dps = root.find('.//nfse:infDPS', ns)
-    id_dps = inf_dps.get('Id')
-    
-    with open(cert_path, 'rb') as f:
-        cert_data = f.read()
-        cert = x509.load_pem_x509_certificate(cert_data, default_backend())
-    
-    with open(key_path, 'rb') as f:
-        key_data = f.read()
-        private_key = serialization.load_pem_private_key(key_data, None, default_backend())
-    
-    # Canonicalizar com Exclusive C14N
-    c14n_xml = etree.tostring(inf_dps, method='c14n', exclusive=True, inclusive_ns_prefixes=None)
-    digest_value = hashlib.sha256(c14n_xml).digest()
-    digest_b64 = base64.b64encode(digest_value).decode('utf-8')
-    
-    # Criar SignedInfo
-    nsmap_sig = {None: 'http://www.w3.org/2000/09/xmldsig#'}
-    signed_info = etree.Element('{http://www.w3.org/2000/09/xmldsig#}SignedInfo', nsmap=nsmap_sig)
-    
-    c14n_method = etree.SubElement(signed_info, '{http://www.w3.org/2000/09/xmldsig#}CanonicalizationMethod')
-    c14n_method.set('Algorithm', 'http://www.w3.org/2001/10/xml-exc-c14n#')
-    
-    sig_method = etree.SubElement(signed_info, '{http://www.w3.org/2000/09/xmldsig#}SignatureMethod')
-    sig_method.set('Algorithm', 'http://www.w3.org/2001/04/xmldsig-more#rsa-sha256')
-    
-    reference = etree.SubElement(signed_info, '{http://www.w3.org/2000/09/xmldsig#}Reference')
-    reference.set('URI', f'#{id_dps}')
-    
-    transforms = etree.SubElement(reference, '{http://www.w3.org/2000/09/xmldsig#}Transforms')
-    
-    transform1 = etree.SubElement(transforms, '{http://www.w3.org/2000/09/xmldsig#}Transform')
-    transform1.set('Algorithm', 'http://www.w3.org/2000/09/xmldsig#enveloped-signature')
-    
-    transform2 = etree.SubElement(transforms, '{http://www.w3.org/2000/09/xmldsig#}Transform')
-    transform2.set('Algorithm', 'http://www.w3.org/2001/10/xml-exc-c14n#')
-    
-    digest_method = etree.SubElement(reference, '{http://www.w3.org/2000/09/xmldsig#}DigestMethod')
-    digest_method.set('Algorithm', 'http://www.w3.org/2001/04/xmlenc#sha256')
-    
-    digest_value_elem = etree.SubElement(reference, '{http://www.w3.org/2000/09/xmldsig#}DigestValue')
-    digest_value_elem.text = digest_b64
-    
-    # Canonicalizar SignedInfo
-    c14n_signed_info = etree.tostring(signed_info, method='c14n', exclusive=True, inclusive_ns_prefixes=None)
-    
-    # Assinar
-    signature = private_key.sign(c14n_signed_info, padding.PKCS1v15(), hashes.SHA256())
-    signature_b64 = base64.b64encode(signature).decode('utf-8')
-    
-    # Montar Signature
-    signature_elem = etree.Element('{http://www.w3.org/2000/09/xmldsig#}Signature', nsmap=nsmap_sig)
-    signature_elem.append(signed_info)
-    
-    signature_value = etree.SubElement(signature_elem, '{http://www.w3.org/2000/09/xmldsig#}SignatureValue')
-    signature_value.text = signature_b64
-    
-    # KeyInfo
-    key_info = etree.SubElement(signature_elem, '{http://www.w3.org/2000/09/xmldsig#}KeyInfo')
-    x509_data = etree.SubElement(key_info, '{http://www.w3.org/2000/09/xmldsig#}X509Data')
-    x509_cert = etree.SubElement(x509_data, '{http://www.w3.org/2000/09/xmldsig#}X509Certificate')
-    
-    cert_der = cert.public_bytes(serialization.Encoding.DER)
-    cert_b64 = base64.b64encode(cert_der).decode('utf-8')
-    cert_lines = '\n'.join([cert_b64[i:i+64] for i in range(0, len(cert_b64), 64)])
-    x509_cert.text = '\n' + cert_lines + '\n'
-    
-    root.append(signature_elem)
-    
-    xml_assinado = etree.tostring(root, encoding='unicode')
-    return f'<?xml version="1.0" encoding="UTF-8"?>\n{xml_assinado}'
+# Registro de idempotência e numeração durável de DPS
+idempotencia_repository = IdempotenciaRepository()
 
 
 async def emitir_nfse_com_pdf(
     prestador: PrestadorServico,
     tomador: TomadorServico,
     servico: Servico,
-    salvar_arquivos: bool = True
+    salvar_arquivos: bool = True,
+    hash_transacao: Optional[str] = None
 ):
     """
     Emite NFS-e e gera automaticamente XML + PDF.
@@ -113,6 +40,8 @@ async def emitir_nfse_com_pdf(
         tomador: Dados do tomador
         servico: Dados do serviço
         salvar_arquivos: Se True, salva arquivos com nomes automáticos
+        hash_transacao: Hash da transação (PACIENTEBLIS). Quando informado, a
+            emissão é idempotente: um retry reaproveita o DPS/chave já emitidos
     
     Returns:
         dict com chave_acesso, xml_path, pdf_path
@@ -159,30 +88,76 @@ async def emitir_nfse_com_pdf(
     print(f"Valor: R$ {servico.valor_servico}")
     print(f"Ambiente: {ambiente.value}")
     
-    # 2. Gerar XML DPS
-    print("\n[1] Gerando XML DPS...")
-    generator = NFSeXMLGenerator(ambiente=ambiente)
-    xml_dps = generator.gerar_xml_nfse(nfse_request)
-    print(f"    OK {len(xml_dps)} bytes")
+    client = get_nfse_api_client(cert_path=str(cert_path), key_path=str(key_path))
     
-    # 3. Assinar
-    print("[2] Assinando XML...")
-    xml_assinado = assinar_xml_exclusive_c14n(xml_dps, str(cert_path), str(key_path))
-    print(f"    OK {len(xml_assinado)} bytes")
+    # Idempotência: um hash de transação gera no máximo uma NFS-e
+    registro = await idempotencia_repository.get_registro(hash_transacao) if hash_transacao else None
     
-    # 4. Comprimir
-    print("[3] Comprimindo (GZIP + Base64)...")
-    xml_bytes = xml_assinado.encode('utf-8')
-    compressed = gzip.compress(xml_bytes)
-    b64_encoded = base64.b64encode(compressed).decode('utf-8')
-    print(f"    OK {len(compressed)} bytes comprimidos")
+    if registro and registro['status'] == 'emitido' and registro['resultado']:
+        print(f"\n[OK] Hash {hash_transacao[:12]}... já emitido: {registro['chave_acesso']}")
+        return {**registro['resultado'], 'reconciliado': True}
     
-    # 5. Enviar
-    print("[4] Enviando para Sefin Nacional...")
-    client = NFSeAPIClient(cert_path=str(cert_path), key_path=str(key_path))
+    # Esta tentativa detém o envio do DPS do hash (reserva/assumir_envio)
+    envio_assumido = False
+    # Só a recusa do primeiro envio de um DPS recém-reservado libera o hash
+    # para outro número; qualquer outra falha mantém a reserva para reconciliar
+    rejeicao_definitiva = False
+    reenvio = bool(registro and registro['status'] == 'reservado')
     
     try:
-        resultado = await client.emitir_nfse(b64_encoded)
+        resultado = None
+        
+        if reenvio:
+            # Outra tentativa do mesmo hash pode estar enviando este DPS agora
+            if not await idempotencia_repository.assumir_envio(hash_transacao):
+                return {'sucesso': False, 'erro': f"Emissão do hash {hash_transacao[:12]}... já em andamento"}
+            envio_assumido = True
+            
+            # A tentativa anterior pode ter sido autorizada antes de perdermos a resposta
+            print(f"\n[0] Reconciliando DPS {registro['id_dps']}...")
+            resultado = await _reconciliar_dps(client, registro['id_dps'])
+            
+            # Sem NFS-e: reenvia o MESMO DPS (a Sefin recusa Id duplicado)
+            numero_dps = registro['numero_dps']
+        else:
+            numero_dps = await idempotencia_repository.next_dps_number(prestador.cnpj, SERIE_DPS)
+        
+        if resultado is None:
+            # 2. Gerar DPS (árvore lxml a partir do template)
+            print("\n[1] Gerando XML DPS...")
+            generator = NFSeXMLGenerator(ambiente=ambiente)
+            dps = generator.gerar_dps_element(nfse_request, numero_dps=numero_dps)
+            id_dps = dps[0].get('Id')
+            print(f"    OK {id_dps}")
+            
+            if hash_transacao and not envio_assumido:
+                if not await idempotencia_repository.reservar(hash_transacao, id_dps, numero_dps):
+                    return {'sucesso': False, 'erro': f"Emissão do hash {hash_transacao[:12]}... já em andamento"}
+                envio_assumido = True
+            
+            # 3 e 4. Assinar + comprimir em uma única passada
+            print("[2] Assinando e comprimindo (GZIP + Base64)...")
+            # Emissões simultâneas (ex.: jobs do worker) são agrupadas e assinadas no
+            # pool de processos, liberando o event loop para as demais
+            signing_pool = get_signing_pool(str(cert_path), str(key_path))
+            b64_encoded = await signing_pool.sign_encode_async(dps)
+            print(f"    OK {len(b64_encoded)} bytes em Base64")
+            
+            # 5. Enviar
+            print("[3] Enviando para Sefin Nacional...")
+            try:
+                resultado = await client.emitir_nfse(b64_encoded)
+            except httpx.HTTPStatusError as e:
+                if not reenvio:
+                    rejeicao_definitiva = _rejeicao_definitiva(e)
+                    raise
+                if not _dps_duplicado(e):
+                    raise
+                # O DPS reenviado já foi recebido: a NFS-e surgiu depois da consulta
+                print("    DPS já recebido pela Sefin, consultando novamente...")
+                resultado = await _reconciliar_dps(client, id_dps)
+                if resultado is None:
+                    raise
         
         # Extrair chave
         chave_acesso = resultado.get('chaveAcesso', '')
@@ -191,7 +166,7 @@ async def emitir_nfse_com_pdf(
         print(f"    Chave: {chave_acesso}")
         
         # 6. Salvar XML
-        print("[5] Salvando XML...")
+        print("[4] Salvando XML...")
         nfse_compressed = base64.b64decode(resultado['nfseXmlGZipB64'])
         nfse_xml = gzip.decompress(nfse_compressed).decode('utf-8')
         
@@ -204,7 +179,7 @@ async def emitir_nfse_com_pdf(
         print(f"    OK {xml_path}")
         
         # 7. Gerar PDF (DANFSE no padrão Tubarão/SC)
-        print("[6] Gerando DANFSE (PDF)...")
+        print("[5] Gerando DANFSE (PDF)...")
         
         # Preparar dados para o DANFSE
         dados_danfse = {
@@ -231,7 +206,8 @@ async def emitir_nfse_com_pdf(
             'descricao_servico': servico.discriminacao or 'teleconsulta',
         }
         
-        pdf_path = gerar_danfse_tubarao(dados_danfse)
+        # reportlab é síncrono: roda em thread para não travar emissões concorrentes
+        pdf_path = await asyncio.to_thread(gerar_danfse_tubarao, dados_danfse)
         pdf_size = Path(pdf_path).stat().st_size
         print(f"    OK {pdf_path} ({pdf_size} bytes)")
         
@@ -243,7 +219,7 @@ async def emitir_nfse_com_pdf(
         print(f"PDF: {pdf_path}")
         print("="*70 + "\n")
         
-        return {
+        retorno = {
             'sucesso': True,
             'chave_acesso': chave_acesso,
             'xml_path': str(xml_path),
@@ -251,11 +227,59 @@ async def emitir_nfse_com_pdf(
             'resultado': resultado
         }
         
+        if hash_transacao:
+            await idempotencia_repository.confirmar(hash_transacao, chave_acesso, retorno)
+        
+        return retorno
+        
     except Exception as e:
         print(f"\n[ERRO] Falha: {e}")
+        
+        # Recusa do primeiro envio: o DPS não foi aceito, a próxima tentativa usa outro número.
+        # Timeouts, erros de consulta e falhas no reenvio mantêm a reserva para
+        # reconciliar pelo Id do DPS.
+        if envio_assumido:
+            if rejeicao_definitiva:
+                await idempotencia_repository.rejeitar(hash_transacao, str(e))
+            else:
+                await idempotencia_repository.liberar_envio(hash_transacao)
+        
         return {'sucesso': False, 'erro': str(e)}
 
 
+async def _reconciliar_dps(client, id_dps: str) -> Optional[dict]:
+    """
+    Busca a NFS-e já gerada a partir de um DPS.
+    
+    Args:
+        client: Cliente da API Sefin
+        id_dps: Id do infDPS
+    
+    Returns:
+        Resposta da consulta da NFS-e, ou None se o DPS ainda não gerou nota
+    """
+    consulta = await client.consultar_dps(id_dps)
+    if not consulta or not consulta.get('chaveAcesso'):
+        return None
+    
+    resultado = await client.consultar_nfse(consulta['chaveAcesso'])
+    print("    OK NFS-e já autorizada, reaproveitando")
+    return resultado
+
+
+def _rejeicao_definitiva(erro: httpx.HTTPStatusError) -> bool:
+    """True para respostas 4xx da Sefin que não indicam sobrecarga/timeout."""
+    return (
+        400 <= erro.response.status_code < 500
+        and erro.response.status_code not in (408, 429)
+    )
+
+
+def _dps_duplicado(erro: httpx.HTTPStatusError) -> bool:
+    """True quando a Sefin recusa o DPS por já existir (E0014)."""
+    return 'E0014' in erro.response.text
+
+
 async def exemplo_emissao():
     """Exemplo de emissão de NFS-e."""
     
@@ -288,6 +312,9 @@ async def exemplo_emissao():
         valor_deducoes=0.00
     )
     
+    # Tabelas de numeração de DPS / idempotência
+    await init_database()
+    
     # Emitir NFS-e
     resultado = await emitir_nfse_com_pdf(prestador, tomador, servico)
     
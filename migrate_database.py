@@ -1,6 +1,8 @@
 """
 Script de migração do banco de dados PostgreSQL
-Adiciona colunas xml_content e pdf_content à tabela nfse_emissoes
+Adiciona colunas xml_content e pdf_content à tabela nfse_emissoes,
+move esse conteúdo para o blob store (colunas xml_sha256/pdf_sha256),
+cria os índices das consultas de listagem e reconstrói o resumo diário
 """
 
 import asyncio
@@ -33,6 +35,138 @@ elif DATABASE_URL.startswith('postgresql+psycopg2://'):
     DATABASE_URL = DATABASE_URL.replace('postgresql+psycopg2://', 'postgresql://')
 
 
+# Índices de nfse_emissoes (mesmos nomes declarados em src/database/models.py;
+# o trigram existe só aqui, pois depende da extensão pg_trgm)
+INDICES_NFSE = {
+    'ix_nfse_emissoes_status_created_at': "(status, created_at DESC)",
+    'ix_nfse_emissoes_cpf_created_at': "(cpf_tomador, created_at DESC)",
+    'ix_nfse_emissoes_status_data_emissao': "(status, data_emissao DESC, id DESC)",
+    'ix_nfse_emissoes_mes_emissao': "(EXTRACT(month FROM data_emissao))",
+    'ix_nfse_emissoes_nome_trgm': "USING gin (nome_tomador gin_trgm_ops)",
+}
+
+
+async def create_indexes(conn) -> None:
+    """
+    Cria os índices compostos, funcional e trigram de nfse_emissoes.
+    
+    Usa CREATE INDEX CONCURRENTLY para não bloquear gravações durante o
+    deploy; índices inválidos deixados por uma tentativa interrompida são
+    removidos e recriados.
+    """
+    try:
+        await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        trigram = True
+    except Exception as e:
+        print(f"⚠️ Extensão pg_trgm indisponível ({e}); índice de busca por nome pulado")
+        trigram = False
+    
+    for nome, definicao in INDICES_NFSE.items():
+        if 'gin_trgm_ops' in definicao and not trigram:
+            continue
+        
+        invalido = await conn.fetchval("""
+            SELECT NOT i.indisvalid
+            FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE c.relname = $1
+        """, nome)
+        if invalido:
+            print(f"📝 Removendo índice inválido {nome}...")
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
+        elif invalido is not None:
+            print(f"ℹ️ Índice {nome} já existe")
+            continue
+        
+        print(f"📝 Criando índice {nome}...")
+        await conn.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON nfse_emissoes {definicao}")
+        print(f"✅ Índice {nome} criado")
+    
+    await conn.execute("ANALYZE nfse_emissoes")
+
+
+async def move_blobs_to_store(conn, lote: int = 200) -> None:
+    """
+    Move xml_content/pdf_content das linhas existentes para o blob store.
+    
+    Só roda com BLOB_MIGRAR_INLINE=True e com armazenamento persistente (S3,
+    BLOB_STORE_DIR ou volume do Railway): o conteúdo inline é apagado do
+    banco, então um diretório descartável perderia as notas.
+    
+    Cada blob é relido e conferido pelo hash antes de a linha ser
+    atualizada (hash preenchido, conteúdo inline apagado); linhas cujo blob
+    não confere mantêm o conteúdo no banco. Uma interrupção apenas repete o
+    trabalho. Após mover muitos registros, rode VACUUM FULL nfse_emissoes
+    em uma janela de manutenção para devolver o espaço ao disco.
+    """
+    from config.settings import settings
+    from src.storage.blob_store import get_blob_store
+    
+    if not settings.BLOB_MIGRAR_INLINE:
+        print("ℹ️ Conteúdo inline mantido no banco (BLOB_MIGRAR_INLINE=False)")
+        return
+    
+    if settings.BLOB_STORE_BACKEND != 's3' and not (
+        settings.BLOB_STORE_DIR or os.getenv('RAILWAY_VOLUME_MOUNT_PATH')
+    ):
+        print("⚠️ Blob store local sem diretório persistente (BLOB_STORE_DIR ou volume do Railway):")
+        print("   conteúdo inline mantido no banco")
+        return
+    
+    blob_store = get_blob_store()
+    movidos = 0
+    ultimo_id = 0
+    
+    while True:
+        registros = await conn.fetch("""
+            SELECT id, xml_content, pdf_content
+            FROM nfse_emissoes
+            WHERE (xml_content IS NOT NULL OR pdf_content IS NOT NULL) AND id > $2
+            ORDER BY id
+            LIMIT $1
+        """, lote, ultimo_id)
+        
+        if not registros:
+            break
+        ultimo_id = registros[-1]['id']
+        
+        def armazenar():
+            atualizacoes = []
+            for reg in registros:
+                try:
+                    xml_sha = blob_store.put('xml', reg['xml_content'].encode('utf-8')) if reg['xml_content'] else None
+                    pdf_sha = blob_store.put('pdf', bytes(reg['pdf_content'])) if reg['pdf_content'] else None
+                    # get() confere o SHA-256 do conteúdo relido
+                    if xml_sha:
+                        blob_store.get('xml', xml_sha)
+                    if pdf_sha:
+                        blob_store.get('pdf', pdf_sha)
+                except Exception as e:
+                    print(f"  ⚠️ Registro {reg['id']}: blob não confirmado ({e}), conteúdo mantido no banco")
+                    continue
+                atualizacoes.append((xml_sha, pdf_sha, reg['id']))
+            return atualizacoes
+        
+        atualizacoes = await asyncio.to_thread(armazenar)
+        if atualizacoes:
+            await conn.executemany("""
+                UPDATE nfse_emissoes
+                SET xml_sha256 = COALESCE($1, xml_sha256),
+                    pdf_sha256 = COALESCE($2, pdf_sha256),
+                    xml_content = NULL,
+                    pdf_content = NULL
+                WHERE id = $3
+            """, atualizacoes)
+        
+        movidos += len(atualizacoes)
+        print(f"  📦 {movidos} registro(s) movidos para o blob store...")
+    
+    if movidos:
+        print(f"✅ {movidos} registro(s) com XML/PDF movidos para o blob store")
+        print("   Rode VACUUM FULL nfse_emissoes para liberar o espaço da tabela")
+    else:
+        print("ℹ️ Nenhum conteúdo inline para mover ao blob store")
+
+
 async def run_migration():
     """Executa migração para adicionar colunas de conteúdo de arquivos."""
     
@@ -78,6 +212,24 @@ async def run_migration():
         else:
             print("ℹ️ Coluna pdf_content já existe")
         
+        # Migração 3: Hashes do blob store (conteúdo fora da tabela)
+        for coluna in ('xml_sha256', 'pdf_sha256'):
+            await conn.execute(f"ALTER TABLE nfse_emissoes ADD COLUMN IF NOT EXISTS {coluna} VARCHAR(64)")
+            await conn.execute(
+                f"CREATE INDEX IF NOT EXISTS ix_nfse_emissoes_{coluna} ON nfse_emissoes ({coluna})"
+            )
+        print("✅ Colunas xml_sha256/pdf_sha256 verificadas")
+        
+        # Migração 3b: trava de envio do registro de idempotência
+        await conn.execute(
+            "ALTER TABLE IF EXISTS emissao_idempotencia ADD COLUMN IF NOT EXISTS envio_desde TIMESTAMP"
+        )
+        
+        await move_blobs_to_store(conn)
+        
+        # Migração 4: Índices das consultas de listagem/busca
+        await create_indexes(conn)
+        
         # Verificar quantos registros existem
         total = await conn.fetchval("SELECT COUNT(*) FROM nfse_emissoes")
         print(f"📊 Total de registros na tabela: {total}")
@@ -108,9 +260,13 @@ async def run_migration():
 
 async def populate_existing_files():
     """
-    Popula as colunas xml_content e pdf_content para registros existentes
-    que possuem arquivos no filesystem.
+    Copia para o blob store os arquivos XML/PDF do filesystem de registros
+    existentes que ainda não têm o hash preenchido.
     """
+    from src.storage.blob_store import get_blob_store
+    
+    blob_store = get_blob_store()
+    
     try:
         conn = await asyncpg.connect(DATABASE_URL)
         print("✅ Conectado ao banco de dados para popular arquivos existentes")
@@ -120,7 +276,7 @@ async def populate_existing_files():
             SELECT id, xml_path, pdf_path, chave_acesso
             FROM nfse_emissoes
             WHERE (xml_path IS NOT NULL OR pdf_path IS NOT NULL)
-            AND (xml_content IS NULL OR pdf_content IS NULL)
+            AND (xml_sha256 IS NULL OR pdf_sha256 IS NULL)
         """)
         
         print(f"📊 Encontrados {len(registros)} registros para popular")
@@ -137,12 +293,12 @@ async def populate_existing_files():
             # Tentar ler XML
             if xml_path and Path(xml_path).exists():
                 try:
-                    xml_content = Path(xml_path).read_text(encoding='utf-8')
+                    xml_sha = blob_store.put('xml', Path(xml_path).read_bytes())
                     await conn.execute("""
                         UPDATE nfse_emissoes 
-                        SET xml_content = $1
+                        SET xml_sha256 = $1
                         WHERE id = $2
-                    """, xml_content, reg_id)
+                    """, xml_sha, reg_id)
                     updated_xml += 1
                     print(f"  ✅ XML populado para NFS-e {chave or reg_id}")
                 except Exception as e:
@@ -151,12 +307,12 @@ async def populate_existing_files():
             # Tentar ler PDF
             if pdf_path and Path(pdf_path).exists():
                 try:
-                    pdf_content = Path(pdf_path).read_bytes()
+                    pdf_sha = blob_store.put('pdf', Path(pdf_path).read_bytes())
                     await conn.execute("""
                         UPDATE nfse_emissoes 
-                        SET pdf_content = $1
+                        SET pdf_sha256 = $1
                         WHERE id = $2
-                    """, pdf_content, reg_id)
+                    """, pdf_sha, reg_id)
                     updated_pdf += 1
                     print(f"  ✅ PDF populado para NFS-e {chave or reg_id}")
                 except Exception as e:
@@ -174,6 +330,26 @@ async def populate_existing_files():
         return False
 
 
+async def rebuild_daily_rollup():
+    """
+    Cria a tabela nfse_resumo_diario (se necessário) e a preenche com o
+    histórico existente. Novas gravações a mantêm atualizada.
+    """
+    from config.database import init_database, close_database
+    from src.database.repository import NFSeRepository
+    
+    try:
+        await init_database()
+        await NFSeRepository().reconstruir_resumo_diario()
+        print("✅ Resumo diário (nfse_resumo_diario) reconstruído")
+        return True
+    except Exception as e:
+        print(f"❌ Erro ao reconstruir resumo diário: {e}")
+        return False
+    finally:
+        await close_database()
+
+
 async def main():
     """Função principal de migração."""
     # Verificar se está rodando no Railway (não interativo)
@@ -192,6 +368,10 @@ async def main():
         print("\n❌ Migração falhou. Verifique os logs.")
         return
     
+    # Resumo diário usado pelo dashboard
+    print("\n📊 Reconstruindo resumo diário de emissões...")
+    await rebuild_daily_rollup()
+    
     print("\n" + "=" * 60)
     
     # No Railway, não popular arquivos automaticamente (pode ser lento)
@@ -200,8 +380,8 @@ async def main():
         print("   Os novos arquivos serão salvos automaticamente nas próximas emissões")
     else:
         # Perguntar se deseja popular arquivos existentes (apenas local)
-        print("\n📁 Deseja popular os arquivos XML/PDF existentes no banco?")
-        print("   (Isso irá ler os arquivos do filesystem e salvá-los no banco)")
+        print("\n📁 Deseja popular os arquivos XML/PDF existentes no blob store?")
+        print("   (Isso irá ler os arquivos do filesystem e salvá-los no blob store)")
         resposta = input("\n   Digite 'sim' para popular ou pressione Enter para pular: ").strip().lower()
         
         if resposta in ['sim', 's', 'yes', 'y']:
@@ -77,6 +77,14 @@ def setup_certificates():
                 print(f"❌ Erro ao processar CERTIFICATE_KEY_PEM: {e}")
                 raise
             
+            # Certificados regravados: descarta material de assinatura em cache
+            # (o cache também detecta a mudança de mtime, isto só antecipa)
+            try:
+                from src.utils.signing_material import invalidate_signing_cache
+                invalidate_signing_cache()
+            except Exception as e:
+                print(f"⚠️ Aviso ao limpar cache de assinatura: {e}")
+            
             # Testar carregamento
             print("\n🔍 Testando carregamento dos certificados...")
             try:
@@ -0,0 +1,143 @@
+"""
+Emissão concorrente de NFS-e em lote (paralelismo limitado por semáforo).
+"""
+import asyncio
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from config.settings import settings
+from src.utils.logger import app_logger
+
+
+# Função de emissão de um item: recebe o item e retorna o dicionário de resultado
+EmitFn = Callable[[Any], Awaitable[Dict[str, Any]]]
+
+
+class BatchEmitter:
+    """
+    Executa emissões de NFS-e em paralelo com limite de concorrência.
+    
+    Cada item é entregue à função de emissão (tipicamente um wrapper de
+    NFSeAPIClient.emitir_nfse ou emitir_nfse_com_pdf). No máximo
+    `concurrency` emissões ficam em voo ao mesmo tempo.
+    """
+    
+    def __init__(
+        self,
+        emit_fn: EmitFn,
+        concurrency: Optional[int] = None,
+        max_tentativas: int = 1,
+        intervalo_retry: float = 1.0
+    ):
+        """
+        Inicializa o emissor em lote.
+        
+        Args:
+            emit_fn: Corrotina que emite um item e retorna o resultado
+            concurrency: Emissões simultâneas (padrão: settings.CONCURRENT_REQUESTS)
+            max_tentativas: Tentativas por item quando a emissão lança exceção
+            intervalo_retry: Espera em segundos entre tentativas
+        """
+        self.emit_fn = emit_fn
+        self.concurrency = max(1, concurrency or settings.CONCURRENT_REQUESTS)
+        self.max_tentativas = max(1, max_tentativas)
+        self.intervalo_retry = intervalo_retry
+    
+    async def _emitir_item(
+        self,
+        index: int,
+        item: Any,
+        semaphore: asyncio.Semaphore
+    ) -> Dict[str, Any]:
+        """Emite um item respeitando o semáforo e a política de retry."""
+        async with semaphore:
+            inicio = time.perf_counter()
+            
+            for tentativa in range(1, self.max_tentativas + 1):
+                try:
+                    resultado = await self.emit_fn(item)
+                    break
+                except Exception as e:
+                    if tentativa < self.max_tentativas:
+                        app_logger.warning(
+                            f"[{index + 1}] Tentativa {tentativa}/{self.max_tentativas} falhou: {e}"
+                        )
+                        await asyncio.sleep(self.intervalo_retry)
+                        continue
+                    
+                    app_logger.error(f"[{index + 1}] Emissão falhou após {tentativa} tentativa(s): {e}")
+                    resultado = {
+                        'sucesso': False,
+                        'erro': str(e),
+                        'tipo_erro': type(e).__name__
+                    }
+            
+            return {
+                'index': index,
+                'resultado': resultado,
+                'tentativas': tentativa,
+                'duracao': time.perf_counter() - inicio
+            }
+    
+    async def stream(self, items: Sequence[Any]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Emite todos os itens e produz um evento a cada emissão concluída.
+        
+        Os eventos chegam na ordem de conclusão; use `evento['index']` para
+        relacioná-los ao item de origem.
+        
+        Args:
+            items: Itens a emitir
+        
+        Yields:
+            Dicionário com index, resultado, tentativas, duracao, concluidos e total
+        """
+        total = len(items)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        app_logger.info(f"Emissão concorrente de {total} NFS-e (até {self.concurrency} simultâneas)")
+        
+        tasks = [
+            asyncio.create_task(self._emitir_item(idx, item, semaphore))
+            for idx, item in enumerate(items)
+        ]
+        
+        try:
+            concluidos = 0
+            for proxima in asyncio.as_completed(tasks):
+                evento = await proxima
+                concluidos += 1
+                evento['concluidos'] = concluidos
+                evento['total'] = total
+                yield evento
+        finally:
+            # Consumidor abandonou o stream: cancela o que ainda não terminou
+            pendentes = [t for t in tasks if not t.done()]
+            for task in pendentes:
+                task.cancel()
+            if pendentes:
+                await asyncio.gather(*pendentes, return_exceptions=True)
+    
+    async def emitir(
+        self,
+        items: Sequence[Any],
+        callback_progress: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Emite todos os itens e retorna os resultados na ordem original.
+        
+        Args:
+            items: Itens a emitir
+            callback_progress: Chamado com cada evento assim que a emissão termina
+        
+        Returns:
+            Lista de resultados, um por item, na mesma ordem de `items`
+        """
+        resultados: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        
+        async for evento in self.stream(items):
+            resultados[evento['index']] = evento['resultado']
+            if callback_progress:
+                callback_progress(evento)
+        
+        return resultados
@@ -1,14 +1,46 @@
 """
 Cliente HTTP assíncrono para comunicação com APIs externas.
 """
+import asyncio
 import httpx
 from typing import Optional, Dict, Any
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import retry, wait_exponential, retry_if_exception_type
 
 from config.settings import settings
+from src.api.rate_limiter import (
+    SefinTrafficController, get_sefin_traffic_controller,
+    parse_retry_after, OVERLOAD_STATUS
+)
 from src.utils.logger import app_logger
 
 
+class ServerOverloadedError(httpx.HTTPStatusError):
+    """Servidor respondeu 429/503 (sobrecarga); pode trazer Retry-After."""
+    
+    def __init__(self, message: str, *, request: httpx.Request, response: httpx.Response,
+                 retry_after: Optional[float] = None):
+        super().__init__(message, request=request, response=response)
+        self.retry_after = retry_after
+
+
+_wait_backoff = wait_exponential(multiplier=1, min=2, max=10)
+
+
+def _stop_after_max_retries(retry_state) -> bool:
+    """Para após `max_retries` tentativas do cliente que originou a chamada."""
+    client = retry_state.args[0]
+    return retry_state.attempt_number >= max(1, client.max_retries)
+
+
+def _wait_retry_after(retry_state) -> float:
+    """Backoff exponencial, respeitando o Retry-After do servidor quando houver."""
+    espera = _wait_backoff(retry_state)
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    if isinstance(exc, ServerOverloadedError) and exc.retry_after:
+        espera = max(espera, min(exc.retry_after, settings.SEFIN_RETRY_AFTER_MAX))
+    return espera
+
+
 class AsyncAPIClient:
     """Cliente HTTP assíncrono com retry e timeouts configuráveis."""
     
@@ -19,7 +51,8 @@ class AsyncAPIClient:
         max_retries: int = 3,
         headers: Optional[Dict[str, str]] = None,
         cert_path: Optional[str] = None,
-        key_path: Optional[str] = None
+        key_path: Optional[str] = None,
+        traffic_controller: Optional[SefinTrafficController] = None
     ):
         """
         Inicializa o cliente HTTP.
@@ -31,6 +64,7 @@ class AsyncAPIClient:
             headers: Headers padrão
             cert_path: Caminho para o arquivo do certificado (.pem) para mTLS
             key_path: Caminho para o arquivo da chave privada (.pem) para mTLS
+            traffic_controller: Rate limiter/circuit breaker compartilhado (opcional)
         """
         self.base_url = base_url.rstrip('/')
         self.timeout = timeout
@@ -40,11 +74,98 @@ class AsyncAPIClient:
         self.default_headers.setdefault('Accept', 'application/json')
         self.cert_path = cert_path
         self.key_path = key_path
+        self.traffic_controller = traffic_controller
+        
+        # Cliente HTTP persistente (pool de conexões keep-alive)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+    
+    def _build_client(self) -> httpx.AsyncClient:
+        """
+        Cria o cliente httpx com pool de conexões, keep-alive e mTLS.
+        
+        Returns:
+            Cliente httpx configurado
+        """
+        client_kwargs = {
+            'timeout': self.timeout,
+            'limits': httpx.Limits(
+                max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.HTTP_POOL_MAX_KEEPALIVE,
+                keepalive_expiry=settings.HTTP_POOL_KEEPALIVE_EXPIRY
+            ),
+        }
+        
+        # Configura mTLS se certificados foram fornecidos
+        if self.cert_path and self.key_path:
+            client_kwargs['cert'] = (self.cert_path, self.key_path)
+            app_logger.debug(f"Usando mTLS com certificado: {self.cert_path}")
+        
+        # HTTP/2 é opcional (requer pacote 'h2')
+        if settings.HTTP2_ENABLED:
+            try:
+                import h2  # noqa: F401
+                client_kwargs['http2'] = True
+            except ImportError:
+                app_logger.warning("HTTP/2 solicitado mas pacote 'h2' não instalado. Usando HTTP/1.1")
+        
+        return httpx.AsyncClient(**client_kwargs)
+    
+    async def _get_client(self) -> httpx.AsyncClient:
+        """
+        Retorna o cliente persistente, criando-o se necessário.
+        
+        O pool fica preso ao event loop onde foi criado. No app todas as
+        chamadas passam pelo loop compartilhado (src.utils.runtime); se o loop
+        mudar (ex.: scripts com asyncio.run) o cliente antigo é fechado no loop
+        original, quando este ainda está ativo, e substituído.
+        
+        Returns:
+            Cliente httpx reutilizável
+        """
+        loop = asyncio.get_running_loop()
+        
+        if self._client is not None and (self._client.is_closed or self._client_loop is not loop):
+            if not self._client.is_closed:
+                self._fechar_no_loop_original(self._client, self._client_loop)
+            self._client = None
+        
+        if self._client is None:
+            self._client = self._build_client()
+            self._client_loop = loop
+            app_logger.debug(f"Pool HTTP criado para {self.base_url}")
+        
+        return self._client
+    
+    @staticmethod
+    def _fechar_no_loop_original(client: httpx.AsyncClient, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        """Agenda o aclose() do cliente no loop dono das suas conexões."""
+        if loop is not None and loop.is_running() and not loop.is_closed():
+            app_logger.debug("Event loop mudou - fechando pool HTTP anterior no loop original")
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            # Loop encerrado: os sockets já não têm como ser fechados por ele
+            app_logger.warning("Event loop do pool HTTP anterior encerrado sem aclose(); conexões descartadas")
+    
+    async def aclose(self) -> None:
+        """Fecha o cliente persistente e libera as conexões do pool."""
+        if self._client is not None:
+            if not self._client.is_closed:
+                await self._client.aclose()
+            self._client = None
+            self._client_loop = None
+    
+    async def __aenter__(self) -> "AsyncAPIClient":
+        await self._get_client()
+        return self
+    
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        await self.aclose()
     
     @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=2, max=10),
-        retry=retry_if_exception_type((httpx.TimeoutException, httpx.NetworkError)),
+        stop=_stop_after_max_retries,
+        wait=_wait_retry_after,
+        retry=retry_if_exception_type((httpx.TimeoutException, httpx.NetworkError, ServerOverloadedError)),
         reraise=True
     )
     async def _request(
@@ -56,6 +177,10 @@ class AsyncAPIClient:
         """
         Executa requisição HTTP com retry automático.
         
+        Com `traffic_controller`, cada tentativa passa pelo circuit breaker,
+        limite de concorrência adaptativo e token bucket; 429/503 reduzem o
+        ritmo e são repetidos respeitando Retry-After.
+        
         Args:
             method: Método HTTP (GET, POST, etc)
             endpoint: Endpoint da API
@@ -63,19 +188,25 @@ class AsyncAPIClient:
             
         Returns:
             Resposta HTTP
+            
+        Raises:
+            CircuitBreakerOpenError: Se a API estiver marcada como indisponível
+            ServerOverloadedError: Se o servidor continuar sobrecarregado após os retries
         """
         url = f"{self.base_url}/{endpoint.lstrip('/')}"
         
         # Merge headers
         headers = {**self.default_headers, **kwargs.pop('headers', {})}
         
-        # Configura mTLS se certificados foram fornecidos
-        client_kwargs = {'timeout': self.timeout}
-        if self.cert_path and self.key_path:
-            client_kwargs['cert'] = (self.cert_path, self.key_path)
-            app_logger.debug(f"Usando mTLS com certificado: {self.cert_path}")
+        # Reutiliza conexões do pool (evita novo handshake TLS a cada chamada)
+        client = await self._get_client()
         
-        async with httpx.AsyncClient(**client_kwargs) as client:
+        controller = self.traffic_controller
+        sequencia = None
+        if controller:
+            sequencia = await controller.acquire()
+        
+        try:
             app_logger.debug(f"{method} {url}")
             
             response = await client.request(
@@ -84,10 +215,29 @@ class AsyncAPIClient:
                 headers=headers,
                 **kwargs
             )
-            
-            app_logger.debug(f"Response: {response.status_code}")
-            
-            return response
+        except (httpx.TimeoutException, httpx.NetworkError):
+            if controller:
+                controller.record_timeout(sequencia)
+            raise
+        finally:
+            if controller:
+                controller.release()
+        
+        app_logger.debug(f"Response: {response.status_code} ({response.http_version})")
+        
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if controller:
+            controller.record_response(response.status_code, retry_after, sequencia)
+        
+        if response.status_code in OVERLOAD_STATUS:
+            raise ServerOverloadedError(
+                f"Servidor sobrecarregado: HTTP {response.status_code}",
+                request=response.request,
+                response=response,
+                retry_after=retry_after
+            )
+        
+        return response
     
     async def get(self, endpoint: str, **kwargs) -> httpx.Response:
         """Requisição GET."""
@@ -155,7 +305,8 @@ class NFSeAPIClient(AsyncAPIClient):
             timeout=settings.NFSE_API_TIMEOUT,
             max_retries=settings.NFSE_API_MAX_RETRIES,
             cert_path=cert_path,
-            key_path=key_path
+            key_path=key_path,
+            traffic_controller=get_sefin_traffic_controller()
         )
         
         if cert_path and key_path:
@@ -163,6 +314,10 @@ class NFSeAPIClient(AsyncAPIClient):
         else:
             app_logger.info(f"Cliente Sefin NFS-e inicializado: {self.base_url}")
     
+    async def __aenter__(self) -> "NFSeAPIClient":
+        await super().__aenter__()
+        return self
+    
     async def emitir_nfse(self, dps_xml_gzip_b64: str) -> Dict[str, Any]:
         """
         Emite NFS-e enviando DPS (Declaração de Prestação de Serviço) para Sefin Nacional.
@@ -220,6 +375,54 @@ class NFSeAPIClient(AsyncAPIClient):
             app_logger.error(f"Erro ao emitir NFS-e: {e}")
             raise
     
+    async def consultar_dps(self, id_dps: str) -> Optional[Dict[str, Any]]:
+        """
+        Recupera a chave de acesso da NFS-e gerada a partir de um DPS.
+        
+        Endpoint: GET /SefinNacional/dps/{id}
+        Usado para reconciliar uma emissão cujo resultado se perdeu
+        (timeout/queda de conexão depois do envio).
+        
+        Args:
+            id_dps: Id do infDPS (45 caracteres)
+            
+        Returns:
+            Response com idDps e chaveAcesso, ou None se o DPS não gerou NFS-e
+            
+        Raises:
+            httpx.HTTPStatusError: Se status não for 2xx nem 404
+        """
+        response = await self.get(f"/SefinNacional/dps/{id_dps}")
+        
+        if response.status_code == 404:
+            return None
+        
+        response.raise_for_status()
+        resultado = response.json()
+        
+        app_logger.info(f"DPS {id_dps} já gerou NFS-e: {resultado.get('chaveAcesso', 'N/A')}")
+        
+        return resultado
+    
+    async def consultar_nfse(self, chave_acesso: str) -> Dict[str, Any]:
+        """
+        Consulta uma NFS-e pela chave de acesso.
+        
+        Endpoint: GET /SefinNacional/nfse/{chaveAcesso}
+        
+        Args:
+            chave_acesso: Chave de acesso da NFS-e
+            
+        Returns:
+            Response com chaveAcesso e nfseXmlGZipB64
+            
+        Raises:
+            httpx.HTTPStatusError: Se status não for 2xx
+        """
+        response = await self.get(f"/SefinNacional/nfse/{chave_acesso}")
+        response.raise_for_status()
+        return response.json()
+    
     async def recepcionar_lote(self, lote_xml_gzip_b64: list[str]) -> Dict[str, Any]:
         """
         Recepciona um lote de documentos NFS-e no ADN (Ambiente de Distribuição Nacional).
@@ -264,3 +467,29 @@ class NFSeAPIClient(AsyncAPIClient):
         except Exception as e:
             app_logger.error(f"Erro ao recepcionar lote: {e}")
             raise
+
+
+# Instância global compartilhada (mantém o pool de conexões entre emissões)
+_nfse_api_client: Optional[NFSeAPIClient] = None
+
+
+def get_nfse_api_client(cert_path: Optional[str] = None, key_path: Optional[str] = None) -> NFSeAPIClient:
+    """
+    Retorna instância singleton do cliente Sefin NFS-e.
+    
+    Uma nova instância só é criada se os certificados mudarem.
+    
+    Args:
+        cert_path: Caminho para o arquivo do certificado (.pem) para mTLS
+        key_path: Caminho para o arquivo da chave privada (.pem) para mTLS
+    """
+    global _nfse_api_client
+    
+    if (
+        _nfse_api_client is None
+        or _nfse_api_client.cert_path != cert_path
+        or _nfse_api_client.key_path != key_path
+    ):
+        _nfse_api_client = NFSeAPIClient(cert_path=cert_path, key_path=key_path)
+    
+    return _nfse_api_client
@@ -0,0 +1,211 @@
+"""
+Worker em background que consome a fila persistente de emissão (emissao_jobs).
+
+Os lotes sobrevivem a recarregamentos da página e a reinícios do container:
+cada registro é um job no banco, e o worker retoma do ponto onde parou.
+"""
+import asyncio
+import threading
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import pytz
+
+from config.settings import settings
+from src.api.batch_emitter import BatchEmitter
+from src.database.repository import JobRepository, NFSeRepository
+from src.models.schemas import PrestadorServico, TomadorServico, Servico
+from src.utils.logger import app_logger
+from src.utils.runtime import run_sync
+
+
+# Emissão completa de uma nota: (prestador, tomador, servico, hash_transacao=...) -> resultado
+EmitNFSeFn = Callable[..., Awaitable[Dict[str, Any]]]
+
+
+def montar_payload(
+    prestador: PrestadorServico,
+    tomador: TomadorServico,
+    servico: Servico,
+    registro: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    Monta o payload JSON de um job a partir dos objetos da emissão.
+    
+    Args:
+        prestador: Dados do prestador
+        tomador: Dados do tomador
+        servico: Dados do serviço
+        registro: Registro original do PDF (nome, cpf, hash...)
+    
+    Returns:
+        Dicionário serializável em JSON
+    """
+    return {
+        'prestador': prestador.model_dump(mode='json'),
+        'tomador': tomador.model_dump(mode='json'),
+        'servico': servico.model_dump(mode='json'),
+        'registro': {
+            'nome': registro.get('nome'),
+            'cpf': registro.get('cpf'),
+            'hash': registro.get('hash'),
+        }
+    }
+
+
+class EmissionWorker:
+    """
+    Consome jobs pendentes a partir de uma thread própria.
+    
+    O ciclo roda no event loop compartilhado (run_sync), dono dos pools de
+    banco e HTTP; a thread apenas mantém o ciclo vivo e permite aguardar o fim.
+    
+    A cada ciclo reserva até `concurrency` jobs e os emite com BatchEmitter;
+    cada resultado é gravado no job assim que a emissão termina.
+    """
+    
+    def __init__(
+        self,
+        emit_fn: EmitNFSeFn,
+        concurrency: Optional[int] = None,
+        intervalo_poll: Optional[float] = None
+    ):
+        """
+        Args:
+            emit_fn: Corrotina de emissão completa (ex.: emitir_nfse_com_pdf)
+            concurrency: Jobs em voo ao mesmo tempo (padrão: settings.CONCURRENT_REQUESTS)
+            intervalo_poll: Espera entre consultas com fila vazia (segundos)
+        """
+        self.emit_fn = emit_fn
+        self.concurrency = max(1, concurrency or settings.CONCURRENT_REQUESTS)
+        self.intervalo_poll = intervalo_poll or settings.JOB_WORKER_POLL_INTERVAL
+        self.job_repository = JobRepository()
+        self.nfse_repository = NFSeRepository()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+    
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self) -> None:
+        """Inicia a thread do worker (idempotente)."""
+        if self.is_running:
+            return
+        
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._thread_main, name='emission-worker', daemon=True)
+        self._thread.start()
+        app_logger.info(f"Worker de emissão iniciado (concorrência {self.concurrency})")
+    
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Sinaliza parada e aguarda o ciclo atual terminar."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def _thread_main(self) -> None:
+        run_sync(self._run())
+    
+    async def _run(self) -> None:
+        emitter = BatchEmitter(self._emitir_job, concurrency=self.concurrency)
+        proxima_varredura = 0.0
+        
+        while not self._stop.is_set():
+            try:
+                # Jobs em 'processando' abandonados (ex.: container reiniciado logo
+                # após reservá-los) voltam para a fila assim que a reserva expira
+                if time.monotonic() >= proxima_varredura:
+                    await self.job_repository.requeue_stale_jobs(settings.JOB_STALE_TIMEOUT)
+                    proxima_varredura = time.monotonic() + settings.JOB_STALE_TIMEOUT / 2
+                
+                jobs = await self.job_repository.claim_jobs(self.concurrency)
+                
+                if not jobs:
+                    await asyncio.sleep(self.intervalo_poll)
+                    continue
+                
+                async for evento in emitter.stream(jobs):
+                    await self._registrar_resultado(jobs[evento['index']], evento['resultado'])
+                
+                for batch_id in {job['batch_id'] for job in jobs}:
+                    await self.job_repository.finalize_batch_if_done(batch_id)
+            
+            except Exception as e:
+                app_logger.error(f"Erro no worker de emissão: {e}", exc_info=True)
+                await asyncio.sleep(self.intervalo_poll)
+        
+        app_logger.info("Worker de emissão parado")
+    
+    async def _emitir_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Reconstrói os objetos do payload e emite a nota (idempotente pelo hash)."""
+        payload = job['payload']
+        
+        return await self.emit_fn(
+            PrestadorServico(**payload['prestador']),
+            TomadorServico(**payload['tomador']),
+            Servico(**payload['servico']),
+            hash_transacao=job['hash_transacao']
+        )
+    
+    async def _registrar_resultado(self, job: Dict[str, Any], resultado: Dict[str, Any]) -> None:
+        """Grava o resultado no job e, em caso de sucesso, a NFS-e no banco."""
+        registro = job['payload'].get('registro', {})
+        
+        if not resultado.get('sucesso'):
+            erro = resultado.get('erro') or resultado.get('mensagem') or 'Erro desconhecido'
+            status = await self.job_repository.fail_job(job['id'], erro)
+            app_logger.error(
+                f"[{job['indice'] + 1}] Falha na emissão de {registro.get('nome', 'N/A')} "
+                f"(tentativa {job['tentativas']}/{job['max_tentativas']}, {status}): {erro}"
+            )
+            return
+        
+        servico = job['payload']['servico']
+        valor = servico.get('valor_servico') or 0
+        aliquota_iss = servico.get('aliquota_iss') or 0
+        
+        nfse_data = {
+            'hash_transacao': job['hash_transacao'],
+            'chave_acesso': resultado['chave_acesso'],
+            'numero': resultado.get('numero', 'N/A'),
+            'data_emissao': datetime.now(pytz.timezone('America/Sao_Paulo')).strftime("%d/%m/%Y %H:%M:%S"),
+            'tomador_nome': registro.get('nome', 'N/A'),
+            'tomador_cpf': registro.get('cpf', 'N/A'),
+            'valor': valor,
+            'iss': valor * (aliquota_iss / 100),
+            'xml_path': resultado.get('xml_path'),
+            'pdf_path': resultado.get('pdf_path'),
+            'resultado_completo': resultado
+        }
+        
+        await self.job_repository.complete_job(job['id'], nfse_data)
+        
+        try:
+            await self.nfse_repository.save_nfse(nfse_data)
+        except Exception as e:
+            # A nota já está registrada no job; a gravação pode ser refeita pelo sync
+            app_logger.error(f"Erro ao salvar NFS-e do job {job['id']}: {e}")
+        
+        app_logger.info(f"[{job['indice'] + 1}] Job {job['id']} emitido: {resultado['chave_acesso'][:20]}...")
+
+
+# Instância global do worker
+_emission_worker: Optional[EmissionWorker] = None
+_emission_worker_lock = threading.Lock()
+
+
+def get_emission_worker(emit_fn: EmitNFSeFn) -> EmissionWorker:
+    """
+    Retorna o worker de emissão do processo, iniciando-o se necessário.
+    
+    Args:
+        emit_fn: Corrotina de emissão completa (usada apenas na criação)
+    """
+    global _emission_worker
+    with _emission_worker_lock:
+        if _emission_worker is None:
+            _emission_worker = EmissionWorker(emit_fn)
+        _emission_worker.start()
+    return _emission_worker
@@ -6,7 +6,7 @@ from typing import List, Dict, Any, Optional
 from datetime import datetime, date
 from decimal import Decimal
 
-from src.api.client import NFSeAPIClient
+from src.api.client import get_nfse_api_client
 from src.models.schemas import (
     NFSeRequest, NFSeResponse, ProcessingResult,
     PrestadorServico, TomadorServico, Servico,
@@ -32,7 +32,7 @@ class NFSeService:
         key_path = settings.CERTIFICATE_PATH.replace('.pfx', '_key.pem') if hasattr(settings, 'CERTIFICATE_PATH') else 'certificados/key.pem'
         
         # Inicializa cliente API com mTLS
-        self.client = NFSeAPIClient(cert_path=cert_path, key_path=key_path)
+        self.client = get_nfse_api_client(cert_path=cert_path, key_path=key_path)
         
         # Inicializa gerador de XML com assinatura
         ambiente = TipoAmbiente(settings.NFSE_API_AMBIENTE)
@@ -0,0 +1,346 @@
+"""
+Controle de tráfego para a API Sefin Nacional.
+
+Combina rate limiter (token bucket), concorrência adaptativa (AIMD) e
+circuit breaker. O estado é protegido por threading.Lock e as esperas usam
+asyncio.sleep, então a mesma instância pode ser compartilhada por clientes
+rodando em event loops diferentes (ex.: sessões Streamlit).
+"""
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Optional
+
+from config.settings import settings
+from src.utils.logger import app_logger
+
+
+# Status HTTP que indicam servidor sobrecarregado (reduzir ritmo)
+OVERLOAD_STATUS = {429, 503}
+
+# Status HTTP que indicam falha do servidor (contam para o circuit breaker)
+FAILURE_STATUS = {500, 502, 503, 504}
+
+
+class CircuitBreakerOpenError(Exception):
+    """Circuito aberto: a API está indisponível e a chamada foi recusada sem rede."""
+    
+    def __init__(self, retry_in: float):
+        self.retry_in = retry_in
+        super().__init__(f"API Sefin indisponível (circuit breaker aberto). Nova tentativa em {retry_in:.0f}s")
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Converte o header Retry-After em segundos.
+    
+    Args:
+        value: Valor do header (segundos ou data HTTP)
+    
+    Returns:
+        Segundos de espera ou None se ausente/inválido
+    """
+    if not value:
+        return None
+    
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    
+    try:
+        data = parsedate_to_datetime(value)
+        if data.tzinfo is None:
+            data = data.replace(tzinfo=timezone.utc)
+        return max(0.0, (data - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Rate limiter token bucket (requisições por segundo com rajada)."""
+    
+    def __init__(self, rate: float, capacity: int):
+        """
+        Args:
+            rate: Tokens repostos por segundo
+            capacity: Tamanho máximo da rajada
+        """
+        self.rate = max(rate, 0.001)
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    async def acquire(self) -> None:
+        """Aguarda até haver um token disponível e o consome."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            await asyncio.sleep(wait)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limite de requisições simultâneas com ajuste AIMD.
+    
+    Sucesso aumenta o limite aditivamente (+1 a cada `limite` sucessos);
+    sobrecarga (429/503/timeout) reduz multiplicativamente e pode pausar
+    novas requisições pelo tempo indicado em Retry-After.
+    
+    A redução acontece no máximo uma vez por episódio: sobrecargas de
+    requisições que já estavam em voo na última redução são ignoradas, e só
+    as iniciadas depois dela podem reduzir o limite de novo.
+    """
+    
+    POLL_INTERVAL = 0.05
+    
+    def __init__(self, inicial: int, minimo: int, maximo: int, fator_reducao: float):
+        self.minimo = max(1, minimo)
+        self.maximo = max(self.minimo, maximo)
+        self.fator_reducao = fator_reducao
+        self._limite = float(min(max(inicial, self.minimo), self.maximo))
+        self._em_voo = 0
+        self._pausa_ate = 0.0
+        self._iniciadas = 0  # Sequência de requisições liberadas por acquire()
+        self._iniciadas_na_reducao = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def limite(self) -> int:
+        return int(self._limite)
+    
+    @property
+    def em_voo(self) -> int:
+        return self._em_voo
+    
+    async def acquire(self) -> int:
+        """
+        Aguarda uma vaga dentro do limite atual.
+        
+        Returns:
+            Sequência da requisição, a ser repassada a on_overload
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._pausa_ate:
+                    wait = self._pausa_ate - now
+                elif self._em_voo < int(self._limite):
+                    self._em_voo += 1
+                    self._iniciadas += 1
+                    return self._iniciadas
+                else:
+                    wait = self.POLL_INTERVAL
+            await asyncio.sleep(wait)
+    
+    def release(self) -> None:
+        with self._lock:
+            self._em_voo = max(0, self._em_voo - 1)
+    
+    def on_success(self) -> None:
+        """Aumento aditivo do limite."""
+        with self._lock:
+            self._limite = min(self.maximo, self._limite + 1 / self._limite)
+    
+    def on_overload(self, retry_after: Optional[float] = None, sequencia: Optional[int] = None) -> None:
+        """
+        Redução multiplicativa do limite e pausa opcional (Retry-After).
+        
+        Args:
+            retry_after: Pausa pedida pelo servidor (segundos)
+            sequencia: Sequência da requisição sobrecarregada (retorno de acquire);
+                se ela já estava em voo na última redução, o limite é mantido
+        """
+        with self._lock:
+            if retry_after:
+                self._pausa_ate = max(self._pausa_ate, time.monotonic() + retry_after)
+            
+            if sequencia is not None and sequencia <= self._iniciadas_na_reducao:
+                return
+            
+            anterior = int(self._limite)
+            self._limite = max(self.minimo, self._limite * self.fator_reducao)
+            self._iniciadas_na_reducao = self._iniciadas
+        
+        app_logger.warning(
+            f"Sefin sobrecarregada - concorrência {anterior} → {int(self._limite)}"
+            + (f", pausa de {retry_after:.0f}s" if retry_after else "")
+        )
+
+
+class CircuitBreaker:
+    """Circuit breaker (fechado → aberto → meio-aberto)."""
+    
+    FECHADO = "fechado"
+    ABERTO = "aberto"
+    MEIO_ABERTO = "meio_aberto"
+    
+    def __init__(self, limite_falhas: int, tempo_reset: float):
+        """
+        Args:
+            limite_falhas: Falhas consecutivas para abrir o circuito
+            tempo_reset: Segundos com circuito aberto antes de testar novamente
+        """
+        self.limite_falhas = max(1, limite_falhas)
+        self.tempo_reset = tempo_reset
+        self._estado = self.FECHADO
+        self._falhas = 0
+        self._aberto_em = 0.0
+        self._teste_em_andamento = False
+        self._teste_iniciado_em = 0.0
+        self._lock = threading.Lock()
+    
+    @property
+    def estado(self) -> str:
+        return self._estado
+    
+    def before_call(self) -> None:
+        """
+        Verifica se a chamada pode prosseguir.
+        
+        Raises:
+            CircuitBreakerOpenError: Se o circuito estiver aberto
+        """
+        with self._lock:
+            if self._estado == self.FECHADO:
+                return
+            
+            restante = self._aberto_em + self.tempo_reset - time.monotonic()
+            if self._estado == self.ABERTO and restante <= 0:
+                self._estado = self.MEIO_ABERTO
+                self._teste_em_andamento = False
+            
+            # Meio-aberto: libera uma única requisição de teste
+            # (ou nova tentativa se o teste anterior nunca reportou resultado)
+            teste_expirado = time.monotonic() - self._teste_iniciado_em > self.tempo_reset
+            if self._estado == self.MEIO_ABERTO and (not self._teste_em_andamento or teste_expirado):
+                self._teste_em_andamento = True
+                self._teste_iniciado_em = time.monotonic()
+                app_logger.info("Circuit breaker meio-aberto: enviando requisição de teste")
+                return
+            
+            raise CircuitBreakerOpenError(max(restante, 1.0))
+    
+    def record_success(self) -> None:
+        with self._lock:
+            if self._estado != self.FECHADO:
+                app_logger.info("Circuit breaker fechado: API Sefin respondendo novamente")
+            self._estado = self.FECHADO
+            self._falhas = 0
+            self._teste_em_andamento = False
+    
+    def record_failure(self) -> None:
+        with self._lock:
+            self._falhas += 1
+            if self._estado == self.MEIO_ABERTO or self._falhas >= self.limite_falhas:
+                if self._estado != self.ABERTO:
+                    app_logger.error(
+                        f"Circuit breaker aberto após {self._falhas} falha(s) - "
+                        f"chamadas bloqueadas por {self.tempo_reset:.0f}s"
+                    )
+                self._estado = self.ABERTO
+                self._aberto_em = time.monotonic()
+                self._teste_em_andamento = False
+
+
+class SefinTrafficController:
+    """Ponto único de controle de tráfego usado pelos clientes da Sefin."""
+    
+    def __init__(
+        self,
+        bucket: TokenBucket,
+        concorrencia: AdaptiveConcurrencyLimiter,
+        breaker: CircuitBreaker
+    ):
+        self.bucket = bucket
+        self.concorrencia = concorrencia
+        self.breaker = breaker
+    
+    @classmethod
+    def from_settings(cls) -> "SefinTrafficController":
+        """Cria o controlador a partir das configurações da aplicação."""
+        return cls(
+            bucket=TokenBucket(settings.SEFIN_RATE_LIMIT_PER_SEC, settings.SEFIN_RATE_LIMIT_BURST),
+            concorrencia=AdaptiveConcurrencyLimiter(
+                inicial=settings.SEFIN_CONCURRENCY_INICIAL,
+                minimo=settings.SEFIN_CONCURRENCY_MIN,
+                maximo=settings.SEFIN_CONCURRENCY_MAX,
+                fator_reducao=settings.SEFIN_AIMD_FATOR_REDUCAO
+            ),
+            breaker=CircuitBreaker(
+                limite_falhas=settings.SEFIN_CIRCUIT_LIMITE_FALHAS,
+                tempo_reset=settings.SEFIN_CIRCUIT_TEMPO_RESET
+            )
+        )
+    
+    async def acquire(self) -> int:
+        """
+        Reserva uma vaga para requisição (circuit breaker → concorrência → taxa).
+        
+        Returns:
+            Sequência da requisição, a ser repassada a record_response/record_timeout
+        
+        Raises:
+            CircuitBreakerOpenError: Se a API estiver marcada como indisponível
+        """
+        self.breaker.before_call()
+        sequencia = await self.concorrencia.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.concorrencia.release()
+            raise
+        return sequencia
+    
+    def release(self) -> None:
+        self.concorrencia.release()
+    
+    def record_response(
+        self,
+        status_code: int,
+        retry_after: Optional[float] = None,
+        sequencia: Optional[int] = None
+    ) -> None:
+        """Atualiza limites e circuito a partir do status HTTP recebido."""
+        if status_code in OVERLOAD_STATUS:
+            self.concorrencia.on_overload(retry_after, sequencia)
+        
+        if status_code in FAILURE_STATUS:
+            self.breaker.record_failure()
+            if status_code not in OVERLOAD_STATUS:
+                self.concorrencia.on_overload(sequencia=sequencia)
+        elif status_code not in OVERLOAD_STATUS:
+            self.breaker.record_success()
+            self.concorrencia.on_success()
+    
+    def record_timeout(self, sequencia: Optional[int] = None) -> None:
+        """Timeout ou erro de rede: conta como sobrecarga e falha."""
+        self.concorrencia.on_overload(sequencia=sequencia)
+        self.breaker.record_failure()
+
+
+# Instância global compartilhada por todos os clientes Sefin do processo
+_sefin_controller: Optional[SefinTrafficController] = None
+_sefin_controller_lock = threading.Lock()
+
+
+def get_sefin_traffic_controller() -> SefinTrafficController:
+    """Retorna instância singleton do controlador de tráfego da Sefin."""
+    global _sefin_controller
+    
+    with _sefin_controller_lock:
+        if _sefin_controller is None:
+            _sefin_controller = SefinTrafficController.from_settings()
+    
+    return _sefin_controller
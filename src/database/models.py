@@ -1,9 +1,13 @@
 """
 Modelos ORM do banco de dados usando SQLAlchemy.
 """
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Numeric, Text, LargeBinary
+from sqlalchemy import (
+    Column, Integer, BigInteger, String, Date, DateTime, Boolean, Numeric, Text, LargeBinary, Index, extract
+)
+from sqlalchemy.orm import deferred
 from sqlalchemy.sql import func
 from datetime import datetime
+import json
 
 from config.database import Base
 
@@ -39,9 +43,14 @@ class NFSeEmissao(Base):
     xml_path = Column(String(500))
     pdf_path = Column(String(500))
     
-    # Conteúdo dos arquivos (armazenado no banco)
-    xml_content = Column(Text)  # Conteúdo XML
-    pdf_content = Column(LargeBinary)  # Conteúdo PDF em binário
+    # Conteúdo dos arquivos: SHA-256 do XML/PDF no blob store (src/storage)
+    xml_sha256 = Column(String(64), index=True)
+    pdf_sha256 = Column(String(64), index=True)
+    
+    # Conteúdo inline legado (antes do blob store). migrate_database.py move
+    # para o blob store e limpa; adiados para não pesar nas listagens
+    xml_content = deferred(Column(Text))  # Conteúdo XML
+    pdf_content = deferred(Column(LargeBinary))  # Conteúdo PDF em binário
     
     # Resultado completo (JSON)
     resultado_json = Column(Text)  # JSON string com resultado completo
@@ -59,9 +68,15 @@ class NFSeEmissao(Base):
     def __repr__(self):
         return f"<NFSeEmissao(id={self.id}, chave={self.chave_acesso[:20] if self.chave_acesso else 'N/A'}..., status={self.status})>"
     
-    def to_dict(self):
-        """Converte para dicionário compatível com session_state."""
-        return {
+    def to_dict(self, incluir_conteudo: bool = False):
+        """
+        Converte para dicionário compatível com session_state.
+        
+        Args:
+            incluir_conteudo: Inclui xml_content/pdf_content (exige que tenham
+                sido carregados na consulta, ex.: com undefer)
+        """
+        dados = {
             'id': self.id,
             'chave_acesso': self.chave_acesso,
             'numero': self.numero_nfse,
@@ -72,10 +87,52 @@ class NFSeEmissao(Base):
             'iss': float(self.valor_iss) if self.valor_iss else 0,
             'xml_path': self.xml_path,
             'pdf_path': self.pdf_path,
-            'xml_content': self.xml_content,
-            'pdf_content': self.pdf_content,
             'status': self.status
         }
+        
+        if incluir_conteudo:
+            dados['xml_content'] = self.xml_content
+            dados['pdf_content'] = self.pdf_content
+        
+        return dados
+
+
+# Índices das consultas de listagem e busca. Em bancos já existentes são
+# criados por migrate_database.py (create_all não altera tabelas existentes).
+Index('ix_nfse_emissoes_status_created_at', NFSeEmissao.status, NFSeEmissao.created_at.desc())
+Index('ix_nfse_emissoes_cpf_created_at', NFSeEmissao.cpf_tomador, NFSeEmissao.created_at.desc())
+Index(
+    'ix_nfse_emissoes_status_data_emissao',
+    NFSeEmissao.status, NFSeEmissao.data_emissao.desc(), NFSeEmissao.id.desc()
+)
+
+# Apenas PostgreSQL: filtro por mês (qualquer ano). O índice trigram da busca
+# por trecho do nome (ix_nfse_emissoes_nome_trgm) fica só em migrate_database.py,
+# que o pula quando o papel do banco não pode criar a extensão pg_trgm
+Index('ix_nfse_emissoes_mes_emissao', extract('month', NFSeEmissao.data_emissao)).ddl_if(dialect='postgresql')
+
+
+class NFSeResumoDiario(Base):
+    """
+    Totais diários de nfse_emissoes por status (rollup do dashboard).
+    
+    Mantido pelo NFSeRepository a cada gravação: os dias afetados são
+    recalculados na mesma transação do INSERT.
+    """
+    
+    __tablename__ = 'nfse_resumo_diario'
+    
+    dia = Column(Date, primary_key=True)  # Dia de data_emissao
+    status = Column(String(20), primary_key=True)
+    
+    quantidade = Column(Integer, nullable=False, default=0)
+    valor_servico = Column(Numeric(14, 2), nullable=False, default=0)
+    valor_iss = Column(Numeric(14, 2), nullable=False, default=0)
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<NFSeResumoDiario(dia={self.dia}, status={self.status}, quantidade={self.quantidade})>"
 
 
 class LogProcessamento(Base):
@@ -114,6 +171,141 @@ class LogProcessamento(Base):
         return f"<LogProcessamento(id={self.id}, batch={self.batch_id}, total={self.total_registros})>"
 
 
+class EmissaoJob(Base):
+    """Job de emissão de um registro de lote (fila persistente)."""
+    
+    __tablename__ = 'emissao_jobs'
+    __table_args__ = (
+        # Busca de jobs pendentes na ordem do lote
+        Index('ix_emissao_jobs_status_id', 'status', 'id'),
+    )
+    
+    id = Column(Integer, primary_key=True, index=True)
+    
+    # Lote (LogProcessamento.batch_id) e posição do registro no lote
+    batch_id = Column(String(36), nullable=False, index=True)
+    indice = Column(Integer, nullable=False)
+    
+    # Identificação do registro
+    hash_transacao = Column(String(64), index=True)
+    cpf_tomador = Column(String(14))
+    nome_tomador = Column(String(150))
+    
+    # Status: pendente, processando, sucesso, erro
+    status = Column(String(20), nullable=False, default='pendente')
+    tentativas = Column(Integer, nullable=False, default=0)
+    max_tentativas = Column(Integer, nullable=False, default=3)
+    
+    # Dados de entrada (prestador/tomador/servico) e resultado, em JSON
+    payload_json = Column(Text, nullable=False)
+    resultado_json = Column(Text)
+    erro = Column(Text)
+    
+    # Início do processamento atual (para recuperar jobs órfãos após restart)
+    locked_at = Column(DateTime)
+    
+    created_at = Column(DateTime, default=datetime.utcnow, server_default=func.now())
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<EmissaoJob(id={self.id}, batch={self.batch_id}, indice={self.indice}, status={self.status})>"
+    
+    def to_dict(self):
+        """Converte para dicionário (payload/resultado já decodificados)."""
+        return {
+            'id': self.id,
+            'batch_id': self.batch_id,
+            'indice': self.indice,
+            'hash_transacao': self.hash_transacao,
+            'cpf_tomador': self.cpf_tomador,
+            'nome_tomador': self.nome_tomador,
+            'status': self.status,
+            'tentativas': self.tentativas,
+            'max_tentativas': self.max_tentativas,
+            'payload': json.loads(self.payload_json) if self.payload_json else {},
+            'resultado': json.loads(self.resultado_json) if self.resultado_json else None,
+            'erro': self.erro
+        }
+
+
+class EmissaoIdempotencia(Base):
+    """
+    Registro de idempotência da emissão, por hash de transação (PACIENTEBLIS).
+    
+    Guarda o DPS reservado para o hash antes do envio; uma nova tentativa
+    reaproveita o mesmo DPS (e a chave, se já autorizada) em vez de gerar
+    um documento fiscal duplicado.
+    """
+    
+    __tablename__ = 'emissao_idempotencia'
+    
+    id = Column(Integer, primary_key=True, index=True)
+    
+    hash_transacao = Column(String(64), unique=True, nullable=False, index=True)
+    
+    # DPS reservado para o hash
+    id_dps = Column(String(50), nullable=False)
+    numero_dps = Column(Integer, nullable=False)
+    
+    # Status: reservado (enviado ou a enviar), emitido, rejeitado
+    status = Column(String(20), nullable=False, default='reservado')
+    chave_acesso = Column(String(100), index=True)
+    resultado_json = Column(Text)  # Retorno de emitir_nfse_com_pdf
+    erro = Column(Text)
+    
+    # Início do envio em andamento (None = nenhuma tentativa enviando o DPS)
+    envio_desde = Column(DateTime)
+    
+    created_at = Column(DateTime, default=datetime.utcnow, server_default=func.now())
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<EmissaoIdempotencia(hash={self.hash_transacao[:8]}..., dps={self.numero_dps}, status={self.status})>"
+    
+    def to_dict(self):
+        """Converte para dicionário (resultado já decodificado)."""
+        return {
+            'hash_transacao': self.hash_transacao,
+            'id_dps': self.id_dps,
+            'numero_dps': self.numero_dps,
+            'status': self.status,
+            'chave_acesso': self.chave_acesso,
+            'resultado': json.loads(self.resultado_json) if self.resultado_json else None,
+            'erro': self.erro
+        }
+
+
+class DPSSequencia(Base):
+    """Numeração durável e monotônica de DPS por prestador e série."""
+    
+    __tablename__ = 'dps_sequencia'
+    
+    cnpj = Column(String(14), primary_key=True)
+    serie = Column(String(5), primary_key=True)
+    ultimo_numero = Column(Integer, nullable=False)
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<DPSSequencia(cnpj={self.cnpj}, serie={self.serie}, ultimo={self.ultimo_numero})>"
+
+
+class SyncEstado(Base):
+    """Marca d'água de sincronizações incrementais (ex.: diário local -> banco)."""
+    
+    __tablename__ = 'sync_estado'
+    
+    nome = Column(String(50), primary_key=True)
+    posicao = Column(BigInteger, nullable=False, default=0)  # Byte logo após a última linha sincronizada
+    inicio_ultima = Column(BigInteger)  # Byte de início da última linha sincronizada
+    ultima_chave = Column(String(100))  # Chave de acesso dessa linha, para validar a posição
+    
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=func.now())
+    
+    def __repr__(self):
+        return f"<SyncEstado(nome={self.nome}, posicao={self.posicao})>"
+
+
 class Usuario(Base):
     """Usuários do sistema (para autenticação)."""
     
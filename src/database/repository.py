@@ -2,17 +2,31 @@
 Repositório de acesso a dados (Data Access Layer).
 Version: 2.4-delete-method
 """
+import asyncio
+import base64
+import sqlite3
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import select, func, and_, desc, delete
+from decimal import Decimal
+from sqlalchemy import select, func, and_, or_, desc, delete, update, extract
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import load_only
 import uuid
 import json
+import pytz
 
-from src.database.models import NFSeEmissao, LogProcessamento, Usuario
+from src.database.models import (
+    NFSeEmissao, NFSeResumoDiario, LogProcessamento, Usuario, EmissaoJob, EmissaoIdempotencia,
+    DPSSequencia, SyncEstado
+)
 from src.models.schemas import ProcessingResult
+from src.storage.blob_store import get_blob_store
 from src.utils.logger import app_logger
 from config.database import get_db_session
+from config.settings import settings
 
 
 class NFSeRepository:
@@ -30,91 +44,212 @@ class NFSeRepository:
             usuario: Nome do usuário que executou
             
         Returns:
-            ID do registro criado
+            ID do registro criado (ou do já existente com a mesma chave)
         """
-        from pathlib import Path
+        ids = await self.save_batch_nfse([nfse_data], usuario)
+        chave = nfse_data.get('chave_acesso')
+        
+        app_logger.info(f"NFS-e salva no banco: ID={ids[0]}, Chave={chave[:20] if chave else 'N/A'}...")
+        
+        return ids[0]
+    
+    async def save_batch_nfse(
+        self,
+        nfse_list: List[Dict[str, Any]],
+        usuario: str = "admin",
+        atualizar: bool = False
+    ) -> List[int]:
+        """
+        Salva múltiplas NFS-e em lote com INSERT ... ON CONFLICT (chave_acesso).
+        
+        As linhas são enviadas em INSERTs multi-linha (blocos limitados pelo
+        número de parâmetros do banco) dentro de uma única transação.
+        Notas já existentes são ignoradas ou, com `atualizar`, têm os
+        metadados atualizados.
+        
+        Args:
+            nfse_list: Lista de dicionários com dados das NFS-e
+            usuario: Nome do usuário
+            atualizar: Atualiza metadados de chaves já existentes
+            
+        Returns:
+            IDs dos registros, na ordem de `nfse_list` (sem duplicatas de chave)
+        """
+        if not nfse_list:
+            return []
+        
+        # Leitura dos XML/PDF do disco fora do event loop
+        linhas = await asyncio.to_thread(self._montar_linhas, nfse_list, usuario)
         
         async with get_db_session() as session:
-            # Verificar se já existe
+            dialeto = session.bind.dialect.name
+            insert = pg_insert if dialeto == 'postgresql' else sqlite_insert
+            tamanho_bloco = self._tamanho_bloco(dialeto, len(linhas[0]))
+            
+            ids_por_chave: Dict[str, int] = {}
+            # Linhas sem chave: uma a uma, pois a ordem do RETURNING de um
+            # INSERT multi-linha não é garantida e não há outra coluna que as
+            # identifique (índice em `linhas` -> id)
+            ids_sem_chave: Dict[int, int] = {}
+            for indice, linha in enumerate(linhas):
+                if not linha['chave_acesso']:
+                    result = await session.execute(insert(NFSeEmissao).values(linha).returning(NFSeEmissao.id))
+                    ids_sem_chave[indice] = result.scalar_one()
+            
+            com_chave = [linha for linha in linhas if linha['chave_acesso']]
+            for inicio in range(0, len(com_chave), tamanho_bloco):
+                bloco = com_chave[inicio:inicio + tamanho_bloco]
+                stmt = insert(NFSeEmissao).values(bloco)
+                
+                if atualizar:
+                    stmt = stmt.on_conflict_do_update(
+                        index_elements=[NFSeEmissao.chave_acesso],
+                        set_={
+                            coluna: getattr(stmt.excluded, coluna)
+                            for coluna in self._COLUNAS_ATUALIZAVEIS
+                        }
+                    )
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=[NFSeEmissao.chave_acesso])
+                
+                result = await session.execute(stmt.returning(NFSeEmissao.id, NFSeEmissao.chave_acesso))
+                ids_por_chave.update({chave: id_ for id_, chave in result.all()})
+            
+            # Chaves que já existiam (DO NOTHING não as retorna): uma consulta só
+            faltantes = [
+                linha['chave_acesso'] for linha in linhas
+                if linha['chave_acesso'] and linha['chave_acesso'] not in ids_por_chave
+            ]
+            for inicio in range(0, len(faltantes), tamanho_bloco):
+                result = await session.execute(
+                    select(NFSeEmissao.id, NFSeEmissao.chave_acesso)
+                    .where(NFSeEmissao.chave_acesso.in_(faltantes[inicio:inicio + tamanho_bloco]))
+                )
+                ids_por_chave.update({chave: id_ for id_, chave in result.all()})
+            
+            await self._atualizar_resumo_diario(session, [linha['data_emissao'] for linha in linhas])
+        
+        ids = [
+            ids_por_chave[linha['chave_acesso']] if linha['chave_acesso'] else ids_sem_chave[indice]
+            for indice, linha in enumerate(linhas)
+        ]
+        
+        app_logger.info(f"{len(ids)} NFS-e salvas no banco")
+        
+        return ids
+    
+    # Colunas sobrescritas em save_batch_nfse(atualizar=True); conteúdo e
+    # datas de criação permanecem os da primeira gravação
+    _COLUNAS_ATUALIZAVEIS = (
+        'hash_transacao', 'numero_nfse', 'cpf_tomador', 'nome_tomador',
+        'valor_servico', 'valor_iss', 'xml_path', 'pdf_path', 'resultado_json',
+        'data_processamento', 'usuario',
+    )
+    
+    @staticmethod
+    def _tamanho_bloco(dialeto: str, colunas: int) -> int:
+        """Linhas por INSERT, respeitando o limite de parâmetros por comando."""
+        if dialeto == 'postgresql':
+            limite = 32767
+        else:
+            limite = 32766 if sqlite3.sqlite_version_info >= (3, 32) else 999
+        return max(1, min(settings.DB_BULK_CHUNK_SIZE, limite // colunas))
+    
+    @staticmethod
+    def _montar_linhas(nfse_list: List[Dict[str, Any]], usuario: str) -> List[Dict[str, Any]]:
+        """
+        Converte os dicionários da sessão em linhas de nfse_emissoes.
+        
+        Lê o XML e o PDF de cada nota do disco e os grava no blob store
+        (operações bloqueantes); a linha guarda apenas os hashes. Remove
+        chaves repetidas, mantendo a primeira ocorrência.
+        """
+        from pathlib import Path
+        
+        # Usar datetime naive (sem timezone) para compatibilidade com PostgreSQL TIMESTAMP WITHOUT TIME ZONE
+        # O PostgreSQL converterá para o timezone do servidor automaticamente
+        agora = datetime.now()
+        # Notas sem data de emissão: horário de Brasília, como as demais
+        agora_brasilia = datetime.now(pytz.timezone('America/Sao_Paulo')).replace(tzinfo=None)
+        blob_store = get_blob_store()
+        
+        linhas = []
+        chaves = set()
+        
+        for nfse_data in nfse_list:
             chave = nfse_data.get('chave_acesso')
             if chave:
-                stmt = select(NFSeEmissao).where(NFSeEmissao.chave_acesso == chave)
-                result = await session.execute(stmt)
-                existing = result.scalar_one_or_none()
-                if existing:
-                    app_logger.debug(f"NFS-e já existe no banco: {chave[:20]}...")
-                    return existing.id
+                if chave in chaves:
+                    continue
+                chaves.add(chave)
             
-            # Ler conteúdo dos arquivos XML e PDF
-            xml_content = None
-            pdf_content = None
+            # Copiar XML e PDF para o blob store (endereçado por conteúdo)
+            xml_sha256 = None
+            pdf_sha256 = None
             
             xml_path = nfse_data.get('xml_path')
             if xml_path and Path(xml_path).exists():
                 try:
-                    xml_content = Path(xml_path).read_text(encoding='utf-8')
+                    xml_sha256 = blob_store.put('xml', Path(xml_path).read_bytes())
                 except Exception as e:
-                    app_logger.warning(f"Erro ao ler XML: {e}")
+                    app_logger.warning(f"Erro ao armazenar XML: {e}")
             
             pdf_path = nfse_data.get('pdf_path')
             if pdf_path and Path(pdf_path).exists():
                 try:
-                    pdf_content = Path(pdf_path).read_bytes()
+                    pdf_sha256 = blob_store.put('pdf', Path(pdf_path).read_bytes())
                 except Exception as e:
-                    app_logger.warning(f"Erro ao ler PDF: {e}")
-            
-            # Usar datetime naive (sem timezone) para compatibilidade com PostgreSQL TIMESTAMP WITHOUT TIME ZONE
-            # O PostgreSQL converterá para o timezone do servidor automaticamente
-            agora = datetime.now()
+                    app_logger.warning(f"Erro ao armazenar PDF: {e}")
             
-            emissao = NFSeEmissao(
-                chave_acesso=nfse_data.get('chave_acesso'),
-                numero_nfse=nfse_data.get('numero'),
-                cpf_tomador=nfse_data.get('tomador_cpf', '').replace('.', '').replace('-', '').replace('/', ''),
-                nome_tomador=nfse_data.get('tomador_nome'),
-                status='sucesso',
-                valor_servico=nfse_data.get('valor'),
-                valor_iss=nfse_data.get('iss'),
-                xml_path=nfse_data.get('xml_path'),
-                pdf_path=nfse_data.get('pdf_path'),
-                xml_content=xml_content,
-                pdf_content=pdf_content,
-                resultado_json=json.dumps(nfse_data.get('resultado_completo', {}), default=str),
-                data_emissao=agora,
-                data_processamento=agora,
-                usuario=usuario
-            )
-            
-            session.add(emissao)
-            await session.flush()
-            
-            app_logger.info(f"NFS-e salva no banco: ID={emissao.id}, Chave={chave[:20] if chave else 'N/A'}...")
-            
-            return emissao.id
+            linhas.append({
+                'hash_transacao': nfse_data.get('hash_transacao'),
+                'chave_acesso': chave,
+                'numero_nfse': nfse_data.get('numero'),
+                'cpf_tomador': (nfse_data.get('tomador_cpf') or '').replace('.', '').replace('-', '').replace('/', ''),
+                'nome_tomador': nfse_data.get('tomador_nome'),
+                'status': 'sucesso',
+                'valor_servico': nfse_data.get('valor'),
+                'valor_iss': nfse_data.get('iss'),
+                'xml_path': xml_path,
+                'pdf_path': pdf_path,
+                'xml_sha256': xml_sha256,
+                'pdf_sha256': pdf_sha256,
+                'resultado_json': json.dumps(nfse_data.get('resultado_completo', {}), default=str),
+                'data_emissao': NFSeRepository._data_emissao(nfse_data.get('data_emissao')) or agora_brasilia,
+                'data_processamento': agora,
+                'created_at': agora,
+                'updated_at': agora,
+                'usuario': usuario,
+            })
+        
+        return linhas
     
-    async def save_batch_nfse(self, nfse_list: List[Dict[str, Any]], usuario: str = "admin") -> List[int]:
+    @staticmethod
+    def _data_emissao(valor: Any) -> Optional[datetime]:
         """
-        Salva múltiplas NFS-e em lote.
+        Data de emissão informada na nota, como datetime naive.
+        
+        A sessão grava 'DD/MM/AAAA HH:MM:SS' no horário de Brasília; o valor
+        é mantido nesse horário (é ele que define o dia e a competência).
         
-        Args:
-            nfse_list: Lista de dicionários com dados das NFS-e
-            usuario: Nome do usuário
-            
         Returns:
-            Lista de IDs criados
+            None se ausente ou em formato não reconhecido
         """
-        ids = []
+        if isinstance(valor, datetime):
+            return valor.replace(tzinfo=None)
+        if not valor:
+            return None
         
-        for nfse_data in nfse_list:
+        for formato in ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y"):
             try:
-                id = await self.save_nfse(nfse_data, usuario)
-                ids.append(id)
-            except Exception as e:
-                app_logger.error(f"Erro ao salvar NFS-e: {e}")
-        
-        app_logger.info(f"{len(ids)} NFS-e salvas no banco")
-        
-        return ids
+                return datetime.strptime(str(valor), formato)
+            except ValueError:
+                continue
+        try:
+            return datetime.fromisoformat(str(valor)).replace(tzinfo=None)
+        except ValueError:
+            app_logger.warning(f"Data de emissão não reconhecida ({valor}), usando a data atual")
+            return None
     
     async def get_all_nfse(self, limit: int = 1000) -> List[Dict[str, Any]]:
         """
@@ -124,11 +259,13 @@ class NFSeRepository:
             limit: Limite de registros
             
         Returns:
-            Lista de dicionários com dados das NFS-e
+            Lista de dicionários com os metadados das NFS-e (sem XML/PDF;
+            busque o conteúdo sob demanda com get_nfse_xml/get_nfse_pdf)
         """
         async with get_db_session() as session:
             stmt = (
                 select(NFSeEmissao)
+                .options(load_only(*self._COLUNAS_LISTAGEM))
                 .where(NFSeEmissao.status == 'sucesso')
                 .order_by(desc(NFSeEmissao.created_at))
                 .limit(limit)
@@ -138,6 +275,223 @@ class NFSeRepository:
             
             return [e.to_dict() for e in emissoes]
     
+    # Ordenações de search(): chave -> (expressão, decrescente)
+    _ORDENACOES = {
+        'recentes': (NFSeEmissao.data_emissao, True),
+        'antigas': (NFSeEmissao.data_emissao, False),
+        'maior_valor': (func.coalesce(NFSeEmissao.valor_servico, 0), True),
+        'menor_valor': (func.coalesce(NFSeEmissao.valor_servico, 0), False),
+    }
+    
+    @staticmethod
+    def _filtros_busca(
+        nome: Optional[str],
+        cpf: Optional[str],
+        mes: Optional[int],
+        periodo: Optional[str]
+    ) -> List[Any]:
+        """Condições WHERE de search() (sempre restritas a notas emitidas)."""
+        condicoes = [NFSeEmissao.status == 'sucesso']
+        
+        if nome:
+            condicoes.append(NFSeEmissao.nome_tomador.ilike(f"%{nome.strip()}%"))
+        
+        if cpf:
+            digitos = ''.join(c for c in cpf if c.isdigit())
+            if len(digitos) in (11, 14):
+                condicoes.append(NFSeEmissao.cpf_tomador == digitos)
+            elif digitos:
+                condicoes.append(NFSeEmissao.cpf_tomador.contains(digitos))
+        
+        if mes:
+            condicoes.append(extract('month', NFSeEmissao.data_emissao) == int(mes))
+        
+        if periodo:
+            # 'MM/AAAA' vira intervalo em data_emissao (usa o índice da coluna)
+            mes_periodo, ano_periodo = (int(parte) for parte in periodo.split('/'))
+            inicio = datetime(ano_periodo, mes_periodo, 1)
+            fim = datetime(ano_periodo + mes_periodo // 12, mes_periodo % 12 + 1, 1)
+            condicoes.append(NFSeEmissao.data_emissao >= inicio)
+            condicoes.append(NFSeEmissao.data_emissao < fim)
+        
+        return condicoes
+    
+    @staticmethod
+    def _codificar_pagina(valor: Any, id_: int) -> str:
+        if isinstance(valor, datetime):
+            valor = valor.isoformat()
+        elif valor is not None:
+            valor = str(valor)
+        return base64.urlsafe_b64encode(json.dumps([valor, id_]).encode('utf-8')).decode('ascii')
+    
+    @staticmethod
+    def _decodificar_pagina(page: str, ordem: str) -> tuple:
+        valor, id_ = json.loads(base64.urlsafe_b64decode(page.encode('ascii')))
+        if ordem in ('recentes', 'antigas'):
+            valor = datetime.fromisoformat(valor) if valor else None
+        else:
+            valor = Decimal(valor)
+        return valor, id_
+    
+    async def search(
+        self,
+        nome: Optional[str] = None,
+        cpf: Optional[str] = None,
+        mes: Optional[int] = None,
+        periodo: Optional[str] = None,
+        ordem: str = 'recentes',
+        page: Optional[str] = None,
+        page_size: Optional[int] = 50
+    ) -> Dict[str, Any]:
+        """
+        Busca NFS-e emitidas com filtros, ordenação e paginação por keyset.
+        
+        A página seguinte é identificada pelo último item da atual (valor da
+        ordenação + id), então o custo de cada página não cresce com a
+        posição na listagem. Totais vêm de um único agregado SQL.
+        
+        Args:
+            nome: Trecho do nome do tomador (sem diferenciar maiúsculas)
+            cpf: CPF/CNPJ completo ou trecho (pontuação é ignorada)
+            mes: Mês de emissão 1-12, de qualquer ano
+            periodo: Mês/ano de emissão no formato 'MM/AAAA'
+            ordem: 'recentes', 'antigas', 'maior_valor' ou 'menor_valor'
+            page: Token 'proxima_pagina' de uma chamada anterior (None = primeira)
+            page_size: Itens por página (None = todos, ex.: exportação)
+            
+        Returns:
+            Dicionário com 'itens' (metadados, sem XML/PDF), 'total',
+            'valor_total', 'iss_total' e 'proxima_pagina' (None na última)
+        """
+        if ordem not in self._ORDENACOES:
+            raise ValueError(f"Ordenação inválida: {ordem}")
+        
+        chave_ordem, decrescente = self._ORDENACOES[ordem]
+        condicoes = self._filtros_busca(nome, cpf, mes, periodo)
+        
+        async with get_db_session() as session:
+            totais = (await session.execute(
+                select(
+                    func.count(NFSeEmissao.id),
+                    func.coalesce(func.sum(NFSeEmissao.valor_servico), 0),
+                    func.coalesce(func.sum(NFSeEmissao.valor_iss), 0)
+                ).where(*condicoes)
+            )).one()
+            
+            stmt = (
+                select(NFSeEmissao, chave_ordem.label('chave_ordem'))
+                .options(load_only(*self._COLUNAS_LISTAGEM))
+                .where(*condicoes)
+            )
+            
+            if page:
+                valor, ultimo_id = self._decodificar_pagina(page, ordem)
+                if decrescente:
+                    stmt = stmt.where(or_(
+                        chave_ordem < valor, and_(chave_ordem == valor, NFSeEmissao.id < ultimo_id)
+                    ))
+                else:
+                    stmt = stmt.where(or_(
+                        chave_ordem > valor, and_(chave_ordem == valor, NFSeEmissao.id > ultimo_id)
+                    ))
+            
+            if decrescente:
+                stmt = stmt.order_by(chave_ordem.desc(), NFSeEmissao.id.desc())
+            else:
+                stmt = stmt.order_by(chave_ordem.asc(), NFSeEmissao.id.asc())
+            
+            if page_size:
+                # Um item a mais indica se existe próxima página
+                stmt = stmt.limit(page_size + 1)
+            
+            linhas = (await session.execute(stmt)).all()
+        
+        proxima_pagina = None
+        if page_size and len(linhas) > page_size:
+            linhas = linhas[:page_size]
+            ultima = linhas[-1]
+            proxima_pagina = self._codificar_pagina(ultima.chave_ordem, ultima.NFSeEmissao.id)
+        
+        return {
+            'itens': [linha.NFSeEmissao.to_dict() for linha in linhas],
+            'total': totais[0] or 0,
+            'valor_total': float(totais[1] or 0),
+            'iss_total': float(totais[2] or 0),
+            'proxima_pagina': proxima_pagina
+        }
+    
+    async def get_periodos(self) -> List[str]:
+        """
+        Retorna os meses/anos com notas emitidas ('MM/AAAA'), do mais recente.
+        """
+        ano = extract('year', NFSeEmissao.data_emissao)
+        mes = extract('month', NFSeEmissao.data_emissao)
+        
+        async with get_db_session() as session:
+            result = await session.execute(
+                select(ano, mes)
+                .where(NFSeEmissao.status == 'sucesso', NFSeEmissao.data_emissao.isnot(None))
+                .group_by(ano, mes)
+                .order_by(ano.desc(), mes.desc())
+            )
+            return [f"{int(m):02d}/{int(a)}" for a, m in result.all()]
+    
+    # Colunas exibidas nas listagens (to_dict sem conteúdo)
+    _COLUNAS_LISTAGEM = (
+        NFSeEmissao.id, NFSeEmissao.chave_acesso, NFSeEmissao.numero_nfse,
+        NFSeEmissao.data_emissao, NFSeEmissao.nome_tomador, NFSeEmissao.cpf_tomador,
+        NFSeEmissao.valor_servico, NFSeEmissao.valor_iss, NFSeEmissao.xml_path,
+        NFSeEmissao.pdf_path, NFSeEmissao.status,
+    )
+    
+    async def get_versoes_competencias(self) -> Dict[str, str]:
+        """
+        Versão de cada competência com notas emitidas, a partir do resumo diário.
+        
+        Muda sempre que uma nota do mês é incluída ou muda de status; serve
+        para saber quais exportações mensais precisam ser refeitas sem ler
+        nfse_emissoes.
+        
+        Returns:
+            {'MM/AAAA': versão opaca}
+        """
+        ano = extract('year', NFSeResumoDiario.dia)
+        mes = extract('month', NFSeResumoDiario.dia)
+        
+        async with get_db_session() as session:
+            result = await session.execute(
+                select(
+                    ano, mes,
+                    func.sum(NFSeResumoDiario.quantidade),
+                    func.sum(NFSeResumoDiario.valor_servico),
+                    func.max(NFSeResumoDiario.updated_at)
+                )
+                .where(NFSeResumoDiario.status == 'sucesso')
+                .group_by(ano, mes)
+            )
+            
+            return {
+                f"{int(m):02d}/{int(a)}": f"{quantidade}:{valor}:{atualizado}"
+                for a, m, quantidade, valor, atualizado in result.all()
+                if quantidade
+            }
+    
+    async def get_notas_competencia(self, periodo: str) -> List[Dict[str, Any]]:
+        """
+        Notas emitidas em uma competência, sem XML/PDF, em ordem de emissão.
+        
+        Args:
+            periodo: Competência no formato 'MM/AAAA'
+        """
+        async with get_db_session() as session:
+            result = await session.execute(
+                select(NFSeEmissao)
+                .options(load_only(*self._COLUNAS_LISTAGEM))
+                .where(*self._filtros_busca(None, None, None, periodo))
+                .order_by(NFSeEmissao.data_emissao, NFSeEmissao.id)
+            )
+            return [e.to_dict() for e in result.scalars().all()]
+    
     async def get_nfse_xml(self, chave_acesso: str) -> Optional[str]:
         """
         Retorna o conteúdo XML de uma NFS-e.
@@ -149,13 +503,17 @@ class NFSeRepository:
             Conteúdo XML ou None
         """
         async with get_db_session() as session:
-            stmt = select(NFSeEmissao).where(NFSeEmissao.chave_acesso == chave_acesso)
-            result = await session.execute(stmt)
-            nfse = result.scalar_one_or_none()
-            
-            if nfse and nfse.xml_content:
-                return nfse.xml_content
+            result = await session.execute(
+                select(NFSeEmissao.xml_sha256, NFSeEmissao.xml_content)
+                .where(NFSeEmissao.chave_acesso == chave_acesso)
+            )
+            linha = result.one_or_none()
+        
+        if linha is None:
             return None
+        
+        conteudo = await self._ler_blob('xml', *linha)
+        return conteudo.decode('utf-8') if isinstance(conteudo, bytes) else conteudo
     
     async def get_nfse_pdf(self, chave_acesso: str) -> Optional[bytes]:
         """
@@ -168,13 +526,65 @@ class NFSeRepository:
             Conteúdo PDF em bytes ou None
         """
         async with get_db_session() as session:
-            stmt = select(NFSeEmissao).where(NFSeEmissao.chave_acesso == chave_acesso)
-            result = await session.execute(stmt)
-            nfse = result.scalar_one_or_none()
-            
-            if nfse and nfse.pdf_content:
-                return nfse.pdf_content
+            result = await session.execute(
+                select(NFSeEmissao.pdf_sha256, NFSeEmissao.pdf_content)
+                .where(NFSeEmissao.chave_acesso == chave_acesso)
+            )
+            linha = result.one_or_none()
+        
+        if linha is None:
             return None
+        
+        conteudo = await self._ler_blob('pdf', *linha)
+        return conteudo
+    
+    async def get_blob_refs(self, tipo: str, chaves: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Retorna o SHA-256 do XML ou PDF de várias NFS-e, sem ler conteúdo.
+        
+        Args:
+            tipo: 'xml' ou 'pdf'
+            chaves: Chaves de acesso
+            
+        Returns:
+            {chave_acesso: sha256 ou None (conteúdo inline legado ou ausente)}
+        """
+        coluna_sha = getattr(NFSeEmissao, f"{tipo}_sha256")
+        refs: Dict[str, Optional[str]] = {}
+        
+        async with get_db_session() as session:
+            for inicio in range(0, len(chaves), settings.DB_BULK_CHUNK_SIZE):
+                result = await session.execute(
+                    select(NFSeEmissao.chave_acesso, coluna_sha)
+                    .where(NFSeEmissao.chave_acesso.in_(chaves[inicio:inicio + settings.DB_BULK_CHUNK_SIZE]))
+                )
+                refs.update(dict(result.all()))
+        
+        return refs
+    
+    async def get_conteudos_legados(self, tipo: str, chaves: List[str]) -> Dict[str, Any]:
+        """
+        Conteúdo inline (xml_content/pdf_content) de NFS-e ainda não movidas
+        para o blob store. Use em blocos pequenos: traz os blobs inteiros.
+        """
+        coluna = getattr(NFSeEmissao, f"{tipo}_content")
+        
+        async with get_db_session() as session:
+            result = await session.execute(
+                select(NFSeEmissao.chave_acesso, coluna)
+                .where(NFSeEmissao.chave_acesso.in_(chaves), coluna.isnot(None))
+            )
+            return dict(result.all())
+    
+    @staticmethod
+    async def _ler_blob(tipo: str, sha256: Optional[str], legado: Any) -> Any:
+        """Conteúdo do blob store pelo hash, ou o conteúdo inline legado."""
+        if sha256:
+            try:
+                return await asyncio.to_thread(get_blob_store().get, tipo, sha256)
+            except Exception as e:
+                app_logger.warning(f"Erro ao ler {tipo.upper()} {sha256[:12]} do blob store: {e}")
+        return legado or None
     
     async def get_nfse_by_id(self, nfse_id: int) -> Optional[NFSeEmissao]:
         """
@@ -217,6 +627,7 @@ class NFSeRepository:
             
             session.add(emissao)
             await session.flush()
+            await self._atualizar_resumo_diario(session, [emissao.data_emissao])
             
             app_logger.debug(f"Emissão salva: ID={emissao.id}, Hash={result.hash_transacao[:8]}...")
             
@@ -237,9 +648,8 @@ class NFSeRepository:
         Returns:
             Lista de IDs criados
         """
-        ids = []
-        
         async with get_db_session() as session:
+            emissoes = []
             for result in results:
                 emissao = NFSeEmissao(
                     hash_transacao=result.hash_transacao,
@@ -254,10 +664,12 @@ class NFSeRepository:
                 )
                 
                 session.add(emissao)
+                emissoes.append(emissao)
             
             await session.flush()
+            await self._atualizar_resumo_diario(session, [e.data_emissao for e in emissoes])
             
-            ids = [e.id for e in session.new]
+            ids = [e.id for e in emissoes]
         
         app_logger.info(f"{len(ids)} emissões salvas no banco")
         
@@ -282,50 +694,132 @@ class NFSeRepository:
             result = await session.execute(stmt)
             return list(result.scalars().all())
     
-    async def get_estatisticas(self, dias: int = 30) -> Dict[str, Any]:
+    async def get_estatisticas(self, dias: Optional[int] = 30) -> Dict[str, Any]:
         """
-        Retorna estatísticas de emissões.
+        Retorna estatísticas de emissões a partir do resumo diário.
+        
+        Uma única consulta agrupada por status sobre nfse_resumo_diario, cujo
+        custo depende do número de dias e não do número de notas.
         
         Args:
-            dias: Número de dias para considerar
+            dias: Número de dias para considerar (None = todo o histórico)
             
         Returns:
-            Dicionário com estatísticas
+            Dicionário com estatísticas (valores somam apenas notas emitidas)
         """
-        data_inicio = datetime.utcnow() - timedelta(days=dias)
+        stmt = (
+            select(
+                NFSeResumoDiario.status,
+                func.sum(NFSeResumoDiario.quantidade),
+                func.sum(NFSeResumoDiario.valor_servico),
+                func.sum(NFSeResumoDiario.valor_iss)
+            )
+            .group_by(NFSeResumoDiario.status)
+        )
+        if dias is not None:
+            stmt = stmt.where(NFSeResumoDiario.dia >= (datetime.now() - timedelta(days=dias)).date())
         
         async with get_db_session() as session:
-            # Total de emissões
-            stmt_total = select(func.count(NFSeEmissao.id)).where(
-                NFSeEmissao.created_at >= data_inicio
-            )
-            total = await session.scalar(stmt_total)
-            
-            # Sucessos
-            stmt_sucesso = select(func.count(NFSeEmissao.id)).where(
-                and_(
-                    NFSeEmissao.created_at >= data_inicio,
-                    NFSeEmissao.status == 'sucesso'
-                )
-            )
-            sucessos = await session.scalar(stmt_sucesso)
-            
-            # Erros
-            stmt_erro = select(func.count(NFSeEmissao.id)).where(
-                and_(
-                    NFSeEmissao.created_at >= data_inicio,
-                    NFSeEmissao.status == 'erro'
-                )
+            por_status = {
+                status: (quantidade or 0, valor or 0, iss or 0)
+                for status, quantidade, valor, iss in (await session.execute(stmt)).all()
+            }
+        
+        total = sum(quantidade for quantidade, _, _ in por_status.values())
+        sucessos, valor_total, iss_total = por_status.get('sucesso', (0, 0, 0))
+        erros = por_status.get('erro', (0, 0, 0))[0]
+        
+        return {
+            'total_emissoes': total,
+            'sucessos': sucessos,
+            'erros': erros,
+            'taxa_sucesso': (sucessos / total * 100) if total else 0,
+            'valor_total': float(valor_total),
+            'iss_total': float(iss_total),
+            'periodo_dias': dias
+        }
+    
+    @staticmethod
+    async def _atualizar_resumo_diario(session: AsyncSession, datas: List[Optional[datetime]]):
+        """
+        Recalcula nfse_resumo_diario para os dias das datas informadas.
+        
+        Roda na transação da gravação: um INSERT ... SELECT agrupado por dia
+        e status, com upsert, sobre o intervalo de dias afetado.
+        """
+        datas = [data for data in datas if data]
+        if not datas:
+            return
+        
+        inicio = datetime.combine(min(datas).date(), datetime.min.time())
+        fim = datetime.combine(max(datas).date(), datetime.min.time()) + timedelta(days=1)
+        await NFSeRepository._recalcular_resumo(session, inicio, fim)
+    
+    # Chave do pg_advisory_xact_lock que serializa os recálculos do resumo
+    _RESUMO_LOCK_ID = 7011016
+    
+    @staticmethod
+    async def _recalcular_resumo(session: AsyncSession, inicio: Optional[datetime] = None, fim: Optional[datetime] = None):
+        if session.bind.dialect.name == 'postgresql':
+            # Duas transações recalculando ao mesmo tempo (worker e write-behind)
+            # veriam cada uma só as próprias notas, e a última a gravar apagaria
+            # as da outra. Com o lock (liberado no commit), quem recalcula
+            # depois já enxerga as notas de quem recalculou antes.
+            await session.execute(select(func.pg_advisory_xact_lock(NFSeRepository._RESUMO_LOCK_ID)))
+        
+        dia = func.date(NFSeEmissao.data_emissao)
+        origem = (
+            select(
+                dia,
+                NFSeEmissao.status,
+                func.count(NFSeEmissao.id),
+                func.coalesce(func.sum(NFSeEmissao.valor_servico), 0),
+                func.coalesce(func.sum(NFSeEmissao.valor_iss), 0),
+                func.now()
             )
-            erros = await session.scalar(stmt_erro)
-            
-            return {
-                'total_emissoes': total or 0,
-                'sucessos': sucessos or 0,
-                'erros': erros or 0,
-                'taxa_sucesso': (sucessos / total * 100) if total else 0,
-                'periodo_dias': dias
+            .where(NFSeEmissao.data_emissao.isnot(None))
+            .group_by(dia, NFSeEmissao.status)
+        )
+        if inicio is not None:
+            origem = origem.where(NFSeEmissao.data_emissao >= inicio)
+        if fim is not None:
+            origem = origem.where(NFSeEmissao.data_emissao < fim)
+        
+        # Dia/status que deixou de existir (ex.: nota cancelada) não volta no SELECT
+        limpeza = delete(NFSeResumoDiario)
+        if inicio is not None:
+            limpeza = limpeza.where(NFSeResumoDiario.dia >= inicio.date())
+        if fim is not None:
+            limpeza = limpeza.where(NFSeResumoDiario.dia < fim.date())
+        await session.execute(limpeza)
+        
+        insert = pg_insert if session.bind.dialect.name == 'postgresql' else sqlite_insert
+        stmt = insert(NFSeResumoDiario).from_select(
+            ['dia', 'status', 'quantidade', 'valor_servico', 'valor_iss', 'updated_at'], origem
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[NFSeResumoDiario.dia, NFSeResumoDiario.status],
+            set_={
+                'quantidade': stmt.excluded.quantidade,
+                'valor_servico': stmt.excluded.valor_servico,
+                'valor_iss': stmt.excluded.valor_iss,
+                'updated_at': stmt.excluded.updated_at,
             }
+        )
+        await session.execute(stmt)
+    
+    async def reconstruir_resumo_diario(self) -> None:
+        """
+        Refaz nfse_resumo_diario a partir de todo o histórico de nfse_emissoes.
+        
+        Necessário uma vez em bancos criados antes do resumo (ver
+        migrate_database.py) ou após alterações feitas fora do repositório.
+        """
+        async with get_db_session() as session:
+            await session.execute(delete(NFSeResumoDiario))
+            await self._recalcular_resumo(session)
+        
+        app_logger.info("Resumo diário de NFS-e reconstruído")
 
 
 class LogRepository:
@@ -420,6 +914,7 @@ class LogRepository:
                     stmt_delete = delete(NFSeEmissao)
                     result_delete = await session.execute(stmt_delete)
                     rows_deleted = result_delete.rowcount
+                    await session.execute(delete(NFSeResumoDiario))
                     
                     # Força o commit
                     await session.flush()
@@ -441,3 +936,477 @@ class LogRepository:
             app_logger.error(f"Erro ao deletar NFS-e do banco: {e}")
             app_logger.exception(e)  # Log completo da exceção
             raise
+
+
+class JobRepository:
+    """Repositório da fila persistente de emissão em lote."""
+    
+    async def enqueue_batch(
+        self,
+        payloads: List[Dict[str, Any]],
+        nome_arquivo: str,
+        usuario: str = "admin",
+        max_tentativas: int = 3
+    ) -> str:
+        """
+        Cria um lote (LogProcessamento) e um job pendente por registro.
+        
+        Args:
+            payloads: Um dicionário por registro com 'prestador', 'tomador',
+                'servico' (model_dump) e 'registro' (nome, cpf, hash...)
+            nome_arquivo: Nome do PDF de origem
+            usuario: Usuário que iniciou o lote
+            max_tentativas: Tentativas por job antes de marcar como erro
+            
+        Returns:
+            Batch ID (UUID)
+        """
+        batch_id = str(uuid.uuid4())
+        
+        async with get_db_session() as session:
+            session.add(LogProcessamento(
+                batch_id=batch_id,
+                total_registros=len(payloads),
+                nome_arquivo=nome_arquivo,
+                usuario=usuario,
+                status='processando'
+            ))
+            
+            for indice, payload in enumerate(payloads):
+                registro = payload.get('registro', {})
+                session.add(EmissaoJob(
+                    batch_id=batch_id,
+                    indice=indice,
+                    hash_transacao=registro.get('hash') or None,
+                    cpf_tomador=registro.get('cpf'),
+                    nome_tomador=registro.get('nome'),
+                    status='pendente',
+                    tentativas=0,
+                    max_tentativas=max_tentativas,
+                    payload_json=json.dumps(payload, default=str)
+                ))
+        
+        app_logger.info(f"Lote enfileirado: Batch={batch_id}, {len(payloads)} jobs")
+        
+        return batch_id
+    
+    async def claim_jobs(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Reserva até `limit` jobs pendentes (pendente -> processando).
+        
+        A troca de status é condicional (WHERE status = 'pendente'), então um
+        job nunca é reservado duas vezes, mesmo com mais de um worker.
+        
+        Args:
+            limit: Máximo de jobs a reservar
+            
+        Returns:
+            Jobs reservados, na ordem de criação
+        """
+        async with get_db_session() as session:
+            stmt = (
+                select(EmissaoJob.id)
+                .where(EmissaoJob.status == 'pendente')
+                .order_by(EmissaoJob.id)
+                .limit(limit)
+            )
+            ids = list((await session.execute(stmt)).scalars().all())
+            
+            agora = datetime.utcnow()
+            reservados = []
+            for job_id in ids:
+                result = await session.execute(
+                    update(EmissaoJob)
+                    .where(and_(EmissaoJob.id == job_id, EmissaoJob.status == 'pendente'))
+                    .values(
+                        status='processando',
+                        tentativas=EmissaoJob.tentativas + 1,
+                        locked_at=agora,
+                        updated_at=agora
+                    )
+                )
+                if result.rowcount == 1:
+                    reservados.append(job_id)
+            
+            if not reservados:
+                return []
+            
+            stmt = select(EmissaoJob).where(EmissaoJob.id.in_(reservados)).order_by(EmissaoJob.id)
+            jobs = (await session.execute(stmt)).scalars().all()
+            
+            return [job.to_dict() for job in jobs]
+    
+    async def complete_job(self, job_id: int, resultado: Dict[str, Any]):
+        """
+        Marca um job como emitido com sucesso.
+        
+        Args:
+            job_id: ID do job
+            resultado: Dados da NFS-e emitida (chave, caminhos, resposta da API)
+        """
+        async with get_db_session() as session:
+            await session.execute(
+                update(EmissaoJob)
+                .where(EmissaoJob.id == job_id)
+                .values(
+                    status='sucesso',
+                    resultado_json=json.dumps(resultado, default=str),
+                    erro=None,
+                    locked_at=None,
+                    updated_at=datetime.utcnow()
+                )
+            )
+    
+    async def fail_job(self, job_id: int, erro: str, retry: bool = True) -> str:
+        """
+        Registra falha de um job: volta para a fila ou termina em erro.
+        
+        Args:
+            job_id: ID do job
+            erro: Mensagem de erro
+            retry: Se False, não tenta novamente mesmo com tentativas restantes
+            
+        Returns:
+            Novo status do job ('pendente' ou 'erro')
+        """
+        async with get_db_session() as session:
+            job = await session.get(EmissaoJob, job_id)
+            if job is None:
+                return 'erro'
+            
+            job.status = 'pendente' if retry and job.tentativas < job.max_tentativas else 'erro'
+            job.erro = erro
+            job.locked_at = None
+            
+            return job.status
+    
+    async def requeue_stale_jobs(self, timeout_segundos: float) -> int:
+        """
+        Devolve à fila jobs presos em 'processando' (ex.: container reiniciado).
+        
+        Args:
+            timeout_segundos: Idade mínima da reserva para considerar o job órfão
+            
+        Returns:
+            Número de jobs devolvidos
+        """
+        limite = datetime.utcnow() - timedelta(seconds=timeout_segundos)
+        
+        async with get_db_session() as session:
+            result = await session.execute(
+                update(EmissaoJob)
+                .where(and_(EmissaoJob.status == 'processando', EmissaoJob.locked_at < limite))
+                .values(status='pendente', locked_at=None, updated_at=datetime.utcnow())
+            )
+            total = result.rowcount or 0
+        
+        if total:
+            app_logger.warning(f"{total} job(s) órfão(s) devolvido(s) à fila")
+        
+        return total
+    
+    async def finalize_batch_if_done(self, batch_id: str) -> bool:
+        """
+        Fecha o LogProcessamento do lote quando não há mais jobs em aberto.
+        
+        Args:
+            batch_id: ID do lote
+            
+        Returns:
+            True se o lote está concluído
+        """
+        contagem = await self.count_by_status(batch_id)
+        if contagem.get('pendente') or contagem.get('processando'):
+            return False
+        
+        await LogRepository().update_log(
+            batch_id,
+            sucessos=contagem.get('sucesso', 0),
+            erros=contagem.get('erro', 0),
+            status='concluido'
+        )
+        return True
+    
+    async def count_by_status(self, batch_id: str) -> Dict[str, int]:
+        """Retorna {status: quantidade} dos jobs do lote."""
+        async with get_db_session() as session:
+            stmt = (
+                select(EmissaoJob.status, func.count(EmissaoJob.id))
+                .where(EmissaoJob.batch_id == batch_id)
+                .group_by(EmissaoJob.status)
+            )
+            return {status: total for status, total in (await session.execute(stmt)).all()}
+    
+    async def get_batch_jobs(self, batch_id: str) -> List[Dict[str, Any]]:
+        """Retorna os jobs do lote na ordem dos registros."""
+        async with get_db_session() as session:
+            stmt = (
+                select(EmissaoJob)
+                .where(EmissaoJob.batch_id == batch_id)
+                .order_by(EmissaoJob.indice)
+            )
+            jobs = (await session.execute(stmt)).scalars().all()
+            
+            return [job.to_dict() for job in jobs]
+    
+    async def get_open_batches(self) -> List[Dict[str, Any]]:
+        """
+        Retorna os lotes ainda em processamento (para retomar/acompanhar).
+        
+        Returns:
+            Lista de dicionários com batch_id, nome_arquivo, total_registros e início
+        """
+        async with get_db_session() as session:
+            stmt = (
+                select(LogProcessamento)
+                .where(and_(
+                    LogProcessamento.status == 'processando',
+                    LogProcessamento.batch_id.in_(select(EmissaoJob.batch_id))
+                ))
+                .order_by(desc(LogProcessamento.inicio_processamento))
+            )
+            logs = (await session.execute(stmt)).scalars().all()
+            
+            return [
+                {
+                    'batch_id': log.batch_id,
+                    'nome_arquivo': log.nome_arquivo,
+                    'total_registros': log.total_registros,
+                    'inicio': log.inicio_processamento
+                }
+                for log in logs
+            ]
+
+
+class IdempotenciaRepository:
+    """Repositório do registro de idempotência e da numeração de DPS."""
+    
+    async def next_dps_number(self, cnpj: str, serie: str) -> int:
+        """
+        Reserva o próximo número de DPS do prestador/série (atômico).
+        
+        Args:
+            cnpj: CNPJ do prestador
+            serie: Série do DPS
+            
+        Returns:
+            Número do DPS reservado
+        """
+        for _ in range(3):
+            try:
+                async with get_db_session() as session:
+                    result = await session.execute(
+                        update(DPSSequencia)
+                        .where(and_(DPSSequencia.cnpj == cnpj, DPSSequencia.serie == serie))
+                        .values(ultimo_numero=DPSSequencia.ultimo_numero + 1)
+                        .returning(DPSSequencia.ultimo_numero)
+                    )
+                    numero = result.scalar_one_or_none()
+                    
+                    if numero is None:
+                        # Primeira emissão do prestador/série
+                        numero = await self._numero_inicial(session, cnpj, serie)
+                        session.add(DPSSequencia(cnpj=cnpj, serie=serie, ultimo_numero=numero))
+                        await session.flush()
+                    
+                    return numero
+            except IntegrityError:
+                # Outra emissão criou a sequência ao mesmo tempo: tentar o UPDATE de novo
+                continue
+        
+        raise RuntimeError(f"Não foi possível reservar número de DPS para {cnpj}/{serie}")
+    
+    @staticmethod
+    async def _numero_inicial(session: AsyncSession, cnpj: str, serie: str) -> int:
+        """
+        Primeiro número da sequência, sem repetir DPS já enviados.
+        
+        Parte do maior entre DPS_NUMERO_INICIAL e o último número reservado
+        no registro de idempotência para o prestador/série. Se nenhum dos dois
+        existir mas já houver notas emitidas (numeração antiga, fora do
+        banco), exige DPS_NUMERO_INICIAL configurado.
+        
+        Raises:
+            RuntimeError: Se não for possível determinar um início seguro
+        """
+        # Id do DPS: ... + CNPJ(14) + série(5) + nDPS(15)
+        maior_reservado = (await session.execute(
+            select(func.max(EmissaoIdempotencia.numero_dps))
+            .where(EmissaoIdempotencia.id_dps.like(f"%{cnpj.zfill(14)}{serie}%"))
+        )).scalar()
+        
+        if maior_reservado is not None:
+            return max(maior_reservado + 1, settings.DPS_NUMERO_INICIAL)
+        if settings.DPS_NUMERO_INICIAL:
+            return settings.DPS_NUMERO_INICIAL
+        
+        ja_emitidas = (await session.execute(select(NFSeEmissao.id).limit(1))).first()
+        if ja_emitidas:
+            raise RuntimeError(
+                f"Numeração de DPS de {cnpj}/{serie} sem ponto de partida: configure "
+                f"DPS_NUMERO_INICIAL acima do maior nDPS já enviado (ver XMLs emitidos)"
+            )
+        return 1
+    
+    async def get_registro(self, hash_transacao: str) -> Optional[Dict[str, Any]]:
+        """Retorna o registro de idempotência do hash, se houver."""
+        async with get_db_session() as session:
+            stmt = select(EmissaoIdempotencia).where(EmissaoIdempotencia.hash_transacao == hash_transacao)
+            registro = (await session.execute(stmt)).scalar_one_or_none()
+            return registro.to_dict() if registro else None
+    
+    async def reservar(self, hash_transacao: str, id_dps: str, numero_dps: int) -> bool:
+        """
+        Associa um novo DPS ao hash antes do envio e assume o envio.
+        
+        Cria o registro ou substitui um DPS rejeitado. Não mexe em hashes já
+        emitidos nem em reservas com envio em andamento.
+        
+        Args:
+            hash_transacao: Hash da transação
+            id_dps: Id do infDPS
+            numero_dps: Número do DPS
+            
+        Returns:
+            False se outra tentativa já reservou/está enviando o hash
+        """
+        agora = datetime.utcnow()
+        
+        try:
+            async with get_db_session() as session:
+                result = await session.execute(
+                    update(EmissaoIdempotencia)
+                    .where(and_(
+                        EmissaoIdempotencia.hash_transacao == hash_transacao,
+                        EmissaoIdempotencia.status == 'rejeitado',
+                        self._envio_livre(agora)
+                    ))
+                    .values(
+                        id_dps=id_dps, numero_dps=numero_dps, status='reservado',
+                        erro=None, envio_desde=agora, updated_at=agora
+                    )
+                )
+                if result.rowcount:
+                    return True
+                
+                existe = (await session.execute(
+                    select(EmissaoIdempotencia.id).where(EmissaoIdempotencia.hash_transacao == hash_transacao)
+                )).first()
+                if existe:
+                    return False
+                
+                session.add(EmissaoIdempotencia(
+                    hash_transacao=hash_transacao, id_dps=id_dps, numero_dps=numero_dps,
+                    status='reservado', envio_desde=agora
+                ))
+                await session.flush()
+                return True
+        except IntegrityError:
+            # Outra tentativa criou o registro ao mesmo tempo
+            return False
+    
+    async def assumir_envio(self, hash_transacao: str) -> bool:
+        """
+        Assume o reenvio de um DPS já reservado (UPDATE condicional).
+        
+        Duas tentativas simultâneas do mesmo hash não reenviam o DPS juntas:
+        só uma consegue; a trava expira após JOB_STALE_TIMEOUT (tentativa
+        interrompida sem liberar).
+        
+        Returns:
+            True se esta tentativa pode consultar/enviar o DPS
+        """
+        agora = datetime.utcnow()
+        
+        async with get_db_session() as session:
+            result = await session.execute(
+                update(EmissaoIdempotencia)
+                .where(and_(
+                    EmissaoIdempotencia.hash_transacao == hash_transacao,
+                    EmissaoIdempotencia.status == 'reservado',
+                    self._envio_livre(agora)
+                ))
+                .values(envio_desde=agora, updated_at=agora)
+            )
+            return bool(result.rowcount)
+    
+    async def liberar_envio(self, hash_transacao: str):
+        """Encerra o envio em andamento sem alterar a reserva (ex.: timeout)."""
+        async with get_db_session() as session:
+            await session.execute(
+                update(EmissaoIdempotencia)
+                .where(EmissaoIdempotencia.hash_transacao == hash_transacao)
+                .values(envio_desde=None, updated_at=datetime.utcnow())
+            )
+    
+    @staticmethod
+    def _envio_livre(agora: datetime):
+        limite = agora - timedelta(seconds=settings.JOB_STALE_TIMEOUT)
+        return or_(EmissaoIdempotencia.envio_desde.is_(None), EmissaoIdempotencia.envio_desde < limite)
+    
+    async def confirmar(self, hash_transacao: str, chave_acesso: str, resultado: Dict[str, Any]):
+        """Marca o hash como emitido, com a chave e o resultado da emissão."""
+        async with get_db_session() as session:
+            await session.execute(
+                update(EmissaoIdempotencia)
+                .where(EmissaoIdempotencia.hash_transacao == hash_transacao)
+                .values(
+                    status='emitido',
+                    chave_acesso=chave_acesso,
+                    resultado_json=json.dumps(resultado, default=str),
+                    erro=None,
+                    envio_desde=None,
+                    updated_at=datetime.utcnow()
+                )
+            )
+    
+    async def rejeitar(self, hash_transacao: str, erro: str):
+        """
+        Marca o DPS reservado como rejeitado pela Sefin.
+        
+        Só deve ser usado quando a rejeição é definitiva (erro de validação):
+        a próxima tentativa reserva um novo número de DPS.
+        """
+        async with get_db_session() as session:
+            await session.execute(
+                update(EmissaoIdempotencia)
+                .where(EmissaoIdempotencia.hash_transacao == hash_transacao)
+                .values(status='rejeitado', erro=erro, envio_desde=None, updated_at=datetime.utcnow())
+            )
+
+
+class SyncEstadoRepository:
+    """Repositório das marcas d'água de sincronizações incrementais."""
+    
+    async def get_marca(self, nome: str) -> Optional[Dict[str, Any]]:
+        """Retorna a marca d'água da sincronização, se houver."""
+        async with get_db_session() as session:
+            estado = await session.get(SyncEstado, nome)
+            if estado is None:
+                return None
+            return {
+                'posicao': estado.posicao,
+                'inicio_ultima': estado.inicio_ultima,
+                'ultima_chave': estado.ultima_chave,
+            }
+    
+    async def salvar_marca(
+        self,
+        nome: str,
+        posicao: int,
+        inicio_ultima: Optional[int],
+        ultima_chave: Optional[str]
+    ):
+        """Grava (upsert) a marca d'água da sincronização."""
+        async with get_db_session() as session:
+            insert = pg_insert if session.bind.dialect.name == 'postgresql' else sqlite_insert
+            valores = {
+                'posicao': posicao,
+                'inicio_ultima': inicio_ultima,
+                'ultima_chave': ultima_chave,
+                'updated_at': datetime.utcnow(),
+            }
+            stmt = insert(SyncEstado).values(nome=nome, **valores)
+            await session.execute(
+                stmt.on_conflict_do_update(index_elements=[SyncEstado.nome], set_=valores)
+            )
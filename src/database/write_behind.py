@@ -0,0 +1,237 @@
+"""
+Gravação em segundo plano (write-behind) das NFS-e emitidas no banco.
+
+A emissão só registra a nota no diário local (src.storage.journal) e a
+coloca nesta fila; uma thread grava as notas acumuladas em grupos com
+NFSeRepository.save_batch_nfse. Uma falha do banco não perde notas: o
+grupo é tentado de novo e, se a falha persistir, as notas continuam no
+diário e entram no banco na próxima sincronização (sincronizar_diario).
+
+A sincronização é incremental: a marca d'água em sync_estado guarda até
+que byte do diário já foi enviado ao banco, então o custo ao abrir uma
+sessão depende só das notas novas, não do tamanho do histórico.
+"""
+import asyncio
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from config.settings import settings
+from src.database.repository import NFSeRepository, SyncEstadoRepository
+from src.storage.journal import NFSeJournal
+from src.utils.logger import app_logger
+from src.utils.runtime import run_sync
+
+
+# Chamado após cada grupo gravado com sucesso
+AoGravarFn = Callable[[List[Dict[str, Any]]], None]
+
+
+class GravadorNFSe:
+    """
+    Fila de notas a gravar no banco, esvaziada por uma thread própria.
+    
+    A thread espera até WRITE_BEHIND_LOTE notas ou WRITE_BEHIND_INTERVALO
+    segundos e grava tudo o que acumulou em uma única chamada.
+    """
+    
+    def __init__(
+        self,
+        repository: Optional[NFSeRepository] = None,
+        ao_gravar: Optional[AoGravarFn] = None,
+        tamanho_lote: Optional[int] = None,
+        intervalo: Optional[float] = None
+    ):
+        """
+        Args:
+            repository: Repositório a usar (padrão: NFSeRepository())
+            ao_gravar: Callback com as notas de cada grupo gravado
+            tamanho_lote: Máximo de notas por gravação
+            intervalo: Espera máxima (segundos) antes de gravar um grupo incompleto
+        """
+        self.repository = repository or NFSeRepository()
+        self.ao_gravar = ao_gravar
+        self.tamanho_lote = tamanho_lote or settings.WRITE_BEHIND_LOTE
+        self.intervalo = intervalo or settings.WRITE_BEHIND_INTERVALO
+        self._fila: "queue.Queue[Dict[str, Any]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+    
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    @property
+    def pendentes(self) -> int:
+        """Notas aguardando gravação (aproximado)."""
+        return self._fila.unfinished_tasks
+    
+    def start(self) -> None:
+        """Inicia a thread de gravação (idempotente)."""
+        if self.is_running:
+            return
+        
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._thread_main, name='nfse-write-behind', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Grava o que estiver na fila e encerra a thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def enfileirar(self, notas: List[Dict[str, Any]]) -> None:
+        """Agenda a gravação das notas no banco."""
+        for nota in notas:
+            self._fila.put(nota)
+    
+    def aguardar(self, timeout: Optional[float] = None) -> bool:
+        """
+        Aguarda a fila esvaziar (ex.: antes de consultar o banco).
+        
+        Returns:
+            True se todas as notas enfileiradas foram gravadas a tempo
+        """
+        limite = None if timeout is None else time.monotonic() + timeout
+        while self._fila.unfinished_tasks:
+            if limite is not None and time.monotonic() >= limite:
+                return False
+            time.sleep(0.05)
+        return True
+    
+    def _proximo_lote(self) -> List[Dict[str, Any]]:
+        """Bloqueia até a primeira nota e junta as que chegarem no intervalo."""
+        try:
+            lote = [self._fila.get(timeout=self.intervalo)]
+        except queue.Empty:
+            return []
+        
+        limite = time.monotonic() + self.intervalo
+        while len(lote) < self.tamanho_lote:
+            restante = limite - time.monotonic()
+            if restante <= 0 and self._fila.empty():
+                break
+            try:
+                lote.append(self._fila.get(timeout=max(restante, 0)))
+            except queue.Empty:
+                break
+        return lote
+    
+    def _thread_main(self) -> None:
+        falhas = 0
+        
+        while not (self._stop.is_set() and self._fila.empty()):
+            lote = self._proximo_lote()
+            if not lote:
+                continue
+            
+            try:
+                run_sync(self.repository.save_batch_nfse(lote))
+                falhas = 0
+                app_logger.debug(f"Write-behind: {len(lote)} NFS-e gravadas no banco")
+            except Exception as e:
+                falhas += 1
+                app_logger.error(f"Write-behind: falha ao gravar {len(lote)} NFS-e (tentativa {falhas}): {e}")
+                
+                if self._stop.is_set() or falhas >= settings.WRITE_BEHIND_MAX_TENTATIVAS:
+                    # As notas seguem no diário e entram no banco na próxima sincronização
+                    app_logger.warning(f"Write-behind: {len(lote)} NFS-e ficam apenas no diário local")
+                    for _ in lote:
+                        self._fila.task_done()
+                    falhas = 0
+                    continue
+                
+                for nota in lote:
+                    self._fila.put(nota)
+                for _ in lote:
+                    self._fila.task_done()
+                time.sleep(min(self.intervalo * 2 ** falhas, 60))
+                continue
+            
+            for _ in lote:
+                self._fila.task_done()
+            
+            if self.ao_gravar is not None:
+                try:
+                    self.ao_gravar(lote)
+                except Exception as e:
+                    app_logger.warning(f"Write-behind: erro no callback após gravação: {e}")
+
+
+# Nome da marca d'água do diário em sync_estado
+MARCA_DIARIO = 'diario_nfse'
+
+
+async def sincronizar_diario(
+    journal: NFSeJournal,
+    repository: Optional[NFSeRepository] = None,
+    estados: Optional[SyncEstadoRepository] = None
+) -> int:
+    """
+    Envia ao banco as notas do diário gravadas desde a última sincronização.
+    
+    A posição salva só vale se a linha que termina nela ainda for a mesma
+    (mesma chave de acesso); se o diário foi compactado ou limpo, a
+    sincronização recomeça do início (save_batch_nfse ignora as notas já
+    existentes).
+    
+    Args:
+        journal: Diário local de notas emitidas
+        repository: Repositório de NFS-e (padrão: NFSeRepository())
+        estados: Repositório das marcas d'água (padrão: SyncEstadoRepository())
+    
+    Returns:
+        Quantidade de notas enviadas ao banco
+    """
+    repository = repository or NFSeRepository()
+    estados = estados or SyncEstadoRepository()
+    
+    salva = await estados.get_marca(MARCA_DIARIO)
+    marca = dict(salva or {'posicao': 0, 'inicio_ultima': None, 'ultima_chave': None})
+    posicao = marca['posicao']
+    
+    if posicao:
+        ultima = None
+        if posicao <= journal.tamanho() and marca['inicio_ultima'] is not None:
+            ultima = await asyncio.to_thread(journal.nota_em, marca['inicio_ultima'])
+        if ultima is None or ultima.get('chave_acesso') != marca['ultima_chave']:
+            app_logger.info("Diário local reescrito desde a última sincronização: sincronizando do início")
+            marca = {'posicao': 0, 'inicio_ultima': None, 'ultima_chave': None}
+            posicao = 0
+    
+    notas, nova_posicao, inicio_ultima = await asyncio.to_thread(journal.ler_desde, posicao)
+    
+    if notas:
+        await repository.save_batch_nfse(notas)
+        marca = {
+            'posicao': nova_posicao,
+            'inicio_ultima': inicio_ultima,
+            'ultima_chave': notas[-1].get('chave_acesso'),
+        }
+    else:
+        marca['posicao'] = nova_posicao
+    
+    if marca != salva:
+        await estados.salvar_marca(MARCA_DIARIO, **marca)
+    return len(notas)
+
+# Instância global do gravador
+_gravador: Optional[GravadorNFSe] = None
+_gravador_lock = threading.Lock()
+
+
+def get_gravador_nfse(ao_gravar: Optional[AoGravarFn] = None) -> GravadorNFSe:
+    """
+    Retorna o gravador write-behind do processo, iniciando-o se necessário.
+    
+    Args:
+        ao_gravar: Callback após cada grupo gravado (usado apenas na criação)
+    """
+    global _gravador
+    with _gravador_lock:
+        if _gravador is None:
+            _gravador = GravadorNFSe(ao_gravar=ao_gravar)
+        _gravador.start()
+    return _gravador
@@ -0,0 +1,146 @@
+"""
+Backends de extração de texto para o PDFDataExtractor.
+
+- pdfplumber: análise de layout em Python puro (referência, mais lento)
+- pymupdf: MuPDF em C, tipicamente uma ordem de grandeza mais rápido
+
+O PyMuPDF devolve palavras com coordenadas; as linhas são remontadas
+agrupando palavras pela posição vertical, como o pdfplumber faz com os
+caracteres, para que o parser linha a linha receba o mesmo texto.
+"""
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, List, Optional, Type, Union
+
+import pdfplumber
+
+from config.settings import settings
+
+try:
+    import pymupdf as fitz
+    PYMUPDF_DISPONIVEL = True
+except ImportError:
+    try:
+        import fitz  # PyMuPDF anterior a 1.24.3
+        PYMUPDF_DISPONIVEL = True
+    except ImportError:
+        fitz = None
+        PYMUPDF_DISPONIVEL = False
+
+
+OrigemPDF = Union[str, Path, bytes]
+
+# Mesma tolerância vertical padrão do pdfplumber para juntar uma linha
+_TOLERANCIA_LINHA = 3.0
+
+
+class PdfPlumberBackend:
+    """Texto via pdfplumber (page.extract_text)."""
+    
+    nome = 'pdfplumber'
+    
+    def __init__(self, origem: OrigemPDF):
+        self._pdf = pdfplumber.open(BytesIO(origem) if isinstance(origem, bytes) else origem)
+    
+    def __len__(self) -> int:
+        return len(self._pdf.pages)
+    
+    def texto(self, indice: int) -> Optional[str]:
+        pagina = self._pdf.pages[indice]
+        texto = pagina.extract_text()
+        # Descarta os objetos de layout da página para a memória não crescer com o PDF
+        pagina.flush_cache()
+        return texto
+    
+    def close(self) -> None:
+        self._pdf.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PyMuPDFBackend:
+    """Texto via PyMuPDF, com as linhas remontadas a partir das palavras."""
+    
+    nome = 'pymupdf'
+    
+    def __init__(self, origem: OrigemPDF):
+        if not PYMUPDF_DISPONIVEL:
+            raise RuntimeError("Backend 'pymupdf' requer o pacote PyMuPDF")
+        
+        if isinstance(origem, bytes):
+            self._doc = fitz.open(stream=origem, filetype='pdf')
+        else:
+            self._doc = fitz.open(str(origem))
+    
+    def __len__(self) -> int:
+        return self._doc.page_count
+    
+    def texto(self, indice: int) -> Optional[str]:
+        # (x0, y0, x1, y1, palavra, bloco, linha, n)
+        palavras = self._doc[indice].get_text('words', sort=True)
+        if not palavras:
+            return None
+        
+        linhas: List[List[tuple]] = []
+        for palavra in sorted(palavras, key=lambda p: (p[1], p[0])):
+            if linhas and abs(palavra[1] - linhas[-1][0][1]) <= _TOLERANCIA_LINHA:
+                linhas[-1].append(palavra)
+            else:
+                linhas.append([palavra])
+        
+        return '\n'.join(
+            ' '.join(p[4] for p in sorted(linha, key=lambda p: p[0]))
+            for linha in linhas
+        )
+    
+    def close(self) -> None:
+        self._doc.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+BACKENDS: Dict[str, Type] = {
+    PdfPlumberBackend.nome: PdfPlumberBackend,
+    PyMuPDFBackend.nome: PyMuPDFBackend,
+}
+
+
+def escolher_backend(nome: Optional[str] = None) -> str:
+    """
+    Resolve o backend a usar.
+    
+    Args:
+        nome: 'pdfplumber', 'pymupdf' ou 'auto' (padrão: PDF_TEXT_BACKEND)
+    
+    Returns:
+        Nome de um backend disponível ('auto' prefere o PyMuPDF)
+    """
+    nome = (nome or settings.PDF_TEXT_BACKEND or PdfPlumberBackend.nome).lower()
+    
+    if nome == 'auto':
+        return PyMuPDFBackend.nome if PYMUPDF_DISPONIVEL else PdfPlumberBackend.nome
+    if nome not in BACKENDS:
+        raise ValueError(f"Backend de PDF inválido: {nome} (use {', '.join(BACKENDS)} ou auto)")
+    return nome
+
+
+def abrir_documento(origem: OrigemPDF, backend: Optional[str] = None):
+    """
+    Abre o PDF no backend escolhido.
+    
+    Args:
+        origem: Caminho do arquivo ou bytes do PDF
+        backend: Nome do backend (ver escolher_backend)
+    
+    Returns:
+        Documento com len(), texto(indice) e close(); usável em `with`
+    """
+    return BACKENDS[escolher_backend(backend)](origem)
@@ -1,16 +1,97 @@
 """
 Extrator de dados de PDFs para emissão de NFS-e.
+
+O texto das páginas vem de um backend plugável (src.pdf.backends):
+pdfplumber ou PyMuPDF, escolhido por chamada ou por PDF_TEXT_BACKEND.
+
+Relatórios grandes (PDF_PARALLEL_MIN_PAGES páginas ou mais) são extraídos em
+paralelo: as páginas são divididas em intervalos contíguos entre processos
+de um pool, cada processo abre o PDF (pelo caminho ou pelos bytes em memória
+compartilhada) e os registros são reunidos na ordem das páginas.
+
+iter_records entrega os registros página a página, para quem quer começar
+a processá-los antes do fim da extração; extract_from_file/extract_from_bytes
+apenas juntam essa sequência em uma lista.
 """
+import math
+import multiprocessing
+import os
 import re
-from typing import List, Dict, Optional
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Any, Dict, Iterator, List, Optional, Union
 from pathlib import Path
-import pdfplumber
-from io import BytesIO
 
+from config.settings import settings
+from src.pdf.backends import abrir_documento, escolher_backend
 from src.utils.logger import app_logger
 from src.utils.validators import validator
 
 
+# Pool de processos da extração paralela
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def _num_processos() -> int:
+    return settings.PDF_EXTRACTION_PROCESSES or os.cpu_count() or 1
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    """Pool compartilhado pelas extrações (spawn: o processo do app tem threads)."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=_num_processos(),
+                mp_context=multiprocessing.get_context('spawn')
+            )
+    return _process_pool
+
+
+def _descartar_process_pool() -> None:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+@contextmanager
+def _abrir_origem(origem: Dict[str, Any]) -> Iterator[Any]:
+    """
+    Abre o PDF em um processo do pool.
+    
+    Args:
+        origem: {'caminho': str} ou {'memoria': nome do SharedMemory, 'tamanho': bytes},
+            mais 'backend'
+    """
+    if 'caminho' in origem:
+        with abrir_documento(origem['caminho'], origem['backend']) as doc:
+            yield doc
+        return
+    
+    memoria = shared_memory.SharedMemory(name=origem['memoria'])
+    try:
+        dados = bytes(memoria.buf[:origem['tamanho']])
+    finally:
+        memoria.close()
+    
+    with abrir_documento(dados, origem['backend']) as doc:
+        yield doc
+
+
+def _extrair_intervalo(origem: Dict[str, Any], inicio: int, fim: int) -> List[Dict[str, Any]]:
+    """Executado no pool: extrai as páginas [inicio, fim) (índices a partir de 0)."""
+    extrator = PDFDataExtractor()
+    with _abrir_origem(origem) as doc:
+        return [extrator._processar_pagina(doc, indice) for indice in range(inicio, fim)]
+
+
 class PDFDataExtractor:
     """Extrai dados estruturados de PDFs para emissão de NFS-e."""
     
@@ -27,69 +108,223 @@ class PDFDataExtractor:
     
     def __init__(self):
         self.errors: List[str] = []
+        # Tempos da última extração: backend, modo, processos, total e por página
+        self.ultimas_metricas: Dict[str, Any] = {}
     
-    def extract_from_file(self, file_path: Path) -> List[Dict[str, str]]:
+    def extract_from_file(
+        self,
+        file_path: Path,
+        paralelo: Optional[bool] = None,
+        backend: Optional[str] = None
+    ) -> List[Dict[str, str]]:
         """
         Extrai dados de um arquivo PDF local.
         
         Args:
             file_path: Caminho para o arquivo PDF
-            
+            paralelo: Força (True) ou impede (False) a extração paralela;
+                None decide pelo número de páginas
+            backend: 'pdfplumber', 'pymupdf' ou 'auto' (padrão: PDF_TEXT_BACKEND)
+        
         Returns:
             Lista de dicionários com os dados extraídos
         """
         try:
-            with pdfplumber.open(file_path) as pdf:
-                return self._process_pdf(pdf)
+            return self._coletar(self.iter_records(file_path, paralelo=paralelo, backend=backend))
         except Exception as e:
             error_msg = f"Erro ao processar arquivo {file_path}: {e}"
             app_logger.error(error_msg)
             self.errors.append(error_msg)
             return []
     
-    def extract_from_bytes(self, file_bytes: bytes) -> List[Dict[str, str]]:
+    def extract_from_bytes(
+        self,
+        file_bytes: bytes,
+        paralelo: Optional[bool] = None,
+        backend: Optional[str] = None
+    ) -> List[Dict[str, str]]:
         """
         Extrai dados de bytes de um PDF (útil para uploads Streamlit).
         
         Args:
             file_bytes: Bytes do arquivo PDF
-            
+            paralelo: Força (True) ou impede (False) a extração paralela;
+                None decide pelo número de páginas
+            backend: 'pdfplumber', 'pymupdf' ou 'auto' (padrão: PDF_TEXT_BACKEND)
+        
         Returns:
             Lista de dicionários com os dados extraídos
         """
         try:
-            with pdfplumber.open(BytesIO(file_bytes)) as pdf:
-                return self._process_pdf(pdf)
+            return self._coletar(self.iter_records(file_bytes, paralelo=paralelo, backend=backend))
         except Exception as e:
             error_msg = f"Erro ao processar PDF: {e}"
             app_logger.error(error_msg)
             self.errors.append(error_msg)
             return []
     
-    def _process_pdf(self, pdf) -> List[Dict[str, str]]:
+    @staticmethod
+    def _coletar(paginas: Iterator[Dict[str, Any]]) -> List[Dict[str, str]]:
+        return [record for pagina in paginas for record in pagina['records']]
+    
+    def iter_records(
+        self,
+        origem: Union[Path, str, bytes],
+        paralelo: Optional[bool] = None,
+        backend: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
         """
-        Processa todas as páginas do PDF e extrai dados.
+        Gera os registros página a página, na ordem do documento.
+        
+        O consumidor recebe os registros da primeira página sem esperar o
+        restante do PDF, e só a página atual fica em memória (no modo
+        paralelo, também os intervalos já prontos à frente dela). Ao final,
+        ultimas_metricas é atualizado. Erros de leitura são propagados.
         
         Args:
-            pdf: Objeto pdfplumber PDF
-            
-        Returns:
-            Lista de registros extraídos
+            origem: Caminho do arquivo ou bytes do PDF
+            paralelo: Ver extract_from_file
+            backend: Ver extract_from_file
+        
+        Yields:
+            {'page': número da página, 'offset': registros nas páginas
+             anteriores, 'total_pages': páginas do PDF, 'records': registros
+             da página}
         """
-        all_records = []
+        backend = escolher_backend(backend)
+        fonte = origem if isinstance(origem, bytes) else str(origem)
+        inicio = time.perf_counter()
         
-        for page_num, page in enumerate(pdf.pages, start=1):
-            text = page.extract_text()
+        with abrir_documento(fonte, backend) as doc:
+            total_paginas = len(doc)
+            usar_paralelo = self._usar_paralelo(total_paginas, paralelo)
+            if not usar_paralelo:
+                paginas = self._iter_sequencial(doc, 0, total_paginas)
+                yield from self._numerar(paginas, total_paginas, backend, 'sequencial', 1, inicio)
+                return
+        
+        paginas = self._iter_paralelo(fonte, backend, total_paginas)
+        yield from self._numerar(paginas, total_paginas, backend, 'paralelo', _num_processos(), inicio)
+    
+    @staticmethod
+    def _usar_paralelo(total_paginas: int, paralelo: Optional[bool]) -> bool:
+        if paralelo is None:
+            paralelo = total_paginas >= settings.PDF_PARALLEL_MIN_PAGES
+        return paralelo and total_paginas > 1 and _num_processos() > 1
+    
+    def _processar_pagina(self, doc, indice: int) -> Dict[str, Any]:
+        """Extrai texto e registros de uma página (índice a partir de 0), medindo o tempo."""
+        page_num = indice + 1
+        inicio = time.perf_counter()
+        text = doc.texto(indice)
+        records = self._extract_records_from_text(text, page_num) if text else []
+        
+        return {
+            'pagina': page_num,
+            'registros': records,
+            'sem_texto': not text,
+            'segundos': time.perf_counter() - inicio,
+        }
+    
+    def _iter_sequencial(self, doc, inicio: int, fim: int) -> Iterator[Dict[str, Any]]:
+        for indice in range(inicio, fim):
+            yield self._processar_pagina(doc, indice)
+    
+    def _iter_paralelo(self, fonte: Union[str, bytes], backend: str, total_paginas: int) -> Iterator[Dict[str, Any]]:
+        """
+        Distribui intervalos de páginas pelo pool e os devolve em ordem.
+        
+        Se o pool falhar, continua de forma sequencial a partir da primeira
+        página ainda não entregue.
+        """
+        processos = _num_processos()
+        # Dois intervalos por processo equilibram páginas mais pesadas que outras
+        tamanho = max(1, math.ceil(total_paginas / (processos * 2)))
+        proxima = 0
+        memoria = None
+        futures = []
+        
+        try:
+            if isinstance(fonte, bytes):
+                # Os processos leem os bytes da memória compartilhada em vez de
+                # recebê-los serializados em cada tarefa
+                memoria = shared_memory.SharedMemory(create=True, size=len(fonte))
+                memoria.buf[:len(fonte)] = fonte
+                origem = {'memoria': memoria.name, 'tamanho': len(fonte), 'backend': backend}
+            else:
+                origem = {'caminho': fonte, 'backend': backend}
             
-            if not text:
-                app_logger.warning(f"Página {page_num} sem texto extraível")
-                continue
+            try:
+                pool = _get_process_pool()
+                futures = [
+                    pool.submit(_extrair_intervalo, origem, primeira, min(primeira + tamanho, total_paginas))
+                    for primeira in range(0, total_paginas, tamanho)
+                ]
+                for future in futures:
+                    for pagina in future.result():
+                        yield pagina
+                        proxima = pagina['pagina']
+            except (BrokenProcessPool, OSError) as e:
+                app_logger.warning(f"Extração paralela indisponível a partir da página {proxima + 1}, usando modo sequencial: {e}")
+                _descartar_process_pool()
+            else:
+                return
+            finally:
+                # Consumidor parou no meio: não deixar intervalos pendentes no pool
+                for future in futures:
+                    future.cancel()
+        finally:
+            if memoria is not None:
+                memoria.close()
+                memoria.unlink()
+        
+        with abrir_documento(fonte, backend) as doc:
+            yield from self._iter_sequencial(doc, proxima, total_paginas)
+    
+    def _numerar(
+        self,
+        paginas: Iterator[Dict[str, Any]],
+        total_paginas: int,
+        backend: str,
+        modo: str,
+        processos: int,
+        inicio: float
+    ) -> Iterator[Dict[str, Any]]:
+        """Acrescenta página/offset a cada página extraída e guarda as métricas no fim."""
+        offset = 0
+        tempos = []
+        
+        for pagina in paginas:
+            if pagina['sem_texto']:
+                app_logger.warning(f"Página {pagina['pagina']} sem texto extraível")
+            tempos.append({
+                'pagina': pagina['pagina'],
+                'segundos': pagina['segundos'],
+                'registros': len(pagina['registros']),
+            })
             
-            records = self._extract_records_from_text(text, page_num)
-            all_records.extend(records)
+            yield {
+                'page': pagina['pagina'],
+                'offset': offset,
+                'total_pages': total_paginas,
+                'records': pagina['registros'],
+            }
+            offset += len(pagina['registros'])
         
-        app_logger.info(f"Total de {len(all_records)} registros extraídos do PDF")
-        return all_records
+        self.ultimas_metricas = {
+            'backend': backend,
+            'modo': modo,
+            'processos': processos,
+            'total_segundos': time.perf_counter() - inicio,
+            'paginas': tempos,
+        }
+        
+        mais_lenta = max(tempos, key=lambda p: p['segundos'], default=None)
+        app_logger.info(
+            f"Total de {offset} registros extraídos do PDF "
+            f"({len(tempos)} páginas, {backend}, {modo}, {self.ultimas_metricas['total_segundos']:.2f}s"
+            + (f"; mais lenta: p. {mais_lenta['pagina']} em {mais_lenta['segundos']:.2f}s)" if mais_lenta else ")")
+        )
     
     def _extract_records_from_text(self, text: str, page_num: int) -> List[Dict[str, str]]:
         """
@@ -99,7 +334,7 @@ class PDFDataExtractor:
         Args:
             text: Texto extraído da página
             page_num: Número da página
-            
+        
         Returns:
             Lista de registros
         """
@@ -198,7 +433,7 @@ class PDFDataExtractor:
                 
                 records.append(record)
                 app_logger.debug(f"Registro extraído: {nome} - CPF {cpf}")
-                
+            
             except Exception as e:
                 app_logger.error(f"Erro ao processar linha '{line[:50]}...': {e}")
                 continue
@@ -227,7 +462,7 @@ class PDFDataExtractor:
         
         Args:
             records: Lista de registros extraídos
-            
+        
         Returns:
             Dicionário com estatísticas
         """
@@ -256,7 +491,7 @@ class PDFDataExtractor:
         
         Args:
             records: Lista de todos os registros
-            
+        
         Returns:
             Lista apenas com registros válidos
         """
@@ -0,0 +1,3 @@
+"""
+Módulo de armazenamento de arquivos XML/PDF (blob store).
+"""
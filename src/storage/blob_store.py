@@ -0,0 +1,214 @@
+"""
+Armazenamento de XML/PDF endereçado por conteúdo (SHA-256).
+
+Cada arquivo é identificado pelo SHA-256 do conteúdo original; a linha de
+nfse_emissoes guarda apenas o hash. Conteúdo repetido é gravado uma vez.
+XMLs ficam comprimidos em repouso (zlib com dicionário NFS-e); PDFs já são
+comprimidos e são gravados como estão.
+
+O backend segue a interface de objetos do S3 (put/get/head/delete por
+chave). Há dois: diretório local particionado pelo hash (padrão, ex.: volume
+do Railway) e qualquer serviço compatível com S3 (AWS, MinIO, LocalStack),
+via boto3 opcional.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from config.settings import settings
+from src.utils.compression import comprimir_armazenamento, descomprimir_armazenamento
+from src.utils.logger import app_logger
+
+
+TIPOS_BLOB = ('xml', 'pdf')
+
+
+class BlobNotFoundError(KeyError):
+    """Objeto inexistente no blob store."""
+
+
+# ==================== Backends (interface de objetos S3) ====================
+
+class LocalBlobBackend:
+    """Objetos em um diretório local; a chave vira o caminho relativo."""
+    
+    def __init__(self, raiz: Path):
+        self.raiz = Path(raiz)
+        self.raiz.mkdir(parents=True, exist_ok=True)
+    
+    def _caminho(self, chave: str) -> Path:
+        return self.raiz / chave
+    
+    def put_object(self, chave: str, dados: bytes) -> None:
+        caminho = self._caminho(chave)
+        caminho.parent.mkdir(parents=True, exist_ok=True)
+        
+        # Escrita atômica: leitores nunca veem um arquivo pela metade
+        fd, temporario = tempfile.mkstemp(dir=caminho.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(dados)
+            os.replace(temporario, caminho)
+        except BaseException:
+            Path(temporario).unlink(missing_ok=True)
+            raise
+    
+    def get_object(self, chave: str) -> bytes:
+        try:
+            return self._caminho(chave).read_bytes()
+        except FileNotFoundError:
+            raise BlobNotFoundError(chave) from None
+    
+    def head_object(self, chave: str) -> Optional[Dict[str, int]]:
+        try:
+            return {'ContentLength': self._caminho(chave).stat().st_size}
+        except FileNotFoundError:
+            return None
+    
+    def delete_object(self, chave: str) -> None:
+        self._caminho(chave).unlink(missing_ok=True)
+
+
+class S3BlobBackend:
+    """Objetos em um bucket S3 ou compatível (endpoint_url para MinIO/LocalStack)."""
+    
+    def __init__(
+        self,
+        bucket: str,
+        endpoint_url: Optional[str] = None,
+        region: Optional[str] = None,
+        access_key_id: Optional[str] = None,
+        secret_access_key: Optional[str] = None
+    ):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("BLOB_STORE_BACKEND='s3' requer o pacote boto3") from None
+        
+        self.bucket = bucket
+        self._client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url or None,
+            region_name=region or None,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None
+        )
+    
+    def put_object(self, chave: str, dados: bytes) -> None:
+        self._client.put_object(Bucket=self.bucket, Key=chave, Body=dados)
+    
+    def get_object(self, chave: str) -> bytes:
+        try:
+            return self._client.get_object(Bucket=self.bucket, Key=chave)['Body'].read()
+        except self._client.exceptions.NoSuchKey:
+            raise BlobNotFoundError(chave) from None
+    
+    def head_object(self, chave: str) -> Optional[Dict[str, int]]:
+        from botocore.exceptions import ClientError
+        try:
+            resposta = self._client.head_object(Bucket=self.bucket, Key=chave)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        return {'ContentLength': resposta['ContentLength']}
+    
+    def delete_object(self, chave: str) -> None:
+        self._client.delete_object(Bucket=self.bucket, Key=chave)
+
+
+# ==================== Store endereçado por conteúdo ====================
+
+class BlobStore:
+    """
+    XML/PDF endereçados pelo SHA-256 do conteúdo original.
+    
+    Chaves: '<tipo>/<aa>/<bb>/<sha256>' (aa/bb = primeiros bytes do hash),
+    o que limita o número de arquivos por diretório no backend local.
+    """
+    
+    def __init__(self, backend):
+        self.backend = backend
+    
+    @staticmethod
+    def chave(tipo: str, sha256: str) -> str:
+        if tipo not in TIPOS_BLOB:
+            raise ValueError(f"Tipo de blob inválido: {tipo}")
+        return f"{tipo}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+    
+    def put(self, tipo: str, conteudo: bytes) -> str:
+        """
+        Grava o conteúdo (se ainda não existir) e retorna seu SHA-256.
+        
+        Args:
+            tipo: 'xml' ou 'pdf'
+            conteudo: Bytes originais do arquivo
+        
+        Returns:
+            SHA-256 hexadecimal do conteúdo original
+        """
+        sha256 = hashlib.sha256(conteudo).hexdigest()
+        chave = self.chave(tipo, sha256)
+        
+        if self.backend.head_object(chave) is None:
+            dados = comprimir_armazenamento(conteudo) if tipo == 'xml' else conteudo
+            self.backend.put_object(chave, dados)
+            app_logger.debug(f"Blob gravado: {chave} ({len(conteudo)} → {len(dados)} bytes)")
+        
+        return sha256
+    
+    def get(self, tipo: str, sha256: str) -> bytes:
+        """
+        Lê o conteúdo original pelo hash, conferindo a integridade.
+        
+        Raises:
+            BlobNotFoundError: Se o objeto não existir
+            ValueError: Se o conteúdo não corresponder ao hash
+        """
+        dados = self.backend.get_object(self.chave(tipo, sha256))
+        conteudo = descomprimir_armazenamento(dados) if tipo == 'xml' else dados
+        
+        if hashlib.sha256(conteudo).hexdigest() != sha256:
+            raise ValueError(f"Blob corrompido: {self.chave(tipo, sha256)}")
+        return conteudo
+    
+    def exists(self, tipo: str, sha256: str) -> bool:
+        return self.backend.head_object(self.chave(tipo, sha256)) is not None
+    
+    def delete(self, tipo: str, sha256: str) -> None:
+        self.backend.delete_object(self.chave(tipo, sha256))
+
+
+def _diretorio_padrao() -> Path:
+    if settings.BLOB_STORE_DIR:
+        return Path(settings.BLOB_STORE_DIR)
+    # Mesmo volume persistente usado pelo app para os arquivos
+    return Path(os.getenv('RAILWAY_VOLUME_MOUNT_PATH', './data')) / 'blobs'
+
+
+# Instância global do blob store
+_blob_store: Optional[BlobStore] = None
+_blob_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """Retorna o blob store configurado (BLOB_STORE_BACKEND)."""
+    global _blob_store
+    with _blob_store_lock:
+        if _blob_store is None:
+            if settings.BLOB_STORE_BACKEND == 's3':
+                backend = S3BlobBackend(
+                    bucket=settings.BLOB_STORE_S3_BUCKET,
+                    endpoint_url=settings.BLOB_STORE_S3_ENDPOINT_URL,
+                    region=settings.BLOB_STORE_S3_REGION,
+                    access_key_id=settings.BLOB_STORE_S3_ACCESS_KEY_ID,
+                    secret_access_key=settings.BLOB_STORE_S3_SECRET_ACCESS_KEY
+                )
+            else:
+                backend = LocalBlobBackend(_diretorio_padrao())
+            _blob_store = BlobStore(backend)
+            app_logger.info(f"Blob store: {type(backend).__name__}")
+    return _blob_store
@@ -0,0 +1,276 @@
+"""
+Arquivos ZIP mensais (por competência) gerados em background.
+
+Para cada mês com notas emitidas são mantidos, em EXPORT_COMPETENCIAS_DIR,
+um ZIP de PDFs e um de XMLs, cada um com um manifesto JSON (notas incluídas,
+SHA-256 e tamanho do ZIP). O download na listagem apenas lê o arquivo pronto.
+
+O exportador compara a versão de cada competência (derivada de
+nfse_resumo_diario) com a do manifesto e só mexe nos meses alterados. Se o
+mês apenas ganhou notas, elas são acrescentadas ao ZIP existente; se alguma
+saiu (ex.: cancelamento), o ZIP do mês é refeito.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config.settings import settings
+from src.database.repository import NFSeRepository
+from src.storage.blob_store import TIPOS_BLOB
+from src.storage.export import preencher_zip
+from src.utils.logger import app_logger
+from src.utils.runtime import run_sync
+
+
+def _sha256_arquivo(caminho: Path) -> str:
+    sha = hashlib.sha256()
+    with open(caminho, 'rb') as f:
+        for bloco in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def _gravar_atomico(caminho: Path, dados: bytes) -> None:
+    fd, temporario = tempfile.mkstemp(dir=caminho.parent, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(dados)
+        os.replace(temporario, caminho)
+    except BaseException:
+        Path(temporario).unlink(missing_ok=True)
+        raise
+
+
+class ExportadorCompetencias:
+    """
+    Mantém os ZIPs mensais atualizados a partir de uma thread própria.
+    
+    Como o EmissionWorker, o ciclo roda no event loop compartilhado
+    (run_sync); notificar() antecipa o próximo ciclo após uma emissão.
+    """
+    
+    def __init__(
+        self,
+        diretorio: Optional[Path] = None,
+        intervalo: Optional[float] = None,
+        repository: Optional[NFSeRepository] = None
+    ):
+        """
+        Args:
+            diretorio: Onde ficam ZIPs e manifestos (padrão: EXPORT_COMPETENCIAS_DIR)
+            intervalo: Segundos entre verificações sem notificação
+            repository: Repositório a usar (padrão: NFSeRepository())
+        """
+        self.diretorio = Path(diretorio or _diretorio_padrao())
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self.intervalo = intervalo or settings.EXPORT_COMPETENCIAS_INTERVALO
+        self.repository = repository or NFSeRepository()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._acordar = threading.Event()
+    
+    # ==================== Arquivos ====================
+    
+    def _caminhos(self, periodo: str, tipo: str) -> Dict[str, Path]:
+        mes, ano = periodo.split('/')
+        base = self.diretorio / f"nfse_{tipo}s_{ano}-{mes}"
+        return {'zip': base.with_suffix('.zip'), 'manifesto': base.with_suffix('.json')}
+    
+    def _ler_manifesto(self, periodo: str, tipo: str) -> Optional[Dict[str, Any]]:
+        caminho = self._caminhos(periodo, tipo)['manifesto']
+        try:
+            return json.loads(caminho.read_text(encoding='utf-8'))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            app_logger.warning(f"Manifesto inválido {caminho.name}, será refeito: {e}")
+            return None
+    
+    def obter(self, periodo: str, tipo: str) -> Optional[Dict[str, Any]]:
+        """
+        Arquivo pronto de uma competência, sem gerar nada.
+        
+        Args:
+            periodo: Competência 'MM/AAAA'
+            tipo: 'pdf' ou 'xml'
+        
+        Returns:
+            Manifesto acrescido de 'caminho' (Path do ZIP), ou None se o
+            arquivo ainda não foi gerado
+        """
+        caminhos = self._caminhos(periodo, tipo)
+        manifesto = self._ler_manifesto(periodo, tipo)
+        if manifesto is None or not caminhos['zip'].exists():
+            return None
+        
+        if caminhos['zip'].stat().st_size != manifesto['tamanho']:
+            # ZIP substituído entre a leitura do manifesto e agora
+            return None
+        return {**manifesto, 'caminho': caminhos['zip']}
+    
+    def competencias_disponiveis(self) -> List[str]:
+        """Competências com ZIP pronto, da mais recente para a mais antiga."""
+        periodos = set()
+        for manifesto in self.diretorio.glob('nfse_*s_*.json'):
+            ano, mes = manifesto.stem.rsplit('_', 1)[1].split('-')
+            periodos.add((int(ano), int(mes)))
+        return [f"{mes:02d}/{ano}" for ano, mes in sorted(periodos, reverse=True)]
+    
+    def _remover(self, periodo: str, tipo: str) -> None:
+        for caminho in self._caminhos(periodo, tipo).values():
+            caminho.unlink(missing_ok=True)
+    
+    # ==================== Geração ====================
+    
+    async def sincronizar(self) -> int:
+        """
+        Atualiza os ZIPs das competências alteradas desde a última execução.
+        
+        Returns:
+            Quantidade de arquivos (competência x tipo) regravados ou removidos
+        """
+        versoes = await self.repository.get_versoes_competencias()
+        alterados = 0
+        
+        for periodo in set(self.competencias_disponiveis()) - set(versoes):
+            # Mês sem nenhuma nota emitida (todas canceladas ou histórico limpo)
+            for tipo in TIPOS_BLOB:
+                self._remover(periodo, tipo)
+            alterados += len(TIPOS_BLOB)
+            app_logger.info(f"Exportação da competência {periodo} removida")
+        
+        for periodo, versao in versoes.items():
+            pendentes = [
+                tipo for tipo in TIPOS_BLOB
+                if (self._ler_manifesto(periodo, tipo) or {}).get('versao') != versao
+            ]
+            if not pendentes:
+                continue
+            
+            notas = await self.repository.get_notas_competencia(periodo)
+            for tipo in pendentes:
+                await self._atualizar(periodo, tipo, versao, notas)
+                alterados += 1
+        
+        return alterados
+    
+    async def _atualizar(self, periodo: str, tipo: str, versao: str, notas: List[Dict[str, Any]]) -> None:
+        caminhos = self._caminhos(periodo, tipo)
+        manifesto = self._ler_manifesto(periodo, tipo)
+        chaves = {nota['chave_acesso'] for nota in notas}
+        
+        fd, temporario = tempfile.mkstemp(dir=self.diretorio, prefix='.tmp-', suffix='.zip')
+        os.close(fd)
+        temporario = Path(temporario)
+        
+        try:
+            anteriores: Dict[str, str] = {}
+            if manifesto and caminhos['zip'].exists() and set(manifesto['notas']) <= chaves:
+                # Só inclusões: acrescenta ao ZIP atual em vez de refazê-lo
+                anteriores = manifesto['notas']
+                await asyncio.to_thread(shutil.copyfile, caminhos['zip'], temporario)
+                modo = 'a'
+            else:
+                modo = 'w'
+            
+            novas = [nota for nota in notas if nota['chave_acesso'] not in anteriores]
+            with zipfile.ZipFile(temporario, modo) as zf:
+                incluidas = await preencher_zip(
+                    zf, novas, tipo, self.repository, nomes_usados=set(anteriores.values())
+                )
+            
+            sha256 = await asyncio.to_thread(_sha256_arquivo, temporario)
+            os.replace(temporario, caminhos['zip'])
+        except BaseException:
+            temporario.unlink(missing_ok=True)
+            raise
+        
+        entradas = {**anteriores, **incluidas}
+        manifesto = {
+            'competencia': periodo,
+            'tipo': tipo,
+            'versao': versao,
+            'quantidade': len(entradas),
+            'faltantes': len(chaves - set(entradas)),
+            'sha256': sha256,
+            'tamanho': caminhos['zip'].stat().st_size,
+            'gerado_em': datetime.now().isoformat(timespec='seconds'),
+            'notas': entradas,
+        }
+        _gravar_atomico(caminhos['manifesto'], json.dumps(manifesto, ensure_ascii=False).encode('utf-8'))
+        
+        app_logger.info(
+            f"Exportação {tipo.upper()} {periodo}: {len(incluidas)} nota(s) "
+            f"{'acrescentada(s)' if modo == 'a' else 'no novo ZIP'}, total {len(entradas)}"
+        )
+    
+    # ==================== Thread ====================
+    
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+    
+    def start(self) -> None:
+        """Inicia a thread do exportador (idempotente)."""
+        if self.is_running:
+            return
+        
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._thread_main, name='export-competencias', daemon=True)
+        self._thread.start()
+        app_logger.info(f"Exportador de competências iniciado ({self.diretorio})")
+    
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Sinaliza parada e aguarda o ciclo atual terminar."""
+        self._stop.set()
+        self._acordar.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def notificar(self) -> None:
+        """Antecipa a próxima verificação (ex.: logo após emitir notas)."""
+        self._acordar.set()
+    
+    def _thread_main(self) -> None:
+        run_sync(self._run())
+    
+    async def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                await self.sincronizar()
+            except Exception as e:
+                app_logger.error(f"Erro no exportador de competências: {e}", exc_info=True)
+            
+            await asyncio.to_thread(self._acordar.wait, self.intervalo)
+            self._acordar.clear()
+        
+        app_logger.info("Exportador de competências parado")
+
+
+def _diretorio_padrao() -> Path:
+    if settings.EXPORT_COMPETENCIAS_DIR:
+        return Path(settings.EXPORT_COMPETENCIAS_DIR)
+    return Path(os.getenv('RAILWAY_VOLUME_MOUNT_PATH', './data')) / 'exportacoes'
+
+
+# Instância global do exportador
+_exportador: Optional[ExportadorCompetencias] = None
+_exportador_lock = threading.Lock()
+
+
+def get_exportador_competencias() -> ExportadorCompetencias:
+    """Retorna o exportador de competências do processo, iniciando-o se necessário."""
+    global _exportador
+    with _exportador_lock:
+        if _exportador is None:
+            _exportador = ExportadorCompetencias()
+        _exportador.start()
+    return _exportador
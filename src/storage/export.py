@@ -0,0 +1,171 @@
+"""
+Exportação de XML/PDF de várias NFS-e em um arquivo ZIP.
+
+O ZIP é escrito incrementalmente em um SpooledTemporaryFile: fica em memória
+até EXPORT_SPOOL_MAX_BYTES e passa para disco acima disso. Cada nota é lida,
+gravada no ZIP e descartada, então o pico de memória é o de uma nota, não o
+do lote inteiro. As referências do blob store vêm de uma única consulta em
+lote em vez de uma por nota.
+
+PDFs já são comprimidos e entram com ZIP_STORED; XMLs usam ZIP_DEFLATED.
+"""
+import asyncio
+import tempfile
+import zipfile
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.settings import settings
+from src.database.repository import NFSeRepository
+from src.storage.blob_store import BlobNotFoundError, TIPOS_BLOB, get_blob_store
+from src.utils.logger import app_logger
+
+
+_COMPRESSAO = {
+    'pdf': zipfile.ZIP_STORED,
+    'xml': zipfile.ZIP_DEFLATED,
+}
+
+
+def _nome_arquivo(nota: Dict[str, Any], tipo: str, nomes_usados: set) -> str:
+    """Nome da nota dentro do ZIP, sem repetições."""
+    caminho = nota.get(f'{tipo}_path')
+    if caminho:
+        base = Path(caminho).stem
+    else:
+        base = f"nfse_{nota.get('numero') or nota.get('chave_acesso', 'sem_numero')}"
+    
+    nome = f"{base}.{tipo}"
+    sufixo = 2
+    while nome in nomes_usados:
+        nome = f"{base}_{sufixo}.{tipo}"
+        sufixo += 1
+    nomes_usados.add(nome)
+    return nome
+
+
+def _escrever_local(zf: zipfile.ZipFile, itens: List[Tuple[str, str, Path]], tipo: str) -> Dict[str, str]:
+    """Copia arquivos locais para o ZIP em blocos (zf.write não lê o arquivo inteiro)."""
+    for _, nome, caminho in itens:
+        zf.write(caminho, nome, compress_type=_COMPRESSAO[tipo])
+    return {chave: nome for chave, nome, _ in itens}
+
+
+def _escrever_blobs(zf: zipfile.ZipFile, itens: List[Tuple[str, str, str]], tipo: str) -> Dict[str, str]:
+    """Lê do blob store e grava no ZIP uma nota por vez."""
+    blob_store = get_blob_store()
+    gravados = {}
+    for chave, nome, sha256 in itens:
+        try:
+            zf.writestr(nome, blob_store.get(tipo, sha256), compress_type=_COMPRESSAO[tipo])
+            gravados[chave] = nome
+        except (BlobNotFoundError, ValueError) as e:
+            app_logger.warning(f"{tipo.upper()} {nome} ignorado na exportação: {e}")
+    return gravados
+
+
+def _escrever_conteudos(zf: zipfile.ZipFile, itens: List[Tuple[str, str, Any]], tipo: str) -> Dict[str, str]:
+    for _, nome, conteudo in itens:
+        dados = conteudo.encode('utf-8') if isinstance(conteudo, str) else bytes(conteudo)
+        zf.writestr(nome, dados, compress_type=_COMPRESSAO[tipo])
+    return {chave: nome for chave, nome, _ in itens}
+
+
+async def preencher_zip(
+    zf: zipfile.ZipFile,
+    notas: List[Dict[str, Any]],
+    tipo: str,
+    repository: NFSeRepository,
+    nomes_usados: Optional[set] = None
+) -> Dict[str, str]:
+    """
+    Grava no ZIP aberto o XML ou PDF de cada nota.
+    
+    Usa o arquivo local (xml_path/pdf_path) quando existe; as demais notas são
+    buscadas no banco pela chave de acesso.
+    
+    Args:
+        zf: ZIP aberto para escrita ('w' ou 'a')
+        notas: Notas no formato da listagem (chave_acesso, numero, xml_path, pdf_path)
+        tipo: 'xml' ou 'pdf'
+        repository: Repositório usado para as notas sem arquivo local
+        nomes_usados: Nomes já presentes no ZIP (ao acrescentar em um ZIP existente)
+    
+    Returns:
+        {chave_acesso: nome no ZIP} das notas incluídas
+    """
+    if tipo not in TIPOS_BLOB:
+        raise ValueError(f"Tipo de exportação inválido: {tipo}")
+    
+    nomes_usados = set() if nomes_usados is None else nomes_usados
+    locais: List[Tuple[str, str, Path]] = []
+    pendentes: Dict[str, str] = {}
+    
+    for nota in notas:
+        caminho = nota.get(f'{tipo}_path')
+        if caminho and Path(caminho).exists():
+            nome = _nome_arquivo(nota, tipo, nomes_usados)
+            locais.append((nota.get('chave_acesso') or nome, nome, Path(caminho)))
+        elif nota.get('chave_acesso'):
+            pendentes.setdefault(nota['chave_acesso'], _nome_arquivo(nota, tipo, nomes_usados))
+    
+    incluidas = await asyncio.to_thread(_escrever_local, zf, locais, tipo)
+    
+    if not pendentes:
+        return incluidas
+    
+    try:
+        refs = await repository.get_blob_refs(tipo, list(pendentes))
+    except Exception as e:
+        # Sem banco, o ZIP sai só com os arquivos locais
+        app_logger.warning(f"Exportação sem acesso ao banco ({len(pendentes)} notas ignoradas): {e}")
+        return incluidas
+    
+    no_store = [(chave, pendentes[chave], sha) for chave, sha in refs.items() if sha]
+    incluidas.update(await asyncio.to_thread(_escrever_blobs, zf, no_store, tipo))
+    
+    # Notas anteriores ao blob store: conteúdo inline, lido em blocos pequenos
+    legadas = [chave for chave, sha in refs.items() if not sha]
+    for inicio in range(0, len(legadas), settings.EXPORT_LOTE_LEGADO):
+        conteudos = await repository.get_conteudos_legados(
+            tipo, legadas[inicio:inicio + settings.EXPORT_LOTE_LEGADO]
+        )
+        itens = [(chave, pendentes[chave], conteudo) for chave, conteudo in conteudos.items()]
+        incluidas.update(await asyncio.to_thread(_escrever_conteudos, zf, itens, tipo))
+    
+    return incluidas
+
+
+async def exportar_zip(
+    notas: List[Dict[str, Any]],
+    tipo: str,
+    repository: Optional[NFSeRepository] = None
+) -> Dict[str, Any]:
+    """
+    Gera em arquivo temporário um ZIP com o XML ou PDF de cada nota.
+    
+    Args:
+        notas: Notas no formato da listagem (chave_acesso, numero, xml_path, pdf_path)
+        tipo: 'xml' ou 'pdf'
+        repository: Repositório a usar (padrão: NFSeRepository())
+    
+    Returns:
+        {'arquivo': SpooledTemporaryFile posicionado no início,
+         'quantidade': arquivos no ZIP, 'tamanho': bytes do ZIP}
+        O chamador deve fechar 'arquivo' quando não precisar mais dele.
+    """
+    repository = repository or NFSeRepository()
+    arquivo = tempfile.SpooledTemporaryFile(max_size=settings.EXPORT_SPOOL_MAX_BYTES)
+    
+    try:
+        with zipfile.ZipFile(arquivo, 'w') as zf:
+            quantidade = len(await preencher_zip(zf, notas, tipo, repository))
+    except BaseException:
+        arquivo.close()
+        raise
+    
+    tamanho = arquivo.tell()
+    arquivo.seek(0)
+    app_logger.info(f"ZIP de {tipo.upper()} gerado: {quantidade}/{len(notas)} notas, {tamanho} bytes")
+    
+    return {'arquivo': arquivo, 'quantidade': quantidade, 'tamanho': tamanho}
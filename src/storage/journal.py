@@ -0,0 +1,265 @@
+"""
+Diário local (append-only) das NFS-e emitidas, em JSON Lines.
+
+Substitui a regravação de nfse_emitidas.json a cada nota: cada emissão
+acrescenta uma linha ao arquivo, com custo constante. O fsync é feito em
+lotes (JOURNAL_FSYNC_LOTE linhas ou JOURNAL_FSYNC_INTERVALO segundos), e o
+arquivo é compactado (uma linha por chave de acesso) quando acumula muitas
+linhas repetidas.
+
+Na primeira execução, o conteúdo de um nfse_emitidas.json antigo é importado.
+"""
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.settings import settings
+from src.utils.logger import app_logger
+
+
+class NFSeJournal:
+    """Arquivo JSONL de notas emitidas, seguro para várias threads."""
+    
+    def __init__(self, caminho: Path, legado: Optional[Path] = None):
+        """
+        Args:
+            caminho: Arquivo .jsonl do diário
+            legado: nfse_emitidas.json antigo (lista JSON) a importar se o
+                diário ainda não existir
+        """
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._arquivo = None
+        self._pendentes_fsync = 0
+        self._ultimo_fsync = time.monotonic()
+        
+        if not self.caminho.exists() and legado is not None and Path(legado).exists():
+            self._importar_legado(Path(legado))
+        
+        # Contadores para decidir a compactação sem reler o arquivo
+        notas = self.ler()
+        self._linhas = len(notas)
+        self._chaves = {self._chave(nota) for nota in notas}
+    
+    @staticmethod
+    def _chave(nota: Dict[str, Any]) -> str:
+        return nota.get('chave_acesso') or json.dumps(nota, sort_keys=True, default=str)
+    
+    @staticmethod
+    def _linha(nota: Dict[str, Any]) -> str:
+        return json.dumps(nota, ensure_ascii=False, default=str) + '\n'
+    
+    def _importar_legado(self, legado: Path) -> None:
+        try:
+            notas = json.loads(legado.read_text(encoding='utf-8')) or []
+        except (OSError, ValueError) as e:
+            app_logger.error(f"Não foi possível importar {legado.name}: {e}")
+            return
+        
+        self._regravar(notas)
+        app_logger.info(f"{len(notas)} notas importadas de {legado.name} para {self.caminho.name}")
+    
+    # ==================== Escrita ====================
+    
+    def append(self, notas: List[Dict[str, Any]]) -> None:
+        """
+        Acrescenta notas ao final do diário.
+        
+        Args:
+            notas: Notas no formato da sessão (chave_acesso, numero, ...)
+        """
+        if not notas:
+            return
+        
+        with self._lock:
+            if self._arquivo is None:
+                self._arquivo = open(self.caminho, 'a', encoding='utf-8')
+                if self._termina_incompleto():
+                    # Linha truncada por uma queda: não emendar a próxima nela
+                    self._arquivo.write('\n')
+            
+            self._arquivo.write(''.join(self._linha(nota) for nota in notas))
+            self._arquivo.flush()
+            
+            self._linhas += len(notas)
+            self._chaves.update(self._chave(nota) for nota in notas)
+            self._pendentes_fsync += len(notas)
+            
+            if (
+                self._pendentes_fsync >= settings.JOURNAL_FSYNC_LOTE
+                or time.monotonic() - self._ultimo_fsync >= settings.JOURNAL_FSYNC_INTERVALO
+            ):
+                self._fsync()
+            
+            if (
+                self._linhas >= settings.JOURNAL_COMPACTAR_MIN_LINHAS
+                and self._linhas > 2 * len(self._chaves)
+            ):
+                self._compactar()
+    
+    def sync(self) -> None:
+        """Força o fsync das linhas ainda não gravadas em disco."""
+        with self._lock:
+            if self._arquivo is not None:
+                self._fsync()
+    
+    def _fsync(self) -> None:
+        os.fsync(self._arquivo.fileno())
+        self._pendentes_fsync = 0
+        self._ultimo_fsync = time.monotonic()
+    
+    def _termina_incompleto(self) -> bool:
+        with open(self.caminho, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b'\n'
+    
+    def _fechar(self) -> None:
+        if self._arquivo is not None:
+            self._fsync()
+            self._arquivo.close()
+            self._arquivo = None
+    
+    def _regravar(self, notas: List[Dict[str, Any]]) -> None:
+        """Substitui o diário de forma atômica (arquivo temporário + os.replace)."""
+        fd, temporario = tempfile.mkstemp(dir=self.caminho.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(''.join(self._linha(nota) for nota in notas))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporario, self.caminho)
+        except BaseException:
+            Path(temporario).unlink(missing_ok=True)
+            raise
+    
+    def _compactar(self) -> None:
+        self._fechar()
+        
+        # Última versão de cada nota, na ordem da primeira aparição
+        notas: Dict[str, Dict[str, Any]] = {}
+        for nota in self.ler():
+            notas[self._chave(nota)] = nota
+        
+        antes = self._linhas
+        self._regravar(list(notas.values()))
+        self._linhas = len(notas)
+        self._chaves = set(notas)
+        app_logger.info(f"Diário {self.caminho.name} compactado: {antes} → {self._linhas} linhas")
+    
+    def compactar(self) -> None:
+        """Reescreve o diário com uma linha por nota."""
+        with self._lock:
+            self._compactar()
+    
+    def limpar(self) -> None:
+        """Esvazia o diário (limpeza do histórico)."""
+        with self._lock:
+            self._fechar()
+            self._regravar([])
+            self._linhas = 0
+            self._chaves = set()
+    
+    # ==================== Leitura ====================
+    
+    def ler(self) -> List[Dict[str, Any]]:
+        """
+        Todas as notas do diário, na ordem de gravação.
+        
+        Uma última linha incompleta (queda no meio da escrita) é ignorada.
+        """
+        if not self.caminho.exists():
+            return []
+        
+        notas = []
+        with open(self.caminho, 'r', encoding='utf-8') as f:
+            for numero, linha in enumerate(f, 1):
+                if not linha.strip():
+                    continue
+                try:
+                    notas.append(json.loads(linha))
+                except ValueError:
+                    app_logger.warning(f"Linha {numero} inválida em {self.caminho.name} ignorada")
+        return notas
+
+    
+    def ler_desde(self, posicao: int) -> Tuple[List[Dict[str, Any]], int, Optional[int]]:
+        """
+        Notas gravadas a partir de um byte do arquivo (sincronização incremental).
+        
+        Só considera linhas completas: uma escrita em andamento fica para a
+        próxima leitura.
+        
+        Args:
+            posicao: Byte de início (0 = arquivo inteiro)
+        
+        Returns:
+            (notas, byte logo após a última linha lida, byte de início da
+            última linha lida ou None se nada foi lido)
+        """
+        notas = []
+        inicio_ultima = None
+        
+        if not self.caminho.exists():
+            return notas, posicao, inicio_ultima
+        
+        with open(self.caminho, 'rb') as f:
+            f.seek(posicao)
+            while True:
+                inicio = f.tell()
+                linha = f.readline()
+                if not linha.endswith(b'\n'):
+                    break
+                posicao = f.tell()
+                if not linha.strip():
+                    continue
+                try:
+                    notas.append(json.loads(linha))
+                    inicio_ultima = inicio
+                except ValueError:
+                    app_logger.warning(f"Linha inválida no byte {inicio} de {self.caminho.name} ignorada")
+        
+        return notas, posicao, inicio_ultima
+    
+    def nota_em(self, posicao: int) -> Optional[Dict[str, Any]]:
+        """Nota da linha que começa no byte informado (None se não houver)."""
+        try:
+            with open(self.caminho, 'rb') as f:
+                f.seek(posicao)
+                return json.loads(f.readline())
+        except (OSError, ValueError):
+            return None
+    
+    def tamanho(self) -> int:
+        """Tamanho atual do arquivo em bytes."""
+        try:
+            return self.caminho.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+def _caminho_padrao() -> Path:
+    return Path(os.getenv('RAILWAY_VOLUME_MOUNT_PATH', './data')) / 'nfse_emitidas.jsonl'
+
+
+# Instância global do diário
+_journal: Optional[NFSeJournal] = None
+_journal_lock = threading.Lock()
+
+
+def get_nfse_journal() -> NFSeJournal:
+    """Retorna o diário de notas emitidas (importa o nfse_emitidas.json antigo)."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            caminho = _caminho_padrao()
+            _journal = NFSeJournal(caminho, legado=caminho.with_suffix('.json'))
+            atexit.register(_journal.sync)
+    return _journal
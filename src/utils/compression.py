@@ -0,0 +1,202 @@
+"""
+Compressão GZIP + Base64 dos payloads DPS enviados à Sefin Nacional.
+
+O nível GZIP vem de settings.GZIP_COMPRESS_LEVEL. Lotes são comprimidos em um
+pool de threads (zlib libera o GIL). Para XML armazenado localmente há ainda
+um codec zlib com dicionário pré-treinado do vocabulário NFS-e; ele NÃO é
+usado no envio, pois a Sefin só aceita GZIP padrão sem dicionário.
+"""
+import base64
+import gzip
+import io
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from config.settings import settings
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
+# Mesma declaração usada nos XMLs assinados (aspas duplas, quebra de linha)
+DECLARACAO_BYTES = b'<?xml version="1.0" encoding="UTF-8"?>\n'
+
+# Vocabulário repetitivo de DPS/NFS-e assinados. O zlib procura correspondências
+# do fim para o início do dicionário, então o trecho mais frequente fica no final.
+DICIONARIO_NFSE = (
+    b'<X509Data><X509Certificate>MII</X509Certificate></X509Data></KeyInfo></Signature>'
+    b'<SignatureValue></SignatureValue><KeyInfo>'
+    b'<DigestMethod Algorithm="http://www.w3.org/2001/04/xmlenc#sha256"/><DigestValue></DigestValue>'
+    b'<Transform Algorithm="http://www.w3.org/2000/09/xmldsig#enveloped-signature"/>'
+    b'<Transform Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/></Transforms>'
+    b'<Reference URI="#DPS4218707"><Transforms>'
+    b'<SignatureMethod Algorithm="http://www.w3.org/2001/04/xmldsig-more#rsa-sha256"/>'
+    b'<CanonicalizationMethod Algorithm="http://www.w3.org/2001/10/xml-exc-c14n#"/>'
+    b'<CanonicalizationMethod Algorithm="http://www.w3.org/TR/2001/REC-xml-c14n-20010315"/>'
+    b'<Signature xmlns="http://www.w3.org/2000/09/xmldsig#"><SignedInfo>'
+    b'<infNFSe Id="NFS4218707"><xLocEmi>Tubarao</xLocEmi><xLocPrestacao></xLocPrestacao>'
+    b'<nNFSe></nNFSe><cLocIncid>4218707</cLocIncid><xLocIncid></xLocIncid><xTribNac></xTribNac>'
+    b'<verAplic></verAplic><ambGer>2</ambGer><tpEmis>1</tpEmis><procEmi>1</procEmi><cStat>100</cStat>'
+    b'<dhProc></dhProc><nDFSe></nDFSe><emit><CNPJ></CNPJ><IM></IM><xNome></xNome><enderNac>'
+    b'<xLgr></xLgr><nro></nro><xBairro></xBairro><cMun>4218707</cMun><UF>SC</UF><CEP></CEP></enderNac>'
+    b'<fone></fone><email></email></emit><valores><vCalcDR></vCalcDR><vBC></vBC><pAliqAplic></pAliqAplic>'
+    b'<vISSQN></vISSQN><vTotalRet></vTotalRet><vLiq></vLiq></valores>'
+    b'<tribFed><piscofins><CST>01</CST><vBCPisCofins></vBCPisCofins><pAliqPis></pAliqPis>'
+    b'<pAliqCofins></pAliqCofins><vPis></vPis><vCofins></vCofins><tpRetPisCofins></tpRetPisCofins>'
+    b'</piscofins><vRetCP></vRetCP><vRetIRRF></vRetIRRF><vRetCSLL></vRetCSLL></tribFed>'
+    b'<regTrib><opSimpNac>1</opSimpNac><regEspTrib>0</regEspTrib></regTrib></prest>'
+    b'<toma><CPF></CPF><CNPJ></CNPJ><xNome></xNome></toma>'
+    b'<serv><locPrest><cLocPrestacao>4218707</cLocPrestacao></locPrest>'
+    b'<cServ><cTribNac>040101</cTribNac><xDescServ></xDescServ></cServ></serv>'
+    b'<valores><vServPrest><vServ></vServ></vServPrest><trib><tribMun><tribISSQN>1</tribISSQN>'
+    b'<tpRetISSQN>1</tpRetISSQN></tribMun></trib></valores></infDPS>'
+    b'<?xml version="1.0" encoding="UTF-8"?>\n'
+    b'<DPS xmlns="http://www.sped.fazenda.gov.br/nfse" versao="1.01"><infDPS Id="DPS42187072'
+    b'"><tpAmb>1</tpAmb><dhEmi>-03:00</dhEmi><verAplic>1.0.0</verAplic><serie>00001</serie>'
+    b'<nDPS></nDPS><dCompet></dCompet><tpEmit>1</tpEmit><cLocEmi>4218707</cLocEmi><prest><CNPJ>'
+    b'</CNPJ><IM></IM>'
+)
+
+# Dicionários por versão. O XML armazenado começa com o byte da versão usada,
+# então um dicionário publicado nunca pode ser alterado: um vocabulário novo
+# entra como nova versão e as antigas continuam aqui para leitura.
+DICIONARIOS_NFSE = {
+    1: DICIONARIO_NFSE,
+}
+DICIONARIO_VERSAO = 1
+
+# Cabeçalho GZIP (RFC 1952)
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+def _nivel(compresslevel: Optional[int]) -> int:
+    return settings.GZIP_COMPRESS_LEVEL if compresslevel is None else compresslevel
+
+
+def comprimir_bytes_b64(xml_bytes: bytes, compresslevel: Optional[int] = None) -> str:
+    """
+    Comprime bytes de XML em GZIP e codifica em Base64.
+    
+    Args:
+        xml_bytes: XML já serializado em UTF-8
+        compresslevel: Nível GZIP (padrão: settings.GZIP_COMPRESS_LEVEL)
+    
+    Returns:
+        Payload em Base64 (ASCII)
+    """
+    return base64.b64encode(gzip.compress(xml_bytes, compresslevel=_nivel(compresslevel))).decode('ascii')
+
+
+def comprimir_arvore_b64(root, compresslevel: Optional[int] = None) -> str:
+    """
+    Serializa uma árvore lxml direto no stream GZIP e codifica em Base64.
+    
+    O documento não passa por str nem por um bytes intermediário: lxml
+    escreve a árvore já em UTF-8 dentro do GzipFile.
+    
+    Args:
+        root: Elemento raiz DPS (lxml), normalmente já assinado
+        compresslevel: Nível GZIP (padrão: settings.GZIP_COMPRESS_LEVEL)
+    
+    Returns:
+        Payload em Base64 (ASCII)
+    """
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=_nivel(compresslevel)) as gz:
+        gz.write(DECLARACAO_BYTES)
+        etree.ElementTree(root).write(gz, encoding='UTF-8', xml_declaration=False)
+    return base64.b64encode(buffer.getbuffer()).decode('ascii')
+
+
+def _comprimir_item(item) -> str:
+    if isinstance(item, bytes):
+        return comprimir_bytes_b64(item)
+    if isinstance(item, str):
+        return comprimir_bytes_b64(item.encode('utf-8'))
+    return comprimir_arvore_b64(item)
+
+
+# ==================== Pool de threads ====================
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, settings.COMPRESSION_THREADS),
+                thread_name_prefix='dps-gzip'
+            )
+    return _executor
+
+
+def comprimir_lote(itens: List) -> List[str]:
+    """
+    Comprime vários DPS em GZIP + Base64, fora da thread atual quando compensa.
+    
+    Args:
+        itens: Árvores lxml, bytes UTF-8 ou strings XML
+    
+    Returns:
+        Payloads em Base64, na mesma ordem
+    """
+    if len(itens) < settings.COMPRESSION_MIN_BATCH:
+        return [_comprimir_item(item) for item in itens]
+    return list(_get_executor().map(_comprimir_item, itens))
+
+
+# ==================== XML armazenado (dicionário zlib) ====================
+
+def comprimir_armazenamento(xml_bytes: bytes, compresslevel: Optional[int] = None) -> bytes:
+    """
+    Comprime XML para armazenamento local, com o dicionário NFS-e se habilitado.
+    
+    Args:
+        xml_bytes: XML em UTF-8
+        compresslevel: Nível zlib (padrão: settings.GZIP_COMPRESS_LEVEL)
+    
+    Returns:
+        Byte da versão do dicionário + stream zlib, ou GZIP (sem dicionário)
+    """
+    if not settings.COMPRESSION_DICT_ENABLED:
+        return gzip.compress(xml_bytes, compresslevel=_nivel(compresslevel))
+    
+    compressor = zlib.compressobj(level=_nivel(compresslevel), zdict=DICIONARIOS_NFSE[DICIONARIO_VERSAO])
+    return bytes([DICIONARIO_VERSAO]) + compressor.compress(xml_bytes) + compressor.flush()
+
+
+def descomprimir_armazenamento(dados: bytes) -> bytes:
+    """
+    Descomprime XML gerado por comprimir_armazenamento (GZIP ou zlib + dicionário).
+    
+    Streams zlib sem byte de versão (gravados antes do versionamento; começam
+    com o cabeçalho zlib 0x78) usam o dicionário da versão 1.
+    
+    Args:
+        dados: Bytes comprimidos
+    
+    Returns:
+        XML em UTF-8
+    
+    Raises:
+        ValueError: Se a versão do dicionário for desconhecida
+    """
+    if dados[:2] == _GZIP_MAGIC:
+        return gzip.decompress(dados)
+    
+    if dados[:1] == b'\x78':
+        versao = 1
+    else:
+        versao, dados = dados[0], dados[1:]
+        if versao not in DICIONARIOS_NFSE:
+            raise ValueError(f"Versão de dicionário NFS-e desconhecida: {versao}")
+    
+    decompressor = zlib.decompressobj(zdict=DICIONARIOS_NFSE[versao])
+    return decompressor.decompress(dados) + decompressor.flush()
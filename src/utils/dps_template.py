@@ -0,0 +1,117 @@
+"""
+Template pré-compilado de DPS (Declaração de Prestação de Serviço).
+
+Os blocos invariantes de um DPS (prest/regTrib, locPrest/cServ, trib) só
+dependem do prestador e da configuração tributária do serviço. O template
+guarda uma árvore lxml protótipo, parseada uma única vez, e cada nota é
+gerada a partir de uma cópia dela preenchendo apenas os campos variáveis.
+"""
+import copy
+from typing import Optional
+
+from src.models.schemas import TomadorServico
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+
+NFSE_NS = 'http://www.sped.fazenda.gov.br/nfse'
+
+
+def _nfse(tag: str) -> str:
+    return f'{{{NFSE_NS}}}{tag}'
+
+
+class DPSTemplate:
+    """Protótipo de DPS com os campos variáveis localizados por caminho."""
+    
+    def __init__(self, prototipo):
+        """
+        Args:
+            prototipo: Elemento raiz DPS (lxml) já com os blocos invariantes
+        """
+        self._prototipo = prototipo
+    
+    @classmethod
+    def compilar(cls, xml_prototipo: str) -> "DPSTemplate":
+        """
+        Compila o template a partir do XML de um DPS completo.
+        
+        Args:
+            xml_prototipo: XML DPS (sem declaração) gerado para a configuração
+        
+        Returns:
+            DPSTemplate pronto para preencher
+        """
+        if etree is None:
+            raise RuntimeError("lxml não disponível. Instale com: pip install lxml")
+        
+        return cls(etree.fromstring(xml_prototipo.encode('utf-8')))
+    
+    def preencher(
+        self,
+        id_dps: str,
+        dh_emi: str,
+        d_compet: str,
+        n_dps: str,
+        tomador: Optional[TomadorServico],
+        descricao: str,
+        valor_servico: str
+    ):
+        """
+        Gera um novo DPS a partir do protótipo.
+        
+        Args:
+            id_dps: Atributo Id de infDPS
+            dh_emi: Data/hora de emissão (AAAA-MM-DDTHH:MM:SS-03:00)
+            d_compet: Data de competência (AAAA-MM-DD)
+            n_dps: Número do DPS (sem zeros à esquerda)
+            tomador: Dados do tomador (None remove o bloco toma)
+            descricao: xDescServ
+            valor_servico: vServ já formatado
+        
+        Returns:
+            Elemento raiz DPS (lxml) independente do protótipo
+        """
+        root = copy.deepcopy(self._prototipo)
+        inf_dps = root.find(_nfse('infDPS'))
+        
+        inf_dps.set('Id', id_dps)
+        inf_dps.find(_nfse('dhEmi')).text = dh_emi
+        inf_dps.find(_nfse('nDPS')).text = n_dps
+        inf_dps.find(_nfse('dCompet')).text = d_compet
+        
+        self._preencher_tomador(inf_dps, tomador)
+        
+        inf_dps.find(f"{_nfse('serv')}/{_nfse('cServ')}/{_nfse('xDescServ')}").text = descricao
+        inf_dps.find(f"{_nfse('valores')}/{_nfse('vServPrest')}/{_nfse('vServ')}").text = valor_servico
+        
+        return root
+    
+    @staticmethod
+    def _preencher_tomador(inf_dps, tomador: Optional[TomadorServico]) -> None:
+        """Substitui o bloco toma (mesma ordem de _add_tomador_v101)."""
+        toma = inf_dps.find(_nfse('toma'))
+        
+        if tomador is None:
+            if toma is not None:
+                inf_dps.remove(toma)
+            return
+        
+        if toma is None:
+            # toma fica entre prest e serv
+            toma = etree.Element(_nfse('toma'))
+            inf_dps.find(_nfse('serv')).addprevious(toma)
+        else:
+            toma.clear()
+        
+        # CPF ou CNPJ
+        if tomador.cpf:
+            etree.SubElement(toma, _nfse('CPF')).text = tomador.cpf
+        elif tomador.cnpj:
+            etree.SubElement(toma, _nfse('CNPJ')).text = tomador.cnpj
+        
+        # xNome - Nome
+        etree.SubElement(toma, _nfse('xNome')).text = tomador.nome
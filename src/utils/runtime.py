@@ -0,0 +1,67 @@
+"""
+Event loop de longa duração compartilhado pelo processo.
+
+Recursos assíncronos (pool do banco, pool HTTP da Sefin, controlador de
+tráfego) ficam presos ao event loop em que foram criados. Em vez de um
+asyncio.run() por chamada, que cria e destrói um loop a cada vez, o código
+síncrono (Streamlit, threads) envia as corrotinas para um único loop que roda
+em uma thread daemon, via run_sync().
+"""
+import asyncio
+import threading
+from typing import Any, Coroutine, Optional, TypeVar
+
+from src.utils.logger import app_logger
+
+T = TypeVar('T')
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_runtime_loop() -> asyncio.AbstractEventLoop:
+    """
+    Retorna o event loop compartilhado, iniciando sua thread se necessário.
+    
+    Returns:
+        Event loop em execução na thread 'nfse-runtime'
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='nfse-runtime', daemon=True).start()
+            app_logger.debug("Event loop compartilhado iniciado")
+    return _loop
+
+
+def run_sync(coro: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+    """
+    Executa uma corrotina no loop compartilhado e aguarda o resultado.
+    
+    Substitui asyncio.run() em código síncrono: conexões do banco e da
+    Sefin abertas em uma chamada são reaproveitadas nas seguintes.
+    
+    Args:
+        coro: Corrotina a executar (ex.: repository.get_all_nfse())
+        timeout: Tempo máximo de espera em segundos (None = sem limite)
+    
+    Returns:
+        Valor retornado pela corrotina
+    
+    Raises:
+        RuntimeError: Se chamado de dentro do próprio loop compartilhado
+    """
+    loop = get_runtime_loop()
+    
+    try:
+        em_execucao = asyncio.get_running_loop()
+    except RuntimeError:
+        em_execucao = None
+    
+    if em_execucao is loop:
+        coro.close()
+        raise RuntimeError("run_sync() chamado de dentro do event loop compartilhado; use await")
+    
+    return asyncio.run_coroutine_threadsafe(coro, loop).result(timeout)
@@ -0,0 +1,109 @@
+"""
+Cache do material de assinatura (certificado + chave privada PEM).
+
+Evita reabrir e reprocessar cert.pem/key.pem a cada nota assinada. O cache é
+indexado pelo caminho dos arquivos e invalidado automaticamente quando o
+mtime/tamanho muda (ex.: railway_init.py regravando os certificados).
+"""
+import base64
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+
+from src.utils.logger import app_logger
+
+
+class SigningMaterial:
+    """Certificado e chave já carregados, prontos para assinatura XMLDSig."""
+    
+    def __init__(self, cert_pem: bytes, key_pem: bytes):
+        """
+        Args:
+            cert_pem: Conteúdo do cert.pem
+            key_pem: Conteúdo do key.pem
+        """
+        self.cert_pem = cert_pem
+        self.key_pem = key_pem
+        self.certificate = x509.load_pem_x509_certificate(cert_pem, default_backend())
+        self.private_key = serialization.load_pem_private_key(key_pem, None, default_backend())
+        
+        # Texto do elemento <X509Certificate> (DER em Base64, linhas de 64 chars)
+        cert_der = self.certificate.public_bytes(serialization.Encoding.DER)
+        cert_b64 = base64.b64encode(cert_der).decode('utf-8')
+        cert_lines = '\n'.join(cert_b64[i:i + 64] for i in range(0, len(cert_b64), 64))
+        self.x509_certificate_text = '\n' + cert_lines + '\n'
+    
+    @property
+    def cert_pem_text(self) -> str:
+        """Certificado PEM como string (formato aceito pelo signxml)."""
+        return self.cert_pem.decode('utf-8')
+
+
+# (cert_path, key_path) -> (assinatura dos arquivos, material carregado)
+_FileStamp = Tuple[int, int, int, int]
+_cache: Dict[Tuple[str, str], Tuple[_FileStamp, SigningMaterial]] = {}
+_cache_lock = threading.Lock()
+
+
+def _file_stamp(cert_file: Path, key_file: Path) -> _FileStamp:
+    cert_stat = os.stat(cert_file)
+    key_stat = os.stat(key_file)
+    return (cert_stat.st_mtime_ns, cert_stat.st_size, key_stat.st_mtime_ns, key_stat.st_size)
+
+
+def get_signing_material(cert_path: str, key_path: str) -> SigningMaterial:
+    """
+    Retorna o material de assinatura, recarregando só se os arquivos mudaram.
+    
+    Args:
+        cert_path: Caminho do cert.pem
+        key_path: Caminho do key.pem
+    
+    Returns:
+        SigningMaterial com chave e certificado carregados
+    
+    Raises:
+        FileNotFoundError: Se algum dos arquivos não existir
+    """
+    cert_file = Path(cert_path).resolve()
+    key_file = Path(key_path).resolve()
+    
+    if not cert_file.exists():
+        raise FileNotFoundError(f"Certificado não encontrado: {cert_path}")
+    if not key_file.exists():
+        raise FileNotFoundError(f"Chave privada não encontrada: {key_path}")
+    
+    cache_key = (str(cert_file), str(key_file))
+    stamp = _file_stamp(cert_file, key_file)
+    
+    with _cache_lock:
+        cached = _cache.get(cache_key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        
+        material = SigningMaterial(cert_file.read_bytes(), key_file.read_bytes())
+        _cache[cache_key] = (stamp, material)
+    
+    app_logger.debug(f"Material de assinatura carregado: {cert_file.name} / {key_file.name}")
+    
+    return material
+
+
+def invalidate_signing_cache(cert_path: Optional[str] = None, key_path: Optional[str] = None) -> None:
+    """
+    Descarta o material em cache (todos ou apenas o par informado).
+    
+    Args:
+        cert_path: Caminho do cert.pem (None limpa tudo)
+        key_path: Caminho do key.pem
+    """
+    with _cache_lock:
+        if cert_path is None or key_path is None:
+            _cache.clear()
+        else:
+            _cache.pop((str(Path(cert_path).resolve()), str(Path(key_path).resolve())), None)
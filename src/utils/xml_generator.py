@@ -3,27 +3,50 @@ Gerador de XMLs NFS-e no padrão ADN (Ambiente de Disponibilização Nacional).
 """
 import gzip
 import base64
+import threading
 from xml.etree.ElementTree import Element, SubElement, tostring
-from datetime import datetime
-from typing import Dict, Any, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional, Union
 from pathlib import Path
 
 from src.models.schemas import (
     TomadorServico, Servico, PrestadorServico,
     NFSeRequest, TipoAmbiente
 )
+from src.utils.signing_material import get_signing_material
+from src.utils.xml_signer import (
+    assinar_dps_element_signxml, assinar_e_comprimir, assinar_xml_signxml,
+    get_signing_pool, XML_DECLARACAO
+)
+from src.utils.compression import comprimir_bytes_b64, comprimir_lote
+from src.utils.dps_template import DPSTemplate
 
 try:
     from lxml import etree
+except ImportError:
+    etree = None
+
+try:
     from signxml import XMLSigner, methods
     SIGNXML_AVAILABLE = True
 except ImportError:
     SIGNXML_AVAILABLE = False
-    etree = None
     XMLSigner = None
     methods = None
 
 
+# Horário de Brasília (UTC-3) para dhEmi/dCompet
+TZ_BRASILIA = timezone(timedelta(hours=-3))
+
+# Série do DPS (5 dígitos)
+SERIE_DPS = "00001"
+
+# Templates DPS pré-compilados, compartilhados por todos os geradores do
+# processo (a emissão cria um NFSeXMLGenerator por nota)
+_templates: Dict[tuple, DPSTemplate] = {}
+_templates_lock = threading.Lock()
+
+
 class NFSeXMLGenerator:
     """Gerador de XML NFS-e no padrão ADN."""
     
@@ -47,7 +70,8 @@ class NFSeXMLGenerator:
         self.cert_path = cert_path
         self.key_path = key_path
         
-        # Contador de DPS (inicia aleatório para evitar duplicação)
+        # Contador local de DPS (inicia aleatório para evitar duplicação). A emissão
+        # real passa numero_dps da sequência durável (IdempotenciaRepository)
         import random
         self._dps_counter = random.randint(1000, 9999)
         
@@ -69,6 +93,128 @@ class NFSeXMLGenerator:
         Returns:
             XML em formato string conforme padrão nacional v1.01
         """
+        if etree is not None:
+            root = self.gerar_dps_element(nfse_request)
+            return XML_DECLARACAO + etree.tostring(root, encoding='unicode')
+        
+        # Sem lxml: monta a árvore completa com ElementTree
+        numero_dps = self._proximo_numero_dps()
+        root = self._build_dps_tree(nfse_request, numero_dps, self._data_emissao())
+        
+        # Convertendo para string XML
+        xml_string = tostring(root, encoding="unicode", method="xml")
+        
+        # Adicionando declaração XML
+        return XML_DECLARACAO + xml_string
+    
+    def gerar_dps_element(self, nfse_request: NFSeRequest, numero_dps: Optional[int] = None):
+        """
+        Gera o DPS como árvore lxml a partir de um template pré-compilado.
+        
+        Os blocos invariantes (prest/regTrib, locPrest/cServ, trib) são montados
+        e serializados uma única vez por configuração de prestador + serviço;
+        a cada nota só os campos variáveis são preenchidos em uma cópia.
+        
+        Args:
+            nfse_request: Dados da NFS-e
+            numero_dps: Número do DPS (ex.: da sequência durável no banco);
+                se omitido, usa o contador local do gerador
+            
+        Returns:
+            Elemento raiz DPS (lxml), pronto para assinatura
+        """
+        chave = self._template_key(nfse_request)
+        template = _templates.get(chave)
+        
+        if template is None:
+            prototipo = self._build_dps_tree(nfse_request, 0, self._data_emissao())
+            template = DPSTemplate.compilar(tostring(prototipo, encoding="unicode", method="xml"))
+            with _templates_lock:
+                template = _templates.setdefault(chave, template)
+        
+        if numero_dps is None:
+            numero_dps = self._proximo_numero_dps()
+        now = self._data_emissao()
+        servico = nfse_request.servico
+        
+        return template.preencher(
+            id_dps=self._id_dps(nfse_request.prestador.cnpj, numero_dps),
+            dh_emi=self._formatar_dh_emi(now),
+            d_compet=now.strftime("%Y-%m-%d"),
+            n_dps=str(numero_dps),
+            tomador=nfse_request.tomador,
+            descricao=servico.descricao,
+            valor_servico=f"{servico.valor_servico:.2f}"
+        )
+    
+    def _template_key(self, nfse_request: NFSeRequest) -> tuple:
+        """Chave do template: tudo que afeta os blocos invariantes do DPS."""
+        prestador = nfse_request.prestador
+        servico = nfse_request.servico
+        aliquotas_federais = (
+            servico.aliquota_pis, servico.aliquota_cofins, servico.aliquota_inss,
+            servico.aliquota_ir, servico.aliquota_csll
+        )
+        # Com tributos federais, os valores retidos dependem do valor do serviço
+        has_federal_tax = any(a and a > 0 for a in aliquotas_federais)
+        
+        return (
+            self.ambiente.value,
+            prestador.cnpj,
+            prestador.inscricao_municipal,
+            servico.item_lista_servico,
+            servico.aliquota_iss,
+            aliquotas_federais,
+            servico.valor_deducoes,
+            servico.valor_servico if has_federal_tax else None,
+        )
+    
+    def _proximo_numero_dps(self) -> int:
+        """Incrementa e retorna o número do próximo DPS."""
+        self._dps_counter += 1
+        return self._dps_counter
+    
+    @staticmethod
+    def _data_emissao() -> datetime:
+        """
+        Data/hora de emissão no horário de Brasília (UTC-3).
+        
+        SEMPRE usar horário de Brasília para evitar problemas com fuso horário do servidor.
+        Subtrai 1 minuto de margem de segurança.
+        """
+        return datetime.now(TZ_BRASILIA) - timedelta(minutes=1)
+    
+    @staticmethod
+    def _formatar_dh_emi(now: datetime) -> str:
+        """Formata dhEmi como AAAA-MM-DDTHH:MM:SS-03:00."""
+        dh_emi = now.strftime("%Y-%m-%dT%H:%M:%S%z")
+        if len(dh_emi) > 19:
+            dh_emi = dh_emi[:-2] + ':' + dh_emi[-2:]
+        return dh_emi
+    
+    @staticmethod
+    def _id_dps(cnpj: str, numero_dps: int) -> str:
+        """
+        Gera ID do DPS.
+        
+        Formato: DPS + cMunEmissor(7) + tpInscr(1) + nrInscr(14) + serie(5) + nrDPS(15) = 45 chars
+        """
+        cnpj_prestador = cnpj.zfill(14)
+        numero = str(numero_dps).zfill(15)  # 15 dígitos para o ID
+        return f"DPS4218707{1 if len(cnpj_prestador) == 11 else 2}{cnpj_prestador}{SERIE_DPS}{numero}"
+    
+    def _build_dps_tree(self, nfse_request: NFSeRequest, numero_dps: int, now: datetime) -> Element:
+        """
+        Monta a árvore ElementTree completa do DPS.
+        
+        Args:
+            nfse_request: Dados da NFS-e
+            numero_dps: Número do DPS
+            now: Data/hora de emissão (Brasília)
+            
+        Returns:
+            Elemento raiz DPS
+        """
         # IMPORTANTE: Sefin Nacional NÃO aceita prefixos de namespace (erro E6155)
         # Usar namespace DEFAULT sem prefixo
         
@@ -79,41 +225,23 @@ class NFSeXMLGenerator:
         
         # Elemento infDPS (obrigatório)
         inf_dps = SubElement(root, "infDPS")
-        
-        # Gerar ID do DPS (formato: DPS + cMunEmissor(7) + tpInscr(1) + nrInscr(14) + serie(5) + nrDPS(15) = 45 chars)
-        cnpj_prestador = nfse_request.prestador.cnpj.zfill(14)
-        serie_dps = "00001"  # 5 dígitos
-        
-        # Incrementar contador a cada emissão
-        self._dps_counter += 1
-        numero_dps = str(self._dps_counter).zfill(15)  # 15 dígitos para o ID
-        numero_dps_element = str(self._dps_counter)  # Número SEM zeros à esquerda para o elemento nDPS
-        
-        id_dps = f"DPS4218707{1 if len(cnpj_prestador) == 11 else 2}{cnpj_prestador}{serie_dps}{numero_dps}"
-        inf_dps.set("Id", id_dps)
+        inf_dps.set("Id", self._id_dps(nfse_request.prestador.cnpj, numero_dps))
         
         # ORDEM CORRETA CONFORME XSD v1.01:
         # 1. tpAmb - Tipo de Ambiente (1=Produção, 2=Homologação)
         SubElement(inf_dps, "tpAmb").text = "2" if self.ambiente.value == "HOMOLOGACAO" else "1"
         
         # 2. dhEmi - Data/Hora de Emissão
-        # SEMPRE usar horário de Brasília (UTC-3) para evitar problemas com fuso horário do servidor
-        from datetime import timedelta, timezone
-        tz_brasilia = timezone(timedelta(hours=-3))
-        now = datetime.now(tz_brasilia) - timedelta(minutes=1)  # Subtrai 1 minuto de margem de segurança
-        dh_emi = now.strftime("%Y-%m-%dT%H:%M:%S%z")
-        if len(dh_emi) > 19:
-            dh_emi = dh_emi[:-2] + ':' + dh_emi[-2:]
-        SubElement(inf_dps, "dhEmi").text = dh_emi
+        SubElement(inf_dps, "dhEmi").text = self._formatar_dh_emi(now)
         
         # 3. verAplic - Versão do aplicativo emissor
         SubElement(inf_dps, "verAplic").text = "1.0.0"
         
         # 4. serie - Série do DPS
-        SubElement(inf_dps, "serie").text = serie_dps
+        SubElement(inf_dps, "serie").text = SERIE_DPS
         
         # 5. nDPS - Número do DPS (SEM zeros à esquerda!)
-        SubElement(inf_dps, "nDPS").text = numero_dps_element
+        SubElement(inf_dps, "nDPS").text = str(numero_dps)
         
         # 6. dCompet - Data de Competência (AAAA-MM-DD)
         # IMPORTANTE: Usar a mesma data base do dhEmi para evitar erro E0015
@@ -143,12 +271,7 @@ class NFSeXMLGenerator:
         valores_elem = SubElement(inf_dps, "valores")
         self._add_valores_v101(valores_elem, nfse_request.servico)
         
-        # Convertendo para string XML
-        xml_string = tostring(root, encoding="unicode", method="xml")
-        
-        # Adicionando declaração XML
-        xml_declaracao = '<?xml version="1.0" encoding="UTF-8"?>\n'
-        return xml_declaracao + xml_string
+        return root
     
     def _add_prestador_v101(self, parent: Element, prestador: PrestadorServico):
         """Adiciona dados do prestador conforme XSD v1.01."""
@@ -414,26 +537,18 @@ class NFSeXMLGenerator:
             valor_iss_calculado = base_calculo * (servico.aliquota_iss / 100)
             SubElement(valores, "ValorISS").text = f"{valor_iss_calculado:.2f}"
     
-    def comprimir_e_codificar(self, xml: str) -> str:
+    def comprimir_e_codificar(self, xml: Union[str, bytes]) -> str:
         """
         Comprime o XML em GZIP e codifica em Base64.
         
         Args:
-            xml: String XML
+            xml: String XML (ou bytes já em UTF-8)
             
         Returns:
             XML comprimido e codificado em Base64
         """
-        # Converter XML para bytes
-        xml_bytes = xml.encode('utf-8')
-        
-        # Comprimir com GZIP
-        compressed = gzip.compress(xml_bytes, compresslevel=9)
-        
-        # Codificar em Base64
-        encoded = base64.b64encode(compressed).decode('utf-8')
-        
-        return encoded
+        xml_bytes = xml.encode('utf-8') if isinstance(xml, str) else xml
+        return comprimir_bytes_b64(xml_bytes)
     
     def gerar_lote_comprimido(self, nfse_requests: list[NFSeRequest]) -> list[str]:
         """
@@ -445,18 +560,11 @@ class NFSeXMLGenerator:
         Returns:
             Lista de XMLs comprimidos em Base64
         """
-        lote_comprimido = []
-        
-        for nfse_req in nfse_requests:
-            # Gerar XML
-            xml = self.gerar_xml_nfse(nfse_req)
-            
-            # Comprimir e codificar
-            xml_comprimido = self.comprimir_e_codificar(xml)
-            
-            lote_comprimido.append(xml_comprimido)
+        if etree is None:
+            return comprimir_lote([self.gerar_xml_nfse(nfse_req) for nfse_req in nfse_requests])
         
-        return lote_comprimido
+        # Árvores do template serializadas direto no stream GZIP (pool de threads)
+        return comprimir_lote([self.gerar_dps_element(nfse_req) for nfse_req in nfse_requests])
     
     @staticmethod
     def decodificar_e_descomprimir(xml_base64: str) -> str:
@@ -492,6 +600,17 @@ class NFSeXMLGenerator:
             RuntimeError: Se signxml não estiver instalado
             ValueError: Se certificado ou chave não configurados
         """
+        self._validar_assinatura()
+        
+        try:
+            # Certificado e chave vêm do cache de material de assinatura
+            return assinar_xml_signxml(xml_string, self.cert_path, self.key_path)
+            
+        except Exception as e:
+            raise RuntimeError(f"Erro ao assinar XML: {e}") from e
+    
+    def _validar_assinatura(self):
+        """Verifica se signxml, certificado e chave estão disponíveis."""
         if not SIGNXML_AVAILABLE:
             raise RuntimeError(
                 "Biblioteca 'signxml' não instalada. "
@@ -505,87 +624,60 @@ class NFSeXMLGenerator:
             )
         
         # Verificar se arquivos existem
-        cert_file = Path(self.cert_path)
-        key_file = Path(self.key_path)
-        
-        if not cert_file.exists():
+        if not Path(self.cert_path).exists():
             raise FileNotFoundError(f"Certificado não encontrado: {self.cert_path}")
         
-        if not key_file.exists():
+        if not Path(self.key_path).exists():
             raise FileNotFoundError(f"Chave privada não encontrada: {self.key_path}")
-        
-        try:
-            # Parse XML com lxml
-            root = etree.fromstring(xml_string.encode('utf-8'))
-            
-            # Ler certificado e chave
-            with open(cert_file, 'rb') as f:
-                cert_data = f.read()
-            
-            with open(key_file, 'rb') as f:
-                key_data = f.read()
-            
-            # Encontrar o elemento infDPS que tem o atributo Id
-            inf_dps = root.find('.//{http://www.sped.fazenda.gov.br/nfse}infDPS')
-            if inf_dps is None:
-                inf_dps = root.find('.//infDPS')  # Tentar sem namespace
-            
-            if inf_dps is None:
-                raise ValueError("Elemento infDPS não encontrado no XML")
-            
-            id_dps = inf_dps.get('Id')
-            if not id_dps:
-                raise ValueError("Atributo Id não encontrado no elemento infDPS")
-            
-            # Configurar assinador XMLDSig conforme padrão NFSe Nacional
-            # A assinatura deve ser inserida dentro do elemento DPS, depois de infDPS
-            signer = XMLSigner(
-                method=methods.enveloped,
-                signature_algorithm='rsa-sha256',
-                digest_algorithm='sha256',
-                c14n_algorithm='http://www.w3.org/2001/REC-xml-c14n-20010315'
-            )
-            
-            # Assinar o elemento infDPS especificamente
-            # A assinatura será inserida após infDPS no elemento DPS
-            signed_root = signer.sign(
-                root,
-                key=key_data,
-                cert=cert_data,
-                reference_uri=id_dps  # Usar o ID sem o # - signxml adiciona automaticamente
-            )
-            
-            # Converter de volta para string
-            xml_assinado = etree.tostring(
-                signed_root,
-                encoding='unicode'
-            )
-            
-            # Adicionar declaração XML manualmente
-            xml_declaracao = '<?xml version="1.0" encoding="UTF-8"?>\n'
-            return xml_declaracao + xml_assinado
-            
-        except Exception as e:
-            raise RuntimeError(f"Erro ao assinar XML: {e}") from e
     
     def gerar_xml_assinado(self, nfse_request: NFSeRequest) -> str:
         """
         Gera e assina XML NFS-e.
         
+        A árvore lxml do template vai direto para a assinatura, sem
+        serializar e reparsear o DPS.
+        
         Args:
             nfse_request: Dados da NFS-e
             
         Returns:
             XML assinado digitalmente
         """
-        # Gerar XML
-        xml = self.gerar_xml_nfse(nfse_request)
+        if not (self.cert_path and self.key_path and SIGNXML_AVAILABLE):
+            return self.gerar_xml_nfse(nfse_request)
         
-        # Assinar se configurado
-        if self.cert_path and self.key_path and SIGNXML_AVAILABLE:
-            xml = self.assinar_xml(xml)
+        self._validar_assinatura()
+        root = self.gerar_dps_element(nfse_request)
         
-        return xml
+        try:
+            material = get_signing_material(self.cert_path, self.key_path)
+            signed_root = assinar_dps_element_signxml(root, material)
+        except Exception as e:
+            raise RuntimeError(f"Erro ao assinar XML: {e}") from e
+        
+        return XML_DECLARACAO + etree.tostring(signed_root, encoding='unicode')
+    
+    def gerar_dps_comprimido_assinado(self, nfse_request: NFSeRequest) -> str:
+        """
+        Gera, assina, comprime e codifica um DPS em uma única passada.
+        
+        O documento permanece como árvore lxml da geração até a assinatura
+        e é serializado uma só vez, direto no GZIP/Base64.
+        
+        Args:
+            nfse_request: Dados da NFS-e
+            
+        Returns:
+            DPS assinado e comprimido em Base64
+        """
+        self._validar_assinatura()
+        root = self.gerar_dps_element(nfse_request)
+        
+        try:
+            material = get_signing_material(self.cert_path, self.key_path)
+            return assinar_e_comprimir(root, material, metodo='signxml')
+        except Exception as e:
+            raise RuntimeError(f"Erro ao assinar XML: {e}") from e
     
     def gerar_lote_comprimido_assinado(self, nfse_requests: list[NFSeRequest]) -> list[str]:
         """
@@ -597,15 +689,15 @@ class NFSeXMLGenerator:
         Returns:
             Lista de XMLs assinados e comprimidos em Base64
         """
-        lote_comprimido = []
+        if not (self.cert_path and self.key_path and SIGNXML_AVAILABLE):
+            return self.gerar_lote_comprimido(nfse_requests)
         
-        for nfse_req in nfse_requests:
-            # Gerar XML assinado
-            xml = self.gerar_xml_assinado(nfse_req)
-            
-            # Comprimir e codificar
-            xml_comprimido = self.comprimir_e_codificar(xml)
-            
-            lote_comprimido.append(xml_comprimido)
+        # Gerar todos os DPS primeiro (numeração sequencial no processo atual)
+        arvores = [self.gerar_dps_element(nfse_req) for nfse_req in nfse_requests]
         
-        return lote_comprimido
+        # Assinar + comprimir em paralelo no pool (lotes pequenos ficam no processo)
+        try:
+            signing_pool = get_signing_pool(self.cert_path, self.key_path, metodo='signxml')
+            return signing_pool.sign_encode_many(arvores)
+        except Exception as e:
+            raise RuntimeError(f"Erro ao assinar XML: {e}") from e
@@ -0,0 +1,466 @@
+"""
+Assinatura digital XMLDSig de DPS e pool de processos para assinatura em lote.
+"""
+import asyncio
+import base64
+import hashlib
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from config.settings import settings
+from src.utils.logger import app_logger
+from src.utils.signing_material import SigningMaterial, get_signing_material
+from src.utils.compression import comprimir_arvore_b64
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+try:
+    from signxml import XMLSigner, methods
+    SIGNXML_AVAILABLE = True
+except ImportError:
+    SIGNXML_AVAILABLE = False
+    XMLSigner = None
+    methods = None
+
+
+NFSE_NS = 'http://www.sped.fazenda.gov.br/nfse'
+DSIG_NS = 'http://www.w3.org/2000/09/xmldsig#'
+XML_DECLARACAO = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+
+def _dsig(tag: str) -> str:
+    return f'{{{DSIG_NS}}}{tag}'
+
+
+def assinar_dps_element(root, material: SigningMaterial):
+    """
+    Assina (enveloped, Exclusive C14N, RSA-SHA256) uma árvore lxml de DPS.
+    
+    A Signature é anexada ao elemento raiz, depois de infDPS.
+    
+    Args:
+        root: Elemento raiz DPS (lxml)
+        material: Certificado e chave carregados
+    
+    Returns:
+        O mesmo elemento raiz, já assinado
+    """
+    inf_dps = root.find(f'.//{{{NFSE_NS}}}infDPS')
+    if inf_dps is None:
+        raise ValueError("Elemento infDPS não encontrado no XML")
+    id_dps = inf_dps.get('Id')
+    
+    # Canonicalizar com Exclusive C14N
+    c14n_xml = etree.tostring(inf_dps, method='c14n', exclusive=True, inclusive_ns_prefixes=None)
+    digest_b64 = base64.b64encode(hashlib.sha256(c14n_xml).digest()).decode('utf-8')
+    
+    # Criar SignedInfo
+    nsmap_sig = {None: DSIG_NS}
+    signed_info = etree.Element(_dsig('SignedInfo'), nsmap=nsmap_sig)
+    
+    etree.SubElement(signed_info, _dsig('CanonicalizationMethod')).set(
+        'Algorithm', 'http://www.w3.org/2001/10/xml-exc-c14n#'
+    )
+    etree.SubElement(signed_info, _dsig('SignatureMethod')).set(
+        'Algorithm', 'http://www.w3.org/2001/04/xmldsig-more#rsa-sha256'
+    )
+    
+    reference = etree.SubElement(signed_info, _dsig('Reference'))
+    reference.set('URI', f'#{id_dps}')
+    
+    transforms = etree.SubElement(reference, _dsig('Transforms'))
+    etree.SubElement(transforms, _dsig('Transform')).set(
+        'Algorithm', 'http://www.w3.org/2000/09/xmldsig#enveloped-signature'
+    )
+    etree.SubElement(transforms, _dsig('Transform')).set(
+        'Algorithm', 'http://www.w3.org/2001/10/xml-exc-c14n#'
+    )
+    
+    etree.SubElement(reference, _dsig('DigestMethod')).set(
+        'Algorithm', 'http://www.w3.org/2001/04/xmlenc#sha256'
+    )
+    etree.SubElement(reference, _dsig('DigestValue')).text = digest_b64
+    
+    # Canonicalizar SignedInfo e assinar
+    c14n_signed_info = etree.tostring(signed_info, method='c14n', exclusive=True, inclusive_ns_prefixes=None)
+    signature = material.private_key.sign(c14n_signed_info, padding.PKCS1v15(), hashes.SHA256())
+    
+    # Montar Signature
+    signature_elem = etree.Element(_dsig('Signature'), nsmap=nsmap_sig)
+    signature_elem.append(signed_info)
+    etree.SubElement(signature_elem, _dsig('SignatureValue')).text = base64.b64encode(signature).decode('utf-8')
+    
+    # KeyInfo
+    key_info = etree.SubElement(signature_elem, _dsig('KeyInfo'))
+    x509_data = etree.SubElement(key_info, _dsig('X509Data'))
+    etree.SubElement(x509_data, _dsig('X509Certificate')).text = material.x509_certificate_text
+    
+    root.append(signature_elem)
+    return root
+
+
+def assinar_xml_exclusive_c14n(xml_string: str, cert_path: str, key_path: str) -> str:
+    """Assina XML com Exclusive C14N (método que funciona)."""
+    root = etree.fromstring(xml_string.encode('utf-8'))
+    material = get_signing_material(cert_path, key_path)
+    assinar_dps_element(root, material)
+    return XML_DECLARACAO + etree.tostring(root, encoding='unicode')
+
+
+def assinar_dps_element_signxml(root, material: SigningMaterial):
+    """
+    Assina via signxml (C14N inclusivo) uma árvore lxml de DPS.
+    
+    Args:
+        root: Elemento raiz DPS (lxml)
+        material: Certificado e chave carregados
+    
+    Returns:
+        Elemento raiz assinado (retornado pelo signxml)
+    """
+    # Encontrar o elemento infDPS que tem o atributo Id
+    inf_dps = root.find(f'.//{{{NFSE_NS}}}infDPS')
+    if inf_dps is None:
+        inf_dps = root.find('.//infDPS')  # Tentar sem namespace
+    
+    if inf_dps is None:
+        raise ValueError("Elemento infDPS não encontrado no XML")
+    
+    id_dps = inf_dps.get('Id')
+    if not id_dps:
+        raise ValueError("Atributo Id não encontrado no elemento infDPS")
+    
+    # A assinatura deve ser inserida dentro do elemento DPS, depois de infDPS
+    signer = XMLSigner(
+        method=methods.enveloped,
+        signature_algorithm='rsa-sha256',
+        digest_algorithm='sha256',
+        c14n_algorithm='http://www.w3.org/2001/REC-xml-c14n-20010315'
+    )
+    
+    return signer.sign(
+        root,
+        key=material.private_key,
+        cert=material.cert_pem_text,
+        reference_uri=id_dps  # Usar o ID sem o # - signxml adiciona automaticamente
+    )
+
+
+def assinar_xml_signxml(xml_string: str, cert_path: str, key_path: str) -> str:
+    """
+    Assina XML via signxml (C14N inclusivo), usado por NFSeXMLGenerator.
+    
+    Args:
+        xml_string: XML DPS
+        cert_path: Caminho do cert.pem
+        key_path: Caminho do key.pem
+    
+    Returns:
+        XML assinado com declaração
+    """
+    material = get_signing_material(cert_path, key_path)
+    root = etree.fromstring(xml_string.encode('utf-8'))
+    signed_root = assinar_dps_element_signxml(root, material)
+    return XML_DECLARACAO + etree.tostring(signed_root, encoding='unicode')
+
+
+# Métodos de assinatura disponíveis para o pool
+SIGNERS: Dict[str, Callable[[str, str, str], str]] = {
+    'exc_c14n': assinar_xml_exclusive_c14n,
+    'signxml': assinar_xml_signxml,
+}
+
+# Mesmos métodos, operando direto sobre a árvore lxml
+ELEMENT_SIGNERS: Dict[str, Callable] = {
+    'exc_c14n': assinar_dps_element,
+    'signxml': assinar_dps_element_signxml,
+}
+
+
+def assinar_e_comprimir(dps, material: SigningMaterial, metodo: str = 'exc_c14n') -> str:
+    """
+    Pipeline de uma nota: assina a árvore e a serializa uma única vez no GZIP/Base64.
+    
+    Args:
+        dps: Árvore lxml do DPS ou seus bytes UTF-8 (parseados uma vez)
+        material: Certificado e chave carregados
+        metodo: 'exc_c14n' ou 'signxml'
+    
+    Returns:
+        DPS assinado, comprimido e em Base64, pronto para envio
+    """
+    root = etree.fromstring(dps) if isinstance(dps, bytes) else dps
+    signed_root = ELEMENT_SIGNERS[metodo](root, material)
+    return comprimir_arvore_b64(signed_root)
+
+
+# ==================== Pool de processos ====================
+
+# Estado de cada processo worker (definido pelo initializer)
+_worker_cert_path: Optional[str] = None
+_worker_key_path: Optional[str] = None
+_worker_metodo: Optional[str] = None
+
+
+def _init_worker(cert_path: str, key_path: str, metodo: str) -> None:
+    """Initializer do worker: pré-carrega a chave uma única vez por processo."""
+    global _worker_cert_path, _worker_key_path, _worker_metodo
+    _worker_cert_path = cert_path
+    _worker_key_path = key_path
+    _worker_metodo = metodo
+    get_signing_material(cert_path, key_path)
+
+
+def _sign_chunk(xmls: List[str]) -> List[str]:
+    """Assina um bloco de XMLs dentro do worker."""
+    signer = SIGNERS[_worker_metodo]
+    return [signer(xml, _worker_cert_path, _worker_key_path) for xml in xmls]
+
+
+def _sign_encode_chunk(dps_bytes: List[bytes]) -> List[str]:
+    """Assina e comprime um bloco de DPS (bytes) dentro do worker."""
+    material = get_signing_material(_worker_cert_path, _worker_key_path)
+    return [assinar_e_comprimir(dps, material, _worker_metodo) for dps in dps_bytes]
+
+
+def _como_bytes(dps_list: List) -> List[bytes]:
+    """Serializa (uma vez) as árvores lxml para envio aos workers."""
+    return [dps if isinstance(dps, bytes) else etree.tostring(dps, encoding='UTF-8') for dps in dps_list]
+
+
+class SigningPool:
+    """
+    Pool de processos para assinatura XMLDSig em lote.
+    
+    Cada worker carrega certificado e chave no initializer; os XMLs são
+    enviados em blocos (chunks) para reduzir overhead de IPC. A ordem dos
+    resultados é sempre a mesma da entrada.
+    """
+    
+    def __init__(
+        self,
+        cert_path: str,
+        key_path: str,
+        metodo: str = 'exc_c14n',
+        max_workers: Optional[int] = None,
+        chunk_size: Optional[int] = None
+    ):
+        """
+        Args:
+            cert_path: Caminho do cert.pem
+            key_path: Caminho do key.pem
+            metodo: 'exc_c14n' (Exclusive C14N) ou 'signxml'
+            max_workers: Processos (padrão: settings.SIGNING_POOL_WORKERS ou nº de CPUs)
+            chunk_size: XMLs por bloco enviado a um worker
+        """
+        if metodo not in SIGNERS:
+            raise ValueError(f"Método de assinatura desconhecido: {metodo}")
+        
+        self.cert_path = cert_path
+        self.key_path = key_path
+        self.metodo = metodo
+        self.max_workers = max_workers or settings.SIGNING_POOL_WORKERS or os.cpu_count() or 1
+        self.chunk_size = max(1, chunk_size or settings.SIGNING_POOL_CHUNK_SIZE)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # DPS avulsos aguardando a janela de agrupamento, por event loop
+        self._pendentes: Dict[asyncio.AbstractEventLoop, List[tuple]] = {}
+        self._tarefas: set = set()
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # 'spawn' evita fork de um processo com threads (Streamlit/event loop)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.cert_path, self.key_path, self.metodo)
+            )
+            app_logger.info(f"Pool de assinatura iniciado com {self.max_workers} processo(s)")
+        return self._executor
+    
+    def _chunks(self, xmls: List[str]) -> List[List[str]]:
+        # Divide de forma que todos os workers recebam trabalho em lotes menores
+        tamanho = min(self.chunk_size, max(1, (len(xmls) + self.max_workers - 1) // self.max_workers))
+        return [xmls[i:i + tamanho] for i in range(0, len(xmls), tamanho)]
+    
+    def _map_chunks(self, funcao: Callable[[List], List[str]], itens: List) -> List[str]:
+        """Distribui os itens em blocos entre os workers e junta os resultados em ordem."""
+        resultados: List[str] = []
+        for bloco in self._get_executor().map(funcao, self._chunks(itens)):
+            resultados.extend(bloco)
+        return resultados
+    
+    async def _map_chunks_async(self, funcao: Callable[[List], List[str]], itens: List) -> List[str]:
+        """Versão assíncrona de _map_chunks, sem bloquear o event loop."""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        blocos = await asyncio.gather(*[
+            loop.run_in_executor(executor, funcao, bloco)
+            for bloco in self._chunks(itens)
+        ])
+        return [resultado for bloco in blocos for resultado in bloco]
+    
+    def sign_many(self, xmls: List[str]) -> List[str]:
+        """
+        Assina vários XMLs em paralelo.
+        
+        Lotes pequenos (< settings.SIGNING_POOL_MIN_BATCH) são assinados no
+        próprio processo, onde o custo de IPC não compensa.
+        
+        Args:
+            xmls: XMLs DPS não assinados
+        
+        Returns:
+            XMLs assinados, na mesma ordem
+        """
+        if not xmls:
+            return []
+        
+        if len(xmls) < settings.SIGNING_POOL_MIN_BATCH or self.max_workers == 1:
+            signer = SIGNERS[self.metodo]
+            return [signer(xml, self.cert_path, self.key_path) for xml in xmls]
+        
+        return self._map_chunks(_sign_chunk, xmls)
+    
+    async def sign_many_async(self, xmls: List[str]) -> List[str]:
+        """
+        Versão assíncrona de sign_many, sem bloquear o event loop.
+        
+        Args:
+            xmls: XMLs DPS não assinados
+        
+        Returns:
+            XMLs assinados, na mesma ordem
+        """
+        if not xmls:
+            return []
+        
+        if len(xmls) < settings.SIGNING_POOL_MIN_BATCH or self.max_workers == 1:
+            return await asyncio.to_thread(self.sign_many, xmls)
+        
+        return await self._map_chunks_async(_sign_chunk, xmls)
+    
+    def sign_encode_many(self, dps_list: List) -> List[str]:
+        """
+        Assina, comprime e codifica vários DPS (pipeline sem round trip de string).
+        
+        Abaixo de settings.SIGNING_POOL_MIN_BATCH as árvores lxml são assinadas
+        no próprio processo sem reparse; acima disso são serializadas uma vez
+        para bytes e enviadas aos workers.
+        
+        Args:
+            dps_list: Árvores lxml (ou bytes UTF-8) de DPS não assinados
+        
+        Returns:
+            Payloads GZIP + Base64, na mesma ordem
+        """
+        if not dps_list:
+            return []
+        
+        if len(dps_list) < settings.SIGNING_POOL_MIN_BATCH or self.max_workers == 1:
+            material = get_signing_material(self.cert_path, self.key_path)
+            return [assinar_e_comprimir(dps, material, self.metodo) for dps in dps_list]
+        
+        return self._map_chunks(_sign_encode_chunk, _como_bytes(dps_list))
+    
+    async def sign_encode_many_async(self, dps_list: List) -> List[str]:
+        """
+        Versão assíncrona de sign_encode_many, sem bloquear o event loop.
+        
+        Lotes pequenos são assinados em uma thread sobre a própria árvore
+        lxml; os maiores vão aos workers.
+        
+        Args:
+            dps_list: Árvores lxml (ou bytes UTF-8) de DPS não assinados
+        
+        Returns:
+            Payloads GZIP + Base64, na mesma ordem
+        """
+        if not dps_list:
+            return []
+        
+        if len(dps_list) < settings.SIGNING_POOL_MIN_BATCH or self.max_workers == 1:
+            return await asyncio.to_thread(self.sign_encode_many, dps_list)
+        
+        return await self._map_chunks_async(_sign_encode_chunk, _como_bytes(dps_list))
+    
+    async def sign_encode_async(self, dps) -> str:
+        """
+        Assina e comprime um único DPS, agrupando chamadas concorrentes.
+        
+        Cada emissão (ex.: os jobs em voo do EmissionWorker) assina um DPS por
+        vez. Os que chegam dentro de settings.SIGNING_POOL_JANELA_MS formam um
+        grupo: um DPS sozinho é assinado em thread, como em sign_encode_many_async;
+        dois ou mais são repartidos entre os processos do pool.
+        
+        Args:
+            dps: Árvore lxml (ou bytes UTF-8) do DPS não assinado
+        
+        Returns:
+            Payload GZIP + Base64
+        """
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        pendentes = self._pendentes.setdefault(loop, [])
+        pendentes.append((dps, futuro))
+        
+        if len(pendentes) == 1:
+            loop.call_later(settings.SIGNING_POOL_JANELA_MS / 1000, self._despachar_grupo, loop)
+        
+        return await futuro
+    
+    def _despachar_grupo(self, loop: asyncio.AbstractEventLoop) -> None:
+        grupo = self._pendentes.pop(loop, [])
+        if grupo:
+            tarefa = loop.create_task(self._assinar_grupo(grupo))
+            self._tarefas.add(tarefa)
+            tarefa.add_done_callback(self._tarefas.discard)
+    
+    async def _assinar_grupo(self, grupo: List[tuple]) -> None:
+        dps_list = [dps for dps, _ in grupo]
+        try:
+            if len(dps_list) == 1 or self.max_workers == 1:
+                payloads = await asyncio.to_thread(self.sign_encode_many, dps_list)
+            else:
+                payloads = await self._map_chunks_async(_sign_encode_chunk, _como_bytes(dps_list))
+        except Exception as e:
+            for _, futuro in grupo:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+        
+        for (_, futuro), payload in zip(grupo, payloads):
+            if not futuro.done():
+                futuro.set_result(payload)
+    
+    def close(self) -> None:
+        """Encerra os processos do pool."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+    
+    def __enter__(self) -> "SigningPool":
+        return self
+    
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+# Pools globais por (certificado, chave, método)
+_signing_pools: Dict[tuple, SigningPool] = {}
+
+
+def get_signing_pool(cert_path: str, key_path: str, metodo: str = 'exc_c14n') -> SigningPool:
+    """Retorna o pool de assinatura compartilhado para o par certificado/chave."""
+    chave = (cert_path, key_path, metodo)
+    if chave not in _signing_pools:
+        _signing_pools[chave] = SigningPool(cert_path, key_path, metodo=metodo)
+    return _signing_pools[chave]